@@ -0,0 +1,354 @@
+import asyncio
+import json
+import re
+import sys
+from urllib.parse import urlsplit, parse_qsl
+
+from sqlalchemy import event, select, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from models import Employee, Device, DeviceHolder
+from db import DATABASE_URI, set_sqlite_pragmas, set_statement_timeout
+from usage import EmployeeUsageScript
+from settings import get_setting
+from validators import name_error, email_error
+
+API_HOST = get_setting("host", "127.0.0.1", env="API_HOST", section="api")
+API_PORT = int(get_setting("port", 8080, env="API_PORT", section="api"))
+API_POOL_SIZE = int(get_setting("pool_size", 10, env="API_POOL_SIZE", section="api"))
+API_MAX_OVERFLOW = int(get_setting("max_overflow", 0, env="API_MAX_OVERFLOW", section="api"))
+
+# The async driver of the configured database, e.g. sqlite:///database.db -> sqlite+aiosqlite:///database.db.
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+MAX_BODY_SIZE = 64 * 1024
+
+STATUS_TEXT = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+def async_database_uri(uri=DATABASE_URI):
+    """Replaces the driver of a database URI with its async driver."""
+
+    scheme, separator, rest = uri.partition("://")
+    return ASYNC_DRIVERS.get(scheme.split("+")[0], scheme) + separator + rest
+
+
+# A bounded pool of connections shared by all requests, requests wait for a free connection.
+async_engine = create_async_engine(
+    async_database_uri(), poolclass=AsyncAdaptedQueuePool, pool_size=API_POOL_SIZE, max_overflow=API_MAX_OVERFLOW
+)
+event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+event.listen(async_engine.sync_engine, "connect", set_statement_timeout)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+class HTTPError(Exception):
+    """An error returned to the client as a JSON response."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def employee_to_dict(employee):
+    return {
+        "id": str(employee.id),
+        "first_name": employee.first_name,
+        "last_name": employee.last_name,
+        "email": employee.email,
+        "code": employee.code,
+    }
+
+
+def device_to_dict(device):
+    return {
+        "id": str(device.id),
+        "description": device.description,
+        "brand": device.brand.value[1],
+        "type": device.type.value[1],
+        "code": device.code,
+    }
+
+
+def usage_script(session):
+    """Creates an EmployeeUsageScript working on the sync side of an async session."""
+
+    script = EmployeeUsageScript()
+    script.session = session
+    return script
+
+
+async def get_employee(session, code, query, body):
+    """GET /employees/{code}"""
+
+    employee = await session.scalar(select(Employee).where(Employee.code == code))
+    if employee is None:
+        raise HTTPError(404, f"Employee {code} - not found!")
+    return 200, employee_to_dict(employee)
+
+
+async def check_employee_unique(session, code, email):
+    """Raises a 409 error if the code or the email belongs to an employee."""
+
+    existing = (await session.execute(
+        select(Employee.code, Employee.email).where(or_(Employee.code == code, Employee.email == email))
+    )).first()
+    if existing and existing.code == code:
+        raise HTTPError(409, "This code is already in use. Please try a different one.")
+    if existing:
+        raise HTTPError(409, "This email is already used by another employee. Please enter a different email.")
+
+
+async def add_employee(session, query, body):
+    """POST /employees with first_name, last_name, email and code."""
+
+    first_name = str(body.get("first_name") or "").strip().title()
+    last_name = str(body.get("last_name") or "").strip().title()
+    email = str(body.get("email") or "").strip()
+    code = str(body.get("code") or "").strip()
+
+    error = name_error("First name", first_name) or name_error("Last name", last_name) or email_error(email)
+    if error:
+        raise HTTPError(400, error)
+    if not code:
+        raise HTTPError(400, "Invalid code.")
+
+    await check_employee_unique(session, code, email)
+
+    employee = Employee(first_name=first_name, last_name=last_name, email=email, code=code)
+    session.add(employee)
+    try:
+        await session.commit()
+    except IntegrityError:
+        # Another request added the code or email after the check, it gets the same answer.
+        await session.rollback()
+        await check_employee_unique(session, code, email)
+        raise
+    return 201, employee_to_dict(employee)
+
+
+async def get_device(session, code, query, body):
+    """GET /devices/{code} with the code of the employee that holds it."""
+
+    row = (await session.execute(
+        select(Device, Employee.code)
+        .outerjoin(DeviceHolder, DeviceHolder.device_id == Device.id)
+        .outerjoin(Employee, Employee.id == DeviceHolder.employee_id)
+        .where(Device.code == code)
+    )).first()
+    if row is None:
+        raise HTTPError(404, f"Device {code} - not found!")
+    return 200, {**device_to_dict(row[0]), "holder": row[1]}
+
+
+async def get_usages(session, code, query, body):
+    """GET /employees/{code}/usages?type=in|out&limit=N&after=DATE&after_id=ID"""
+
+    search_type = query.get("type")
+    if search_type not in (None, "in", "out"):
+        raise HTTPError(400, f"Invalid type: {search_type}. Valid types: in, out.")
+
+    def load(sync_session):
+        script = usage_script(sync_session)
+        if not script.load_employee(code):
+            raise HTTPError(404, f"Employee {code} - not found!")
+        script.options = {name: query[name] for name in ("limit", "after", "after_id") if name in query}
+        try:
+            return script.get_usages_with_device_info(search_type=search_type).all()
+        except ValueError as error:
+            raise HTTPError(400, str(error))
+
+    rows = await session.run_sync(load)
+    return 200, [
+        {
+            "id": str(row.id),
+            "date": row.date.isoformat(),
+            "type": row.type.value[1],
+            "device_description": row.description,
+            "device_brand": row.brand.value[1],
+            "device_type": row.device_type.value[1],
+            "device_code": row.code,
+        }
+        for row in rows
+    ]
+
+
+async def check_in_or_out(session, query, body, action):
+    """Loads the employee and device of the request body and checks the device in or out."""
+
+    employee_code = str(body.get("employee_code") or "").strip()
+    device_code = str(body.get("device_code") or "").strip()
+    if not employee_code or not device_code:
+        raise HTTPError(400, "employee_code and device_code are required.")
+
+    def run(sync_session):
+        script = usage_script(sync_session)
+        if not script.load_employee(employee_code, cached=False):
+            raise HTTPError(404, f"Employee {employee_code} - not found!")
+        if not script.load_device(device_code, cached=False):
+            raise HTTPError(404, f"Device {device_code} - not found!")
+        return script.check_in_device() if action == "check_in" else script.check_out_device()
+
+    ok, message = await session.run_sync(run)
+    if not ok:
+        raise HTTPError(409, message)
+    return 200, {"message": message}
+
+
+async def check_in(session, query, body):
+    """POST /check_in with employee_code and device_code."""
+
+    return await check_in_or_out(session, query, body, "check_in")
+
+
+async def check_out(session, query, body):
+    """POST /check_out with employee_code and device_code."""
+
+    return await check_in_or_out(session, query, body, "check_out")
+
+
+# (method, path pattern, handler), the groups of the pattern are passed to the handler.
+ROUTES = [
+    ("GET", re.compile(r"^/employees/([^/]+)$"), get_employee),
+    ("POST", re.compile(r"^/employees$"), add_employee),
+    ("GET", re.compile(r"^/employees/([^/]+)/usages$"), get_usages),
+    ("GET", re.compile(r"^/devices/([^/]+)$"), get_device),
+    ("POST", re.compile(r"^/check_in$"), check_in),
+    ("POST", re.compile(r"^/check_out$"), check_out),
+]
+
+
+async def dispatch(method, target, body):
+    """
+    Runs the handler of a request.
+
+    Returns:
+        tuple: (status code, JSON serializable payload).
+    """
+    url = urlsplit(target)
+    query = dict(parse_qsl(url.query))
+
+    allowed = False
+    for route_method, pattern, handler in ROUTES:
+        match = pattern.match(url.path)
+        if not match:
+            continue
+        if route_method != method:
+            allowed = True
+            continue
+
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            return 400, {"error": "The body is not valid JSON."}
+        if not isinstance(data, dict):
+            return 400, {"error": "The body must be a JSON object."}
+
+        async with AsyncSessionLocal() as session:
+            try:
+                return await handler(session, *match.groups(), query, data)
+            except HTTPError as error:
+                await session.rollback()
+                return error.status, {"error": error.message}
+
+    if allowed:
+        return 405, {"error": f"Method {method} not allowed."}
+    return 404, {"error": f"Not found: {url.path}"}
+
+
+async def read_request(reader):
+    """
+    Reads one HTTP/1.1 request.
+
+    Returns:
+        tuple | None: (method, target, headers, body) or None when the client closed the connection.
+    """
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+
+    method, target, version = request_line.decode("latin-1").split()
+    headers = {"version": version}
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_BODY_SIZE:
+        raise HTTPError(413, "The body is too large.")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target, headers, body
+
+
+def write_response(writer, status, payload, keep_alive):
+    """Writes a JSON response."""
+
+    body = json.dumps(payload).encode()
+    writer.write(
+        f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+    )
+
+
+async def handle_connection(reader, writer):
+    """Serves the requests of one client connection, keeping it open between requests."""
+
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except (ValueError, HTTPError) as error:
+                status, message = (error.status, error.message) if isinstance(error, HTTPError) else (400, "Bad request.")
+                write_response(writer, status, {"error": message}, keep_alive=False)
+                break
+            if request is None:
+                break
+
+            method, target, headers, body = request
+            try:
+                status, payload = await dispatch(method, target, body)
+            except Exception as error:
+                print(f"{method} {target} failed: {error!r}", file=sys.stderr)
+                status, payload = 500, {"error": "Internal server error."}
+
+            keep_alive = headers["version"] == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+            write_response(writer, status, payload, keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host=API_HOST, port=API_PORT):
+    """Starts the HTTP API."""
+
+    server = await asyncio.start_server(handle_connection, host, port)
+    print(f"Listening on http://{host}:{port}, stop with Ctrl+C.", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
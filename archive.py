@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, insert, delete, func, and_
+from models import Usage, UsageArchive
+from choices import UsageCheck
+from settings import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE
+
+ARCHIVE_COLUMNS = ("id", "date", "employee_id", "device_id", "type", "checked_out_at")
+
+
+def archive_cutoff(days=ARCHIVE_AFTER_DAYS, now=None):
+    """Returns the check out time before which closed usages are archived, in UTC as the usage dates."""
+
+    return (now or datetime.utcnow()) - timedelta(days=days)
+
+
+def archive_usages(engine, cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Moves usages checked out before the cutoff from the usage table to the usage archive.
+
+    The age of a usage is measured from its check out, so a device returned yesterday after a
+    long usage stays in the usage table. Usages are moved in check out order, each batch in
+    its own short transaction, so kiosks are not blocked for the whole run. A batch ends at a
+    check out time, usages checked out at the same time as the last one of the batch are moved
+    with it. Open usages are never archived.
+
+    Args:
+        engine (Engine): The engine of the database.
+        cutoff (datetime): Only usages checked out before this time are archived.
+        batch_size (int): The number of usages moved per transaction.
+
+    Returns:
+        int: The number of archived usages.
+    """
+    closed = and_(Usage.type == UsageCheck.CHECK_OUT, Usage.checked_out_at < cutoff)
+    archived = 0
+
+    while True:
+        with engine.begin() as connection:
+            batch_end = connection.scalar(
+                select(Usage.checked_out_at).where(closed).order_by(Usage.checked_out_at)
+                .offset(batch_size - 1).limit(1)
+            )
+            batch = closed if batch_end is None else and_(closed, Usage.checked_out_at <= batch_end)
+
+            connection.execute(
+                insert(UsageArchive).from_select(
+                    ARCHIVE_COLUMNS, select(*(getattr(Usage, name) for name in ARCHIVE_COLUMNS)).where(batch)
+                )
+            )
+            archived += connection.execute(delete(Usage).where(batch)).rowcount
+
+        if batch_end is None:
+            return archived
+
+
+def reaches_archive(bind, after=None, employee_id=None):
+    """
+    Checks whether a history starting after a date may hold archived usages.
+
+    Args:
+        bind (Session | Connection): The session or connection to query.
+        after (datetime | None): The start of the history, the whole history if None.
+        employee_id (UUID | None): Only the archive of this employee.
+
+    Returns:
+        bool: True if archived usages newer than the start exist.
+    """
+    query = select(func.max(UsageArchive.date))
+    if employee_id is not None:
+        query = query.where(UsageArchive.employee_id == employee_id)
+
+    archived_until = bind.scalar(query)
+    return archived_until is not None and (after is None or after < archived_until)
@@ -0,0 +1,208 @@
+import csv
+import uuid
+from datetime import datetime
+
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.exc import IntegrityError, OperationalError
+from models import Employee, Device, Usage, DeviceHolder
+from choices import UsageCheck
+from importer import chunks, IN_CHUNK_SIZE
+from lookups import find_ids, cache
+
+ACTIONS = {
+    "check_in": "check_in",
+    "in": "check_in",
+    "check_out": "check_out",
+    "out": "check_out",
+}
+
+
+def read_scans(file):
+    """
+    Reads scans from a CSV file with employee_code, device_code, action columns.
+
+    A header row is skipped when its action column is "action".
+
+    Args:
+        file (file): An open text file or sys.stdin.
+
+    Yields:
+        tuple: (line number, employee code, device code, action or None if unknown).
+    """
+    for line_number, row in enumerate(csv.reader(file), start=1):
+        row = [value.strip() for value in row]
+        if not any(row):
+            continue
+        if line_number == 1 and len(row) == 3 and row[2].lower() == "action":
+            continue
+
+        if len(row) != 3:
+            yield line_number, None, None, None
+            continue
+
+        employee_code, device_code, action = row
+        yield line_number, employee_code, device_code, ACTIONS.get(action.lower())
+
+
+def load_holders(session, device_ids, from_usages=False):
+    """
+    Loads the current holders of the devices.
+
+    Args:
+        session (Session): The database session.
+        device_ids (iterable): The devices.
+        from_usages (bool): If True, the holders are read from the open usages, which the unique
+            index of open usages keeps consistent, instead of the device holder table.
+
+    Returns:
+        dict: Device id -> {"employee_id", "usage_id"}.
+    """
+    holders = {}
+    for chunk in chunks(device_ids, IN_CHUNK_SIZE):
+        if from_usages:
+            query = select(Usage.device_id, Usage.employee_id, Usage.id.label("usage_id")).where(
+                Usage.type == UsageCheck.CHECK_IN, Usage.device_id.in_(chunk))
+        else:
+            query = select(DeviceHolder.device_id, DeviceHolder.employee_id, DeviceHolder.usage_id).where(
+                DeviceHolder.device_id.in_(chunk))
+        for holder in session.execute(query):
+            holders[holder.device_id] = {"employee_id": holder.employee_id, "usage_id": holder.usage_id}
+    return holders
+
+
+class StaleHolders(Exception):
+    """Another process checked out a device of the batch after its holders were loaded."""
+
+
+def apply_scans(session, scans, attempts=3):
+    """
+    Checks in and checks out a batch of scans in one transaction.
+
+    The batch is checked again against freshly loaded holders and retried when another kiosk
+    changed one of its devices after the holders were loaded: the unique index of open usages
+    rejects a concurrent check in, the check out only closes usages that are still open. A
+    retry reads the holders from the open usages, so a device holder row that does not match
+    them cannot fail every attempt. A locked database is retried too. Cached codes are looked up again on a retry, another
+    process may have deleted their rows.
+
+    Args:
+        session (Session): The database session, committed on success.
+        scans (iterable): (line number, employee code, device code, action) tuples.
+        attempts (int): How many times the batch is tried.
+
+    Returns:
+        list: (line number, ok (bool), message) tuples in input order.
+
+    Raises:
+        ValueError: If the batch could not be applied in any attempt, nothing was written.
+    """
+    scans = list(scans)
+    for attempt in range(attempts):
+        try:
+            return apply_scans_once(session, scans, from_usages=attempt > 0)
+        except (IntegrityError, OperationalError, StaleHolders) as error:
+            session.rollback()
+            cache.clear()
+            if attempt == attempts - 1:
+                reason = "the devices kept changing" if isinstance(error, StaleHolders) else error.orig
+                raise ValueError(f"The batch was not applied after {attempts} attempts, {reason}.")
+
+
+def apply_scans_once(session, scans, from_usages=False):
+    """
+    Checks in and checks out a batch of scans in one transaction.
+
+    The codes and current holders are loaded with a few set based queries, not from the lookup
+    cache, so no usage is written for an employee or device another process deleted. The
+    scans are then checked in order against the in-memory device state, so a device can be
+    checked out and checked in again within one batch. Accepted changes are written with bulk statements.
+
+    Args:
+        session (Session): The database session, committed on success.
+        scans (iterable): (line number, employee code, device code, action) tuples.
+        from_usages (bool): If True, the holders are read from the open usages, see load_holders.
+
+    Returns:
+        list: (line number, ok (bool), message) tuples in input order.
+
+    Raises:
+        StaleHolders: If a usage the batch checks out was closed by another process.
+    """
+    employee_codes = {scan[1] for scan in scans if scan[1]}
+    device_codes = {scan[2] for scan in scans if scan[2]}
+    employees = find_ids(session, Employee, "code", employee_codes, IN_CHUNK_SIZE, cached=False)
+    devices = find_ids(session, Device, "code", device_codes, IN_CHUNK_SIZE, cached=False)
+    holders = load_holders(session, set(devices.values()), from_usages=from_usages)
+
+    new_usages = {}
+    closed_usage_ids = []
+    results = []
+
+    for line_number, employee_code, device_code, action in scans:
+        if action is None:
+            results.append((line_number, False, "Invalid line, expected: employee_code,device_code,check_in|check_out"))
+            continue
+
+        employee_id, device_id = employees.get(employee_code), devices.get(device_code)
+        if employee_id is None:
+            results.append((line_number, False, f"Employee {employee_code} - not found!"))
+            continue
+        if device_id is None:
+            results.append((line_number, False, f"Device {device_code} - not found!"))
+            continue
+
+        holder = holders.get(device_id)
+        if action == "check_in":
+            if holder is not None:
+                results.append((line_number, False, f"Device <{device_code}> - already checked in!"))
+                continue
+
+            usage_id = uuid.uuid4()
+            new_usages[usage_id] = {
+                "id": usage_id,
+                "date": datetime.utcnow(),
+                "employee_id": employee_id,
+                "device_id": device_id,
+                "type": UsageCheck.CHECK_IN,
+                "checked_out_at": None,
+            }
+            holders[device_id] = {"employee_id": employee_id, "usage_id": usage_id}
+            results.append((line_number, True, f"Employee <{employee_code}> checked in device <{device_code}>."))
+        else:
+            if holder is None or holder["employee_id"] != employee_id:
+                results.append((line_number, False,
+                                f"Employee <{employee_code}> has not checked in device <{device_code}>."))
+                continue
+
+            if holder["usage_id"] in new_usages:
+                new_usages[holder["usage_id"]].update(type=UsageCheck.CHECK_OUT, checked_out_at=datetime.utcnow())
+            else:
+                closed_usage_ids.append(holder["usage_id"])
+            del holders[device_id]
+            results.append((line_number, True, f"Employee <{employee_code}> checked out device <{device_code}>."))
+
+    checked_out_at = datetime.utcnow()
+    for chunk in chunks(closed_usage_ids, IN_CHUNK_SIZE):
+        # Only usages still open are closed, the holders were read before the transaction wrote anything.
+        closed = session.execute(
+            update(Usage).where(Usage.id.in_(chunk), Usage.type == UsageCheck.CHECK_IN)
+            .values(type=UsageCheck.CHECK_OUT, checked_out_at=checked_out_at)
+            .returning(Usage.id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if len(closed) != len(chunk):
+            raise StaleHolders()
+        session.execute(delete(DeviceHolder).where(DeviceHolder.usage_id.in_(chunk)))
+
+    if new_usages:
+        session.execute(insert(Usage), list(new_usages.values()))
+        new_holders = [
+            {"device_id": usage["device_id"], "employee_id": usage["employee_id"],
+             "usage_id": usage["id"], "since": usage["date"]}
+            for usage in new_usages.values() if usage["type"] == UsageCheck.CHECK_IN
+        ]
+        if new_holders:
+            session.execute(insert(DeviceHolder), new_holders)
+
+    session.commit()
+    return results
@@ -0,0 +1,333 @@
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import time
+import uuid
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+import sqlalchemy
+from sqlalchemy import create_engine, event, insert, select, func
+from sqlalchemy.orm import sessionmaker
+
+import db
+from batch import apply_scans
+from bulk import delete_employees
+from choices import BrandType, DeviceType, UsageCheck
+from cli import parse_options
+from devices import DeviceScript
+from employees import EmployeeScript
+from migrations import create_schema, backfill_checked_out_at
+from models import Employee, Device, Usage, DeviceHolder
+from usage import EmployeeUsageScript
+
+# Dataset sizes: (employees, devices, usages).
+SIZES = {
+    "tiny": (1_000, 500, 10_000),
+    "small": (10_000, 5_000, 100_000),
+    "medium": (100_000, 50_000, 1_000_000),
+    "large": (100_000, 50_000, 10_000_000),
+}
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_data")
+INSERT_CHUNK_SIZE = 10_000
+# Share of devices that are checked in at the end of the generated history.
+CHECKED_IN_SHARE = 0.3
+START_DATE = datetime(2020, 1, 1)
+
+
+def make_engine(path):
+    """Creates an engine for a dataset file with the pragmas of the active engine profile."""
+
+    engine = create_engine(f"sqlite:///{path}")
+    event.listen(engine, "connect", db.set_sqlite_pragmas)
+    return engine
+
+
+def random_uuid(rng):
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def insert_chunks(connection, table, rows):
+    """Inserts rows from a generator with executemany in chunks."""
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == INSERT_CHUNK_SIZE:
+            connection.execute(insert(table), chunk)
+            chunk = []
+    if chunk:
+        connection.execute(insert(table), chunk)
+
+
+def generate(path, employees, devices, usages, seed=42):
+    """
+    Generates a deterministic dataset.
+
+    Every usage is a closed check in of a random device by a random employee, dates grow
+    over the history. At the end a share of the devices is checked in again and held.
+
+    Args:
+        path (str): The SQLite file to create.
+        employees (int): The number of employees.
+        devices (int): The number of devices.
+        usages (int): The number of usages.
+        seed (int): The random seed, the same seed gives the same dataset.
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+
+    rng = random.Random(seed)
+    employee_ids = [random_uuid(rng) for _ in range(employees)]
+    device_ids = [random_uuid(rng) for _ in range(devices)]
+    brands, device_types = list(BrandType), list(DeviceType)
+
+    engine = make_engine(path)
+    create_schema(engine)
+
+    with engine.begin() as connection:
+        insert_chunks(connection, Employee, (
+            {"id": employee_id, "first_name": f"First{index}", "last_name": f"Last{index}",
+             "email": f"employee{index}@example.com", "code": f"E{index:07d}"}
+            for index, employee_id in enumerate(employee_ids)
+        ))
+        insert_chunks(connection, Device, (
+            {"id": device_id, "description": f"Device {index}", "brand": rng.choice(brands),
+             "type": rng.choice(device_types), "code": f"D{index:07d}"}
+            for index, device_id in enumerate(device_ids)
+        ))
+
+        step = timedelta(minutes=1)
+        insert_chunks(connection, Usage, (
+            {"id": random_uuid(rng), "date": START_DATE + step * index, "employee_id": rng.choice(employee_ids),
+             "device_id": rng.choice(device_ids), "type": UsageCheck.CHECK_OUT}
+            for index in range(usages)
+        ))
+
+        held_date = START_DATE + step * usages
+        holders = []
+        for device_id in rng.sample(device_ids, int(devices * CHECKED_IN_SHARE)):
+            holders.append({"device_id": device_id, "employee_id": rng.choice(employee_ids),
+                            "usage_id": random_uuid(rng), "since": held_date})
+        insert_chunks(connection, Usage, (
+            {"id": holder["usage_id"], "date": holder["since"], "employee_id": holder["employee_id"],
+             "device_id": holder["device_id"], "type": UsageCheck.CHECK_IN}
+            for holder in holders
+        ))
+        insert_chunks(connection, DeviceHolder, holders)
+        # Every closed usage ends at the next check in of its device, see backfill_checked_out_at.
+        backfill_checked_out_at(connection)
+
+    with engine.connect() as connection:
+        connection.exec_driver_sql("ANALYZE")
+    engine.dispose()
+
+
+def dataset_path(size, seed):
+    employees, devices, usages = SIZES[size]
+    return os.path.join(DATA_DIR, f"{size}-{employees}-{devices}-{usages}-{seed}.db")
+
+
+def ensure_dataset(size, seed):
+    """Generates the dataset of a size unless it already exists."""
+
+    path = dataset_path(size, seed)
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        print(f"Generating {size} dataset: {path}", flush=True)
+        started = time.perf_counter()
+        generate(path + ".tmp", *SIZES[size], seed=seed)
+        os.replace(path + ".tmp", path)
+        print(f"Generated in {time.perf_counter() - started:.1f} s", flush=True)
+    return path
+
+
+def timed(function, repeat):
+    """
+    Runs a function several times with its output discarded.
+
+    Returns:
+        dict: Timings in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            function()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    return {
+        "repeat": repeat,
+        "min_ms": round(min(timings), 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "mean_ms": round(statistics.mean(timings), 3),
+        "max_ms": round(max(timings), 3),
+    }
+
+
+def run_benchmarks(path, repeat, seed):
+    """
+    Times the hot paths of the scripts against a dataset.
+
+    The scripts use db.SessionLocal, which is bound to the dataset for the run.
+
+    Returns:
+        dict: Benchmark name -> timings.
+    """
+    engine = make_engine(path)
+    db.SessionLocal.configure(bind=engine)
+    rng = random.Random(seed)
+    results = {}
+
+    with engine.connect() as connection:
+        employee_codes = list(connection.scalars(select(Employee.code)))
+        device_codes = list(connection.scalars(select(Device.code)))
+        free_device_codes = list(connection.scalars(
+            select(Device.code).outerjoin(DeviceHolder, DeviceHolder.device_id == Device.id)
+            .where(DeviceHolder.device_id.is_(None))
+        ))
+
+    def list_devices(options):
+        def run():
+            with DeviceScript() as script:
+                script.options = options
+                script.list_devices()
+        return run
+
+    results["list_devices"] = timed(list_devices({}), max(1, repeat // 10))
+    results["list_devices_page"] = timed(list_devices({"limit": "100", "after": rng.choice(device_codes)}), repeat)
+
+    def search_employees():
+        with EmployeeScript() as script:
+            script.arguments = [rng.choice(employee_codes)[:-2]]
+            script.search_employees()
+
+    results["search_employees"] = timed(search_employees, repeat)
+
+    def usages():
+        with EmployeeUsageScript() as script:
+            script.load_employee(rng.choice(employee_codes))
+            script.get_usages_with_device_info().all()
+
+    results["get_usages_with_device_info"] = timed(usages, repeat)
+
+    pairs = [(rng.choice(employee_codes), code) for code in rng.sample(free_device_codes, repeat)]
+    checked_in = iter(pairs)
+    checked_out = iter(pairs)
+
+    def check_in():
+        employee_code, device_code = next(checked_in)
+        with EmployeeUsageScript() as script:
+            script.load_employee(employee_code, cached=False)
+            script.load_device(device_code, cached=False)
+            script.check_in_device()
+
+    def check_out():
+        employee_code, device_code = next(checked_out)
+        with EmployeeUsageScript() as script:
+            script.load_employee(employee_code, cached=False)
+            script.load_device(device_code, cached=False)
+            script.check_out_device()
+
+    results["check_in"] = timed(check_in, repeat)
+    results["check_out"] = timed(check_out, repeat)
+
+    scans = [(line, employee_code, device_code, "check_in") for line, (employee_code, device_code) in enumerate(pairs)]
+
+    def batch():
+        session = sessionmaker(bind=engine)()
+        try:
+            apply_scans(session, scans)
+            session.rollback()
+        finally:
+            session.close()
+
+    results["batch_check_in"] = timed(batch, max(1, repeat // 10))
+
+    deleted = iter(rng.sample(employee_codes, repeat))
+
+    def delete_employee():
+        # The statements of "employees.py delete" after its confirmation.
+        with EmployeeScript() as script:
+            employee_id = script.session.scalar(select(Employee.id).where(Employee.code == next(deleted)))
+            delete_employees(script.session, [Employee.id == employee_id])
+            script.session.commit()
+
+    results["delete_employee"] = timed(delete_employee, repeat)
+
+    engine.dispose()
+    db.SessionLocal.configure(bind=db.engine)
+    return results
+
+
+def table_counts(path):
+    engine = make_engine(path)
+    with engine.connect() as connection:
+        counts = {
+            model.__tablename__: connection.scalar(select(func.count()).select_from(model))
+            for model in (Employee, Device, Usage, DeviceHolder)
+        }
+    engine.dispose()
+    return counts
+
+
+def main(argv=None):
+    """
+    Runs the benchmarks.
+
+    Usage: python bench.py [--sizes tiny,small] [--repeat 20] [--seed 42] [--output results.json]
+    """
+    argv = sys.argv if argv is None else argv
+    _, options = parse_options(argv[1:])
+
+    sizes = options.get("sizes", "tiny,small").split(",")
+    invalid = [size for size in sizes if size not in SIZES]
+    if invalid:
+        print(f"Invalid sizes: {', '.join(invalid)}. Valid sizes: {', '.join(SIZES)}")
+        return
+
+    repeat = int(options.get("repeat", 20))
+    seed = int(options.get("seed", 42))
+    output = options.get("output", "bench_results.json")
+
+    report = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "sqlite": db.engine.dialect.dbapi.sqlite_version,
+        "engine_profile": db.ENGINE_PROFILE,
+        "strict_loading": db.STRICT_LOADING,
+        "repeat": repeat,
+        "seed": seed,
+        "sizes": {},
+    }
+
+    for size in sizes:
+        path = ensure_dataset(size, seed)
+        # Benchmarks write to the dataset, so they run on a fresh copy.
+        run_path = path + ".run"
+        shutil.copyfile(path, run_path)
+        try:
+            results = run_benchmarks(run_path, repeat, seed)
+        finally:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(run_path + suffix):
+                    os.unlink(run_path + suffix)
+
+        report["sizes"][size] = {"rows": table_counts(path), "results": results}
+        for name, timing in results.items():
+            print(f"{size:>6} {name:<30} median {timing['median_ms']:>10.3f} ms  max {timing['max_ms']:>10.3f} ms")
+
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+from datetime import datetime
+
+from sqlalchemy import select, update, delete, func, and_
+from models import Employee, Device, Usage, UsageArchive, UsageDaily, DeviceHolder
+from choices import UsageCheck
+from importer import chunks, IN_CHUNK_SIZE
+
+# Bulk check outs and deletes run a few UPDATE / DELETE statements with the selected ids as a
+# subquery, no rows are loaded into the session. The caller commits, so a bulk command is one
+# transaction. The statements go through the session, which drops the rows from the lookup cache.
+
+
+def read_codes(codes, path=None):
+    """
+    Collects codes from the command line and from a file with one code per line.
+
+    Raises:
+        OSError: If the file cannot be read.
+    """
+    codes = [code.strip() for code in codes if code.strip()]
+    if path:
+        with open(path, encoding="utf-8") as file:
+            codes.extend(line.strip() for line in file if line.strip())
+    return codes
+
+
+def selections(model, codes=None, criteria=()):
+    """
+    Builds the WHERE clauses that select employees or devices.
+
+    Args:
+        model (class): Employee or Device.
+        codes (iterable | None): Only rows with these codes.
+        criteria (iterable): Further conditions, e.g. a code prefix, a brand or a type.
+
+    Returns:
+        list: One clause per chunk of codes, the conditions are part of every clause.
+    """
+    criteria = list(criteria)
+    if not codes:
+        return [and_(*criteria)] if criteria else []
+    return [and_(model.code.in_(chunk), *criteria) for chunk in chunks(sorted(set(codes)), IN_CHUNK_SIZE)]
+
+
+def count_selected(session, model, clauses):
+    """Counts the rows the clauses select."""
+
+    return sum(session.scalar(select(func.count()).select_from(model).where(clause)) for clause in clauses)
+
+
+def execute(session, statement):
+    return session.execute(statement.execution_options(synchronize_session=False)).rowcount
+
+
+def close_usages(session, usage_column, holder_column, ids, now):
+    """Checks out the open usages of the selected ids and removes their device holder rows."""
+
+    closed = execute(session, update(Usage).where(Usage.type == UsageCheck.CHECK_IN, usage_column.in_(ids))
+                     .values(type=UsageCheck.CHECK_OUT, checked_out_at=now))
+    execute(session, delete(DeviceHolder).where(holder_column.in_(ids)))
+    return closed
+
+
+def check_out_employees(session, clauses, now=None):
+    """
+    Checks out every device the selected employees hold.
+
+    Returns:
+        int: The number of closed usages.
+    """
+    now = now or datetime.utcnow()
+    return sum(
+        close_usages(session, Usage.employee_id, DeviceHolder.employee_id, select(Employee.id).where(clause), now)
+        for clause in clauses
+    )
+
+
+def check_out_devices(session, clauses, now=None):
+    """
+    Checks out the selected devices from whoever holds them.
+
+    Returns:
+        int: The number of closed usages.
+    """
+    now = now or datetime.utcnow()
+    return sum(
+        close_usages(session, Usage.device_id, DeviceHolder.device_id, select(Device.id).where(clause), now)
+        for clause in clauses
+    )
+
+
+def delete_employees(session, clauses, now=None):
+    """
+    Deletes the selected employees as delete_employee does, with set based statements.
+
+    Their devices are checked out first, their usages and archived usages keep the history
+    without the employee.
+
+    Returns:
+        dict: The numbers of "checked_out" usages, detached "usages" and "archived" usages and deleted "employees".
+    """
+    now = now or datetime.utcnow()
+    counts = {"checked_out": 0, "usages": 0, "archived": 0, "employees": 0}
+    for clause in clauses:
+        ids = select(Employee.id).where(clause)
+        counts["checked_out"] += close_usages(session, Usage.employee_id, DeviceHolder.employee_id, ids, now)
+        counts["usages"] += execute(session, update(Usage).where(Usage.employee_id.in_(ids)).values(employee_id=None))
+        counts["archived"] += execute(session, update(UsageArchive).where(UsageArchive.employee_id.in_(ids))
+                                      .values(employee_id=None))
+        counts["employees"] += execute(session, delete(Employee).where(clause))
+    return counts
+
+
+def delete_devices(session, clauses, now=None):
+    """
+    Deletes the selected devices as delete_device does, with set based statements.
+
+    Checked in devices are checked out first, their usages and archived usages keep the
+    history without the device. Their rows of the usage rollup are deleted here too, not left
+    to ON DELETE CASCADE, so the reports are the same whether foreign keys are enforced or not.
+
+    Returns:
+        dict: The numbers of "checked_out" usages, detached "usages" and "archived" usages and deleted "devices".
+    """
+    now = now or datetime.utcnow()
+    counts = {"checked_out": 0, "usages": 0, "archived": 0, "devices": 0}
+    for clause in clauses:
+        ids = select(Device.id).where(clause)
+        counts["checked_out"] += close_usages(session, Usage.device_id, DeviceHolder.device_id, ids, now)
+        counts["usages"] += execute(session, update(Usage).where(Usage.device_id.in_(ids)).values(device_id=None))
+        counts["archived"] += execute(session, update(UsageArchive).where(UsageArchive.device_id.in_(ids))
+                                      .values(device_id=None))
+        execute(session, delete(UsageDaily).where(UsageDaily.device_id.in_(ids)))
+        counts["devices"] += execute(session, delete(Device).where(clause))
+    return counts
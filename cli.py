@@ -0,0 +1,159 @@
+import sys
+import uuid
+from datetime import datetime
+
+from renderer import render_rows, MACHINE_FORMATS
+
+# Options that do not take a value.
+FLAGS = ("stream", "gzip", "resume", "rebuild", "profile", "yes")
+
+STREAM_CHUNK_SIZE = 1000
+
+
+def parse_options(args, flags=FLAGS):
+    """
+    Splits command line arguments into positional arguments and --options.
+
+    Args:
+        args (list): The command line arguments without the script name.
+        flags (tuple): Option names that do not take a value.
+
+    Returns:
+        tuple: (list of positional arguments, dict of options).
+
+    Example:
+        ["list", "--limit", "10", "--after=005", "--stream"] ->
+        (["list"], {"limit": "10", "after": "005", "stream": True})
+    """
+    positional, options = [], {}
+    args = iter(args)
+
+    for arg in args:
+        if not arg.startswith("--"):
+            positional.append(arg)
+            continue
+
+        name, separator, value = arg[2:].partition("=")
+        name = name.replace("-", "_")
+        if separator:
+            options[name] = value
+        elif name in flags:
+            options[name] = True
+        else:
+            options[name] = next(args, None)
+
+    return positional, options
+
+
+def get_limit(options):
+    """
+    Reads the --limit option.
+
+    Args:
+        options (dict): The parsed options.
+
+    Returns:
+        int | None: The positive limit, None if not set.
+
+    Raises:
+        ValueError: If the limit is not a positive number.
+    """
+    limit = options.get("limit")
+    if limit is None:
+        return None
+
+    if not str(limit).isdigit() or int(limit) < 1:
+        raise ValueError(f"Invalid limit: {limit}. The limit must be a positive number.")
+    return int(limit)
+
+
+def get_offset(options):
+    """
+    Reads the --offset option.
+
+    Args:
+        options (dict): The parsed options.
+
+    Returns:
+        int: The offset, 0 if not set.
+
+    Raises:
+        ValueError: If the offset is not a number.
+    """
+    offset = options.get("offset")
+    if offset is None:
+        return 0
+
+    if not str(offset).isdigit():
+        raise ValueError(f"Invalid offset: {offset}. The offset must be a number.")
+    return int(offset)
+
+
+def parse_datetime(value):
+    """
+    Parses a date or date and time in ISO format.
+
+    Args:
+        value (str): The value to parse, for example "2024-03-01" or "2024-03-01T12:30:00".
+
+    Returns:
+        datetime: The parsed date and time.
+
+    Raises:
+        ValueError: If the value is not a valid date.
+    """
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid date: {value}. Use the YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS format.")
+
+
+def parse_uuid(value):
+    """
+    Parses the id of a row.
+
+    Raises:
+        ValueError: If the value is not a valid UUID.
+    """
+    try:
+        return uuid.UUID(value)
+    except (TypeError, ValueError, AttributeError):
+        raise ValueError(f"Invalid id: {value}.")
+
+
+def print_rows(rows, stream=False, output_format=None, widths=None):
+    """
+    Prints rows as a table or in a machine readable format, see renderer.render_rows.
+
+    Args:
+        rows (iterable): The rows to print as dicts.
+        stream (bool): If True, rows are printed as they are fetched, so memory does not
+            grow with the number of rows.
+        output_format (str | None): The --format option: table, csv, tsv or jsonl.
+        widths (dict | None): Fixed column widths of a streamed table.
+
+    Returns:
+        int: The number of printed rows.
+    """
+    return render_rows(rows, output_format=output_format, stream=stream, widths=widths)
+
+
+def confirm(options, question):
+    """
+    Asks a yes / no question, --yes answers it without asking.
+
+    Returns:
+        bool: True if confirmed.
+    """
+    if options.get("yes"):
+        return True
+    return input(question).strip().lower() in ("yes", "y")
+
+
+def message_file(options):
+    """
+    The stream for messages around the rows.
+
+    With a machine readable --format messages go to stderr, so stdout holds only the rows.
+    """
+    return sys.stderr if options.get("format") in MACHINE_FORMATS else sys.stdout
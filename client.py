@@ -0,0 +1,52 @@
+import json
+import os
+import socket
+import sys
+import threading
+
+# settings imports only the standard library, so the client starts fast.
+from settings import SERVER_SOCKET
+
+
+def forward_stdin(connection):
+    """Sends stdin to the server until it ends, then closes the sending side of the connection."""
+
+    try:
+        # Raw reads of the file descriptor, a buffered reader would block interpreter shutdown.
+        while data := os.read(sys.stdin.fileno(), 65536):
+            connection.sendall(data)
+        connection.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+
+
+def main(argv=None):
+    """
+    Runs a command on the command server.
+
+    Usage: python client.py <employees | devices | usage | db> <command> [arguments]
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print("Usage: python client.py <employees | devices | usage | db> <command> [arguments]")
+        return 1
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(SERVER_SOCKET)
+    except OSError:
+        print(f"The server is not running on {SERVER_SOCKET}. Start it with: python server.py")
+        return 1
+
+    with connection:
+        connection.sendall(json.dumps({"argv": argv}).encode() + b"\n")
+        threading.Thread(target=forward_stdin, args=(connection,), daemon=True).start()
+
+        while data := connection.recv(65536):
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
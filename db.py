@@ -1,14 +1,128 @@
+import os
 import sys
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, insert, make_url
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError, ArgumentError
 from sqlalchemy.orm import sessionmaker
-from models import Base, Employee, Device, Usage
+from models import Employee, Device
 from choices import BrandType, DeviceType
+from migrations import create_schema, migrate, get_version, populate_device_holders, convert_guid_storage, copy_database
+from importer import import_file
+from profiling import instrument, profiled
+from loaders import enable_strict_loading
+from lookups import enable_lookup_cache
+from cli import parse_options
+from archive import archive_cutoff, archive_usages
+from settings import (CONFIG_FILE, ENGINE_PROFILE, SQLITE_PRAGMAS, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, STRICT_LOADING,
+                      DATABASE_URI, POOL_SIZE, MAX_OVERFLOW, POOL_PRE_PING, STATEMENT_TIMEOUT)
 
 
-DATABASE_URI = "sqlite:///database.db"
-engine = create_engine(DATABASE_URI)
+def engine_options(uri):
+    """
+    The pool options of an engine for a database URI.
+
+    An in-memory SQLite database lives in a single connection, it keeps the default pool.
+    """
+    url = make_url(uri)
+    options = {"pool_pre_ping": POOL_PRE_PING}
+    if url.get_backend_name() != "sqlite" or url.database not in (None, "", ":memory:"):
+        options.update(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW)
+    return options
+
+
+engine = create_engine(DATABASE_URI, **engine_options(DATABASE_URI))
+
+PRAGMA_CHOICES = {
+    "journal_mode": ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"),
+    "synchronous": ("OFF", "NORMAL", "FULL", "EXTRA"),
+    "foreign_keys": ("ON", "OFF"),
+}
+
+
+def pragma_statements(pragmas=None):
+    """
+    Builds the PRAGMA statements of the engine profile.
+
+    Args:
+        pragmas (dict | None): Pragma name -> value, the configured pragmas if None.
+
+    Returns:
+        list: The PRAGMA statements.
+
+    Raises:
+        ValueError: If a pragma value is not valid.
+    """
+    statements = []
+    for name, value in (pragmas or SQLITE_PRAGMAS).items():
+        if name in PRAGMA_CHOICES:
+            value = str(value).upper()
+            if value not in PRAGMA_CHOICES[name]:
+                raise ValueError(f"Invalid {name}: {value}. Valid values: {', '.join(PRAGMA_CHOICES[name])}.")
+        else:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid {name}: {value}. The value must be a number.")
+        statements.append(f"PRAGMA {name} = {value}")
+    return statements
+
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Applies the pragmas of the engine profile to every new SQLite connection."""
+
+    if engine.dialect.name != "sqlite":
+        return
+
+    cursor = dbapi_connection.cursor()
+    for statement in pragma_statements():
+        cursor.execute(statement)
+    cursor.close()
+
+
+@event.listens_for(engine, "connect")
+def set_statement_timeout(dbapi_connection, connection_record):
+    """Sets the statement timeout of every new PostgreSQL connection, outside of a transaction."""
+
+    if engine.dialect.name != "postgresql" or not STATEMENT_TIMEOUT:
+        return
+
+    autocommit = dbapi_connection.autocommit
+    dbapi_connection.autocommit = True
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"SET statement_timeout = {STATEMENT_TIMEOUT}")
+    cursor.close()
+    dbapi_connection.autocommit = autocommit
+
+
+# Statement and connect timings for --profile, added after the pragmas so connect time includes them.
+instrument(engine)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+if STRICT_LOADING:
+    enable_strict_loading(SessionLocal)
+# Cached code and email lookups are dropped when any session changes the rows.
+enable_lookup_cache()
+
+
+def dialect_insert(bind, table):
+    """
+    Builds an INSERT of the database dialect, which supports ON CONFLICT on SQLite and PostgreSQL.
+
+    Args:
+        bind (Session | Connection | Engine): Anything bound to the database.
+        table: The model or table to insert into.
+
+    Returns:
+        Insert: The insert statement.
+    """
+    dialect_name = bind.get_bind().dialect.name if hasattr(bind, "get_bind") else bind.dialect.name
+    if dialect_name == "sqlite":
+        return sqlite.insert(table)
+    if dialect_name == "postgresql":
+        return postgresql.insert(table)
+    return insert(table)
 
 
 class DatabaseConnectionMixin:
@@ -28,10 +142,21 @@ class DatabaseConnectionMixin:
 def init_db():
     """This function creates the database tables."""
 
-    Base.metadata.create_all(bind=engine)
+    create_schema(engine)
     print("Database initialized.")
 
 
+def migrate_db():
+    """This function applies pending schema migrations."""
+
+    applied = migrate(engine)
+    for version, description in applied:
+        print(f"Applied migration {version}: {description}.")
+
+    with engine.connect() as connection:
+        print(f"Schema version: {get_version(connection)}.")
+
+
 def add_dummy_devices():
     """This function adds dummy devices."""
 
@@ -70,33 +195,191 @@ def add_dummy_employees():
         print("Default employees added.")
 
 
-def main(scripts_dict):
-    """This function runs the script."""
+def rebuild_holders():
+    """This function rebuilds the device holder table from the usage history."""
+
+    with engine.begin() as connection:
+        count = populate_device_holders(connection)
+    print(f"Device holders rebuilt: {count} checked in devices.")
+
+
+def import_data(path=None, kind=None):
+    """
+    This function imports employees or devices from a CSV or JSONL file.
+
+    Args:
+        path (str): The path to the file.
+        kind (str | None): "employees" or "devices", guessed from the file name if not set.
+    """
+
+    if not path:
+        print("Usage: python db.py import <file.csv | file.jsonl> [employees | devices]")
+        return
+
+    try:
+        importer = import_file(engine, path, kind)
+    except (OSError, ValueError) as error:
+        print(error)
+        return
+
+    for line_number, error in importer.rejected:
+        print(f"Line {line_number} rejected: {error}")
+    print(f"Imported {importer.imported} rows, rejected {len(importer.rejected)} rows.")
+
+
+def convert_guids(mode=None):
+    """
+    This function converts the stored UUID keys of the SQLite database.
+
+    Args:
+        mode (str): "binary" for 16 byte blobs, "char" for 36 character strings.
+    """
+
+    if mode not in ("binary", "char"):
+        print("Usage: python db.py convert_guids <binary | char>")
+        return
+
+    try:
+        converted = convert_guid_storage(engine, binary=mode == "binary")
+    except ValueError as error:
+        print(error)
+        return
+
+    print(f"Converted {converted} keys to {mode} storage.")
+    print(f"Set GUID_STORAGE={mode} before running the other commands.")
+
+
+def archive(days=None, batch_size=None):
+    """
+    This function moves usages checked out more than a number of days ago to the usage archive.
+
+    Args:
+        days (str | None): The age in days, ARCHIVE_AFTER_DAYS if not set.
+        batch_size (str | None): The number of usages moved per transaction, ARCHIVE_BATCH_SIZE if not set.
+    """
+
+    days = days or ARCHIVE_AFTER_DAYS
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    if not str(days).isdigit() or not str(batch_size).isdigit() or int(batch_size) < 1:
+        print("Usage: python db.py archive [days] [batch size]")
+        return
+
+    cutoff = archive_cutoff(int(days))
+    archived = archive_usages(engine, cutoff, int(batch_size))
+    print(f"Archived {archived} usages checked out before {cutoff:%Y-%m-%d %H:%M} UTC.")
+
+
+def copy_data(target_uri=None):
+    """
+    This function copies all data of the database to another, empty database, e.g. from SQLite to PostgreSQL.
+
+    Args:
+        target_uri (str): The URI of the target database, its schema is created first.
+    """
+
+    if not target_uri:
+        print("Usage: python db.py copy <target database URI>")
+        return
+
+    try:
+        target = create_engine(target_uri)
+    except (ArgumentError, ImportError) as error:
+        print(f"Invalid database URI: {error}")
+        return
+    # The pragma listener applies to SQLite engines when the configured database is SQLite as well.
+    if target.dialect.name == "sqlite" and engine.dialect.name == "sqlite":
+        event.listen(target, "connect", set_sqlite_pragmas)
+    instrument(target)
+    try:
+        copied = copy_database(engine, target)
+    except (ValueError, SQLAlchemyError) as error:
+        print(error)
+        return
+    finally:
+        target.dispose()
+
+    for table, rows in copied.items():
+        print(f"{table}: {rows} rows")
+    print(f"Copied {sum(copied.values())} rows to {target.url.render_as_string(hide_password=True)}.")
+
+
+def show_settings():
+    """This function prints the active engine settings and the pragmas of the open connection."""
+
+    print(f"Database: {engine.url.render_as_string(hide_password=True)}")
+    print(f"Config file: {CONFIG_FILE}{'' if os.path.exists(CONFIG_FILE) else ' (not found)'}")
+    print(f"Pool: {engine.pool.status()}, pre-ping {'on' if POOL_PRE_PING else 'off'}")
+
+    if engine.dialect.name != "sqlite":
+        print(f"Statement timeout: {f'{STATEMENT_TIMEOUT} ms' if STATEMENT_TIMEOUT else 'none'}")
+        return
+
+    print(f"Engine profile: {ENGINE_PROFILE}\n")
+
+    with engine.connect() as connection:
+        cursor = connection.connection.driver_connection
+        for name, value in SQLITE_PRAGMAS.items():
+            active = cursor.execute(f"PRAGMA {name}").fetchone()[0]
+            print(f"{name}: {active} (configured: {value})")
+
+
+def main(scripts_dict, args_scripts_dict=None, argv=None):
+    """
+    This function runs the script.
+
+    Args:
+        scripts_dict (dict): Commands without arguments, several can be run at once.
+        args_scripts_dict (dict | None): Commands that take the rest of the command line as arguments.
+        argv (list | None): The command line with the script name, sys.argv if None.
+    """
+    argv = sys.argv if argv is None else argv
 
     slash = 100
     print("-" * slash + "\n")
 
-    if len(sys.argv) < 2:
-        print("Usage: python db.py\n init | dummy_devices | dummy_employees")
+    if len(argv) < 2:
+        print("Usage: python db.py\n init | migrate | dummy_devices | dummy_employees | rebuild_holders | settings"
+              "\n import <file> [employees | devices] | convert_guids <binary | char> | archive [days] [batch size]"
+              "\n copy <target database URI>")
         return
 
-    commands = sys.argv[1:]
-
-    for command in commands:
-        if command not in scripts_dict:
-            print(f"Invalid command: {command}. Valid commands:\ninit | dummy_devices | dummy_employees")
+    args, options = parse_options(argv[1:])
+    with profiled(options.get("profile"), f"db {' '.join(args)}"):
+        args_scripts_dict = args_scripts_dict or {}
+        if args and args[0].lower() in args_scripts_dict:
+            # Commands with arguments take the rest of the command line.
+            args_scripts_dict[args[0].lower()](*args[1:])
+            print("\n" + "-" * slash)
             return
 
-    for command in commands:
-        scripts_dict[command.lower()]()
+        commands = args
+
+        for command in commands:
+            if command not in scripts_dict:
+                print(f"Invalid command: {command}. Valid commands:\ninit | migrate | dummy_devices | dummy_employees | rebuild_holders | settings")
+                return
+
+        for command in commands:
+            scripts_dict[command.lower()]()
+
+        print("\n" + "-" * slash)
+
 
-    print("\n" + "-" * slash)
+scripts = {
+    "init": init_db,  # create tables
+    "migrate": migrate_db,  # apply pending schema migrations
+    "dummy_devices": add_dummy_devices,  # add default devices
+    "dummy_employees": add_dummy_employees,  # add default employees
+    "rebuild_holders": rebuild_holders,  # rebuild current device holders from usage history
+    "settings": show_settings,  # print the active engine profile and pragmas
+}
+args_scripts = {
+    "import": import_data,  # bulk import employees or devices from a file
+    "convert_guids": convert_guids,  # rewrite stored UUID keys as binary or char
+    "archive": archive,  # move old closed usages to the usage archive
+    "copy": copy_data,  # copy all data to another, empty database
+}
 
 
 if __name__ == "__main__":
-    scripts = {
-        "init": init_db,  # create tables
-        "dummy_devices": add_dummy_devices,  # add default devices
-        "dummy_employees": add_dummy_employees,  # add default employees
-    }
-    main(scripts)
+    main(scripts, args_scripts)
@@ -1,9 +1,15 @@
 import sys
-from tabulate import tabulate
+from sqlalchemy import select
 from models import Device
 from db import DatabaseConnectionMixin
 from choices import BrandType, DeviceType, get_type_by_name
-from settings import tabluate_kwargs
+from cli import parse_options, get_limit, get_offset, print_rows, message_file, confirm
+from renderer import OUTPUT_FORMATS, MACHINE_FORMATS
+from readers import guid_text, read_rows
+from profiling import profiled
+from lookups import find
+from bulk import read_codes, selections, count_selected, check_out_devices, delete_devices
+from search import search_devices, SEARCH_PAGE_SIZE
 
 
 class DeviceScript(DatabaseConnectionMixin):
@@ -13,11 +19,16 @@ class DeviceScript(DatabaseConnectionMixin):
     def __init__(self):
         self.commands = {
             "list": self.list_devices,
+            "search": self.search_devices,
             "add": self.add_device,
             "update": self.update_device,
             "delete": self.delete_device,
+            "bulk_delete": self.bulk_delete,
+            "bulk_check_out": self.bulk_check_out,
         }
         self.session = None
+        self.options = {}
+        self.arguments = []
         self.joined_brand_choices = ", ".join([brand.value[0] for brand in BrandType])
         self.joined_device_choices = ", ".join([device.value[0] for device in DeviceType])
 
@@ -31,26 +42,93 @@ class DeviceScript(DatabaseConnectionMixin):
         Returns:
             bool: Returns True if the code is unique, otherwise False.
         """
-        return self.session.query(Device).filter(Device.code == code_to_check).first() is None
+        return find(self.session, Device, "code", code_to_check) is None
 
     def list_devices(self):
-        """List all devices."""
-        devices = self.session.query(Device).all()
+        """
+        List devices ordered by code.
 
-        if not devices:
-            print("No devices found.")
+        Options:
+            --limit (int): The maximum number of devices to print.
+            --after (str): Print only devices with a code after this one (keyset pagination).
+            --stream: Fetch and print devices in chunks as they are read.
+            --format (str): table | csv | tsv | jsonl.
+        """
+        try:
+            limit = get_limit(self.options)
+        except ValueError as error:
+            print(error)
+            return
+
+        query = select(
+            guid_text(Device.id), Device.description, Device.brand, Device.type, Device.code
+        ).order_by(Device.code)
+        if self.options.get("after"):
+            query = query.where(Device.code > self.options["after"])
+        if limit:
+            query = query.limit(limit)
+
+        last_code = None
+
+        def rows():
+            nonlocal last_code
+            for device in read_rows(self.session.connection(), query, stream=self.options.get("stream")):
+                last_code = device.code
+                yield {
+                    "id": str(device.id),
+                    "description": device.description,
+                    "brand": device.brand.value[1],
+                    "type": device.type.value[1],
+                    "code": device.code
+                }
+
+        messages = message_file(self.options)
+        count = print_rows(rows(), stream=self.options.get("stream"), output_format=self.options.get("format"),
+                           widths={"id": 36})
+        if not count:
+            print("No devices found.", file=messages)
+        elif limit and count == limit:
+            print(f"Next page: --after {last_code}", file=messages)
+
+    def search_devices(self):
+        """
+        Print the devices whose description or code start with the searched words, best matches first.
+
+        Arguments:
+            The words to search for, e.g. "lap 14".
+
+        Options:
+            --limit (int): The number of devices per page, 20 by default.
+            --offset (int): The number of best matches to skip, for the next pages.
+            --format (str): table | csv | tsv | jsonl.
+        """
+        try:
+            limit = get_limit(self.options) or SEARCH_PAGE_SIZE
+            offset = get_offset(self.options)
+        except ValueError as error:
+            print(error)
+            return
+
+        query = " ".join(self.arguments)
+        if not query.strip():
+            print("Enter the words to search for.")
             return
 
-        data = []
-        for device in devices:
-            data.append({
-                "id": str(device.id),
-                "description": device.description,
-                "brand": device.brand.value[1],
-                "type": device.type.value[1],
-                "code": device.code
-            })
-        print(tabulate(data, **tabluate_kwargs))
+        devices = search_devices(self.session.connection(), query, limit=limit, offset=offset)
+        rows = ({
+            "id": device.id,
+            "description": device.description,
+            "brand": device.brand.value[1],
+            "type": device.type.value[1],
+            "code": device.code
+        } for device in devices)
+
+        messages = message_file(self.options)
+        count = print_rows(rows, output_format=self.options.get("format"))
+        if not count:
+            print("No devices found.", file=messages)
+        elif count == limit:
+            print(f"Next page: --offset {offset + limit}", file=messages)
 
     def add_device(self):
         """Add a new device."""
@@ -94,7 +172,7 @@ class DeviceScript(DatabaseConnectionMixin):
             print("Invalid input.")
             return
 
-        device_inst = self.session.query(Device).filter(Device.code == device_code).first()
+        device_inst = find(self.session, Device, "code", device_code, cached=False)
         if not device_inst:
             print("Device not found!")
             return
@@ -138,40 +216,149 @@ class DeviceScript(DatabaseConnectionMixin):
     def delete_device(self):
         """Delete an existing device."""
         device_code = input("Enter the device code to delete: ")
-        device = self.session.query(Device).filter(Device.code == device_code).first()
+        device_id = self.session.scalar(select(Device.id).where(Device.code == device_code))
 
-        if not device:
+        if not device_id:
             print("Device not found!")
             return
 
-        confirm = input("Are you sure you want to delete this device? (yes/no): ").lower()
-        if confirm in ['yes', 'y']:
-            self.session.delete(device)
+        confirmed = input("Are you sure you want to delete this device? (yes/no): ").lower()
+        if confirmed in ['yes', 'y']:
+            # A checked in device is checked out first, its usages and archived usages keep the
+            # history without the device, as with bulk delete.
+            delete_devices(self.session, [Device.id == device_id])
             self.session.commit()
             print(f"Device {device_code} deleted.")
         else:
             print("Deletion cancelled.")
 
+    def bulk_selection(self):
+        """
+        Reads the devices a bulk command works on: codes as arguments or in a file, or filters.
+
+        Returns:
+            list | None: The WHERE clauses, see bulk.selections, None if nothing was selected.
+        """
+        try:
+            codes = read_codes(self.arguments, self.options.get("file"))
+        except OSError as error:
+            print(error)
+            return None
+
+        criteria = []
+        if self.options.get("prefix"):
+            criteria.append(Device.code.startswith(self.options["prefix"], autoescape=True))
+        if self.options.get("brand"):
+            brand = get_type_by_name(name=self.options["brand"], enum_class=BrandType)
+            if not brand:
+                print("Invalid brand. Please enter one of the following: " + self.joined_brand_choices)
+                return None
+            criteria.append(Device.brand == brand)
+        if self.options.get("type"):
+            device_type = get_type_by_name(name=self.options["type"], enum_class=DeviceType)
+            if not device_type:
+                print("Invalid type. Please enter one of the following: " + self.joined_device_choices)
+                return None
+            criteria.append(Device.type == device_type)
+
+        clauses = selections(Device, codes, criteria)
+        if not clauses:
+            print("Enter device codes, --file, --prefix, --brand or --type.")
+            return None
+        return clauses
+
+    def bulk_delete(self):
+        """
+        Delete many devices with a few set based statements in one transaction.
+
+        Arguments:
+            Device codes.
+
+        Options:
+            --file (str): A file with one device code per line.
+            --prefix (str): Only devices whose code starts with this.
+            --brand (str), --type (str): Only devices of this brand or type.
+            --yes: Do not ask for confirmation.
+        """
+        clauses = self.bulk_selection()
+        if clauses is None:
+            return
+
+        count = count_selected(self.session, Device, clauses)
+        if not count:
+            print("No devices found.")
+            return
+        if not confirm(self.options, f"Are you sure you want to delete {count} devices? (yes/no): "):
+            print("Deletion cancelled.")
+            return
+
+        counts = delete_devices(self.session, clauses)
+        self.session.commit()
+        print(f"Deleted {counts['devices']} devices, checked out {counts['checked_out']} of them, "
+              f"kept {counts['usages']} usages and {counts['archived']} archived usages without the device.")
+
+    def bulk_check_out(self):
+        """
+        Check out many devices from whoever holds them with set based statements in one transaction.
+
+        Arguments:
+            Device codes.
+
+        Options:
+            --file (str): A file with one device code per line.
+            --prefix (str): Only devices whose code starts with this.
+            --brand (str), --type (str): Only devices of this brand or type.
+        """
+        clauses = self.bulk_selection()
+        if clauses is None:
+            return
+
+        checked_out = check_out_devices(self.session, clauses)
+        self.session.commit()
+        print(f"Checked out {checked_out} devices.")
 
-def main():
-    """This function runs the script."""
+
+def main(argv=None):
+    """
+    This function runs the script.
+
+    Args:
+        argv (list | None): The command line with the script name, sys.argv if None.
+    """
+    argv = sys.argv if argv is None else argv
 
     slash = 100
-    print("-" * slash + "\n")
+    args, options = parse_options(argv[1:])
+    command = args[0].lower() if args else ""
+    # The machine readable formats write only the data to stdout.
+    banner = options.get("format") not in MACHINE_FORMATS
+
+    if banner:
+        print("-" * slash + "\n")
+
+    if len(argv) < 2:
+        print("Usage: python devices.py\nlist [--limit N] [--after CODE] [--stream] [--format table | csv | tsv | jsonl] | add | update | delete"
+              "\nsearch WORDS [--limit N] [--offset N] [--format table | csv | tsv | jsonl]"
+              "\nbulk_delete [CODE ...] [--file FILE] [--prefix PREFIX] [--brand BRAND] [--type TYPE] [--yes]"
+              "\nbulk_check_out [CODE ...] [--file FILE] [--prefix PREFIX] [--brand BRAND] [--type TYPE]"
+              "\n[--profile | --profile=json] prints where the time of a command goes")
+        return
 
-    if len(sys.argv) < 2:
-        print("Usage: python devices.py\nlist | add | update | delete")
+    if options.get("format") not in (None, *OUTPUT_FORMATS):
+        print(f"Invalid format: {options['format']}. Valid formats: {', '.join(OUTPUT_FORMATS)}.")
         return
 
-    command = sys.argv[1].lower()
-    with DeviceScript() as es:
+    with profiled(options.get("profile"), f"devices {' '.join(args)}"), DeviceScript() as es:
+        es.options = options
+        es.arguments = args[1:]
         if command not in es.commands:
-            print(f"Invalid command: {command}. Valid commands:\nlist | add | update | delete")
+            print(f"Invalid command: {command}. Valid commands:\nlist | search | add | update | delete | bulk_delete | bulk_check_out")
             return
 
         es.commands[command]()
 
-        print("\n" + "-" * slash)
+        if banner:
+            print("\n" + "-" * slash)
 
 
 if __name__ == "__main__":
@@ -1,10 +1,15 @@
 import sys
-import re
-from tabulate import tabulate
-from models import Employee, Usage
+from sqlalchemy import select
+from models import Employee
 from db import DatabaseConnectionMixin
-from choices import UsageCheck
-from settings import tabluate_kwargs
+from cli import parse_options, get_limit, get_offset, print_rows, message_file, confirm
+from renderer import OUTPUT_FORMATS, MACHINE_FORMATS
+from readers import guid_text, read_rows
+from profiling import profiled
+from lookups import find
+from bulk import read_codes, selections, count_selected, check_out_employees, delete_employees
+from search import search_employees, SEARCH_PAGE_SIZE
+from validators import name_error, email_error
 
 
 class EmployeeScript(DatabaseConnectionMixin):
@@ -15,11 +20,16 @@ class EmployeeScript(DatabaseConnectionMixin):
     def __init__(self):
         self.commands = {
             "list": self.list_employees,
+            "search": self.search_employees,
             "add": self.add_employee,
             "update": self.update_employee,
             "delete": self.delete_employee,
+            "bulk_delete": self.bulk_delete,
+            "bulk_check_out": self.bulk_check_out,
         }
         self.session = None
+        self.options = {}
+        self.arguments = []
 
     @staticmethod
     def validate_name(name):
@@ -33,19 +43,9 @@ class EmployeeScript(DatabaseConnectionMixin):
             bool: Returns True if the name is valid, otherwise False.
         """
 
-        key = name[0]
-        value = name[1].strip()
-
-        if len(value) < 3:
-            print(f"{key} must be longer than 2 characters.")
-            return False
-
-        if any(char.isdigit() for char in value):
-            print(f"{key} cannot contain numbers.")
-            return False
-
-        if re.search(r'[!@#$%^&*(),.?":{}|<>]', value):
-            print(f"{key} cannot contain special characters.")
+        error = name_error(key=name[0], value=name[1])
+        if error:
+            print(error)
             return False
 
         return True
@@ -66,7 +66,7 @@ class EmployeeScript(DatabaseConnectionMixin):
             print("Invalid code.")
             return False
 
-        existing_code = self.session.query(Employee).filter(Employee.code == code).first()
+        existing_code = find(self.session, Employee, "code", code)
         if not existing_code:
             return True
 
@@ -88,12 +88,12 @@ class EmployeeScript(DatabaseConnectionMixin):
                 bool: Returns True if the email is valid, otherwise False.
         """
 
-        pattern = r"(^[a-z0-9_.+-]+@[a-z0-9-]+\.[a-z]+$)"
-        if not re.match(pattern, email):
-            print("This is not a valid email format. Please try again.")
+        error = email_error(email)
+        if error:
+            print(error)
             return False
 
-        existing_email = self.session.query(Employee).filter(Employee.email == email).first()
+        existing_email = find(self.session, Employee, "email", email)
         if not existing_email:
             return True
 
@@ -104,24 +104,92 @@ class EmployeeScript(DatabaseConnectionMixin):
         return False
 
     def list_employees(self):
-        """Print list of all employees.(Prints a table with all employees using tabulate)."""
+        """
+        Print list of employees ordered by code.(Prints a table with all employees, or CSV, TSV or JSONL).
 
-        employees = self.session.query(Employee).all()
-        if not employees:
-            print("No employees found.")
+        Options:
+            --limit (int): The maximum number of employees to print.
+            --after (str): Print only employees with a code after this one (keyset pagination).
+            --stream: Fetch and print employees in chunks as they are read.
+            --format (str): table | csv | tsv | jsonl.
+        """
+
+        try:
+            limit = get_limit(self.options)
+        except ValueError as error:
+            print(error)
+            return
+
+        query = select(
+            guid_text(Employee.id), Employee.first_name, Employee.last_name, Employee.email, Employee.code
+        ).order_by(Employee.code)
+        if self.options.get("after"):
+            query = query.where(Employee.code > self.options["after"])
+        if limit:
+            query = query.limit(limit)
+
+        last_code = None
+
+        def rows():
+            nonlocal last_code
+            for employee in read_rows(self.session.connection(), query, stream=self.options.get("stream")):
+                last_code = employee.code
+                yield {
+                    "id": employee.id,
+                    "first name": employee.first_name,
+                    "last name": employee.last_name,
+                    "email": employee.email,
+                    "code": employee.code
+                }
+
+        messages = message_file(self.options)
+        print("Employees list:", file=messages)
+        count = print_rows(rows(), stream=self.options.get("stream"), output_format=self.options.get("format"),
+                           widths={"id": 36})
+        if not count:
+            print("No employees found.", file=messages)
+        elif limit and count == limit:
+            print(f"Next page: --after {last_code}", file=messages)
+
+    def search_employees(self):
+        """
+        Print the employees whose names, email or code start with the searched words, best matches first.
+
+        Arguments:
+            The words to search for, e.g. "ann now" or "anna@example".
+
+        Options:
+            --limit (int): The number of employees per page, 20 by default.
+            --offset (int): The number of best matches to skip, for the next pages.
+            --format (str): table | csv | tsv | jsonl.
+        """
+        try:
+            limit = get_limit(self.options) or SEARCH_PAGE_SIZE
+            offset = get_offset(self.options)
+        except ValueError as error:
+            print(error)
+            return
+
+        query = " ".join(self.arguments)
+        if not query.strip():
+            print("Enter the words to search for.")
             return
 
-        data = []
-        for employee in employees:
-            data.append({
-                "id": employee.id,
-                "first name": employee.first_name,
-                "last name": employee.last_name,
-                "email": employee.email,
-                "code": employee.code
-            })
-        print("Employees list:")
-        print(tabulate(data, **tabluate_kwargs))
+        employees = search_employees(self.session.connection(), query, limit=limit, offset=offset)
+        rows = ({
+            "id": employee.id,
+            "first name": employee.first_name,
+            "last name": employee.last_name,
+            "email": employee.email,
+            "code": employee.code
+        } for employee in employees)
+
+        messages = message_file(self.options)
+        count = print_rows(rows, output_format=self.options.get("format"))
+        if not count:
+            print("No employees found.", file=messages)
+        elif count == limit:
+            print(f"Next page: --offset {offset + limit}", file=messages)
 
     def add_employee(self):
         """Add a new employee."""
@@ -161,7 +229,7 @@ class EmployeeScript(DatabaseConnectionMixin):
             print("Invalid input.")
             return
 
-        employee = self.session.query(Employee).filter(Employee.code == employee_code).first()
+        employee = find(self.session, Employee, "code", employee_code, cached=False)
         if not employee:
             print("Employee not found!")
             return
@@ -219,51 +287,134 @@ class EmployeeScript(DatabaseConnectionMixin):
     def delete_employee(self):
         """Delete an existing employee."""
         employee_code = input("Enter the employee code to delete: ")
-        employee = self.session.query(Employee).filter(Employee.code == employee_code).first()
+        employee_id = self.session.scalar(select(Employee.id).where(Employee.code == employee_code))
 
-        if not employee:
+        if not employee_id:
             print("Employee not found!")
             return
 
-        confirm = input("Are you sure you want to delete this employee? (yes/no): ").lower()
-        if confirm in ['yes', 'y']:
-            self.check_out_usages(employee)
-            self.session.delete(employee)
+        confirmed = input("Are you sure you want to delete this employee? (yes/no): ").lower()
+        if confirmed in ['yes', 'y']:
+            # The devices of the employee are checked out first, its usages and archived usages keep
+            # the history without the employee, as with bulk delete.
+            delete_employees(self.session, [Employee.id == employee_id])
             self.session.commit()
             print(f"Employee {employee_code} deleted.")
         else:
             print("Deletion cancelled.")
 
-    def check_out_usages(self, employee):
-        """Check out usages for employee."""
-        usages = self.session.query(Usage).filter(
-            Usage.employee_id == employee.id, Usage.type == UsageCheck.CHECK_IN).all()
-        if not usages:
+    def bulk_selection(self):
+        """
+        Reads the employees a bulk command works on: codes as arguments or in a file, or a code prefix.
+
+        Returns:
+            list | None: The WHERE clauses, see bulk.selections, None if nothing was selected.
+        """
+        try:
+            codes = read_codes(self.arguments, self.options.get("file"))
+        except OSError as error:
+            print(error)
+            return None
+
+        criteria = []
+        if self.options.get("prefix"):
+            criteria.append(Employee.code.startswith(self.options["prefix"], autoescape=True))
+
+        clauses = selections(Employee, codes, criteria)
+        if not clauses:
+            print("Enter employee codes, --file or --prefix.")
+            return None
+        return clauses
+
+    def bulk_delete(self):
+        """
+        Delete many employees with a few set based statements in one transaction.
+
+        Arguments:
+            Employee codes.
+
+        Options:
+            --file (str): A file with one employee code per line.
+            --prefix (str): Only employees whose code starts with this.
+            --yes: Do not ask for confirmation.
+        """
+        clauses = self.bulk_selection()
+        if clauses is None:
+            return
+
+        count = count_selected(self.session, Employee, clauses)
+        if not count:
+            print("No employees found.")
+            return
+        if not confirm(self.options, f"Are you sure you want to delete {count} employees? (yes/no): "):
+            print("Deletion cancelled.")
+            return
+
+        counts = delete_employees(self.session, clauses)
+        self.session.commit()
+        print(f"Deleted {counts['employees']} employees, checked out {counts['checked_out']} devices, "
+              f"kept {counts['usages']} usages and {counts['archived']} archived usages without the employee.")
+
+    def bulk_check_out(self):
+        """
+        Check out every device held by many employees with set based statements in one transaction.
+
+        Arguments:
+            Employee codes.
+
+        Options:
+            --file (str): A file with one employee code per line.
+            --prefix (str): Only employees whose code starts with this.
+        """
+        clauses = self.bulk_selection()
+        if clauses is None:
             return
 
-        for usage in usages:
-            usage.type = UsageCheck.CHECK_OUT
+        checked_out = check_out_employees(self.session, clauses)
+        self.session.commit()
+        print(f"Checked out {checked_out} devices.")
 
 
-def main():
-    """This function runs the script."""
+def main(argv=None):
+    """
+    This function runs the script.
+
+    Args:
+        argv (list | None): The command line with the script name, sys.argv if None.
+    """
+    argv = sys.argv if argv is None else argv
 
     slash = 100
-    print("-" * slash + "\n")
+    args, options = parse_options(argv[1:])
+    command = args[0].lower() if args else ""
+    # The machine readable formats write only the data to stdout.
+    banner = options.get("format") not in MACHINE_FORMATS
+
+    if banner:
+        print("-" * slash + "\n")
+
+    if len(argv) < 2:
+        print("Usage: python employees.py\nlist [--limit N] [--after CODE] [--stream] [--format table | csv | tsv | jsonl] | add | update | delete"
+              "\nsearch WORDS [--limit N] [--offset N] [--format table | csv | tsv | jsonl]"
+              "\nbulk_delete [CODE ...] [--file FILE] [--prefix PREFIX] [--yes] | bulk_check_out [CODE ...] [--file FILE] [--prefix PREFIX]"
+              "\n[--profile | --profile=json] prints where the time of a command goes")
+        return
 
-    if len(sys.argv) < 2:
-        print("Usage: python employees.py\nlist | add | update | delete")
+    if options.get("format") not in (None, *OUTPUT_FORMATS):
+        print(f"Invalid format: {options['format']}. Valid formats: {', '.join(OUTPUT_FORMATS)}.")
         return
 
-    command = sys.argv[1].lower()
-    with EmployeeScript() as es:
+    with profiled(options.get("profile"), f"employees {' '.join(args)}"), EmployeeScript() as es:
+        es.options = options
+        es.arguments = args[1:]
         if command not in es.commands:
-            print(f"Invalid command: {command}. Valid commands:\nlist | add | update | delete")
+            print(f"Invalid command: {command}. Valid commands:\nlist | search | add | update | delete | bulk_delete | bulk_check_out")
             return
 
         es.commands[command]()
 
-        print("\n" + "-" * slash)
+        if banner:
+            print("\n" + "-" * slash)
 
 
 if __name__ == "__main__":
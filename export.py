@@ -0,0 +1,215 @@
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+import uuid
+
+from sqlalchemy import select, union_all
+from models import Employee, Device, Usage, UsageArchive
+from archive import reaches_archive
+from readers import guid_text, after_key
+from choices import UsageCheck
+from cli import parse_datetime
+
+FORMATS = ("csv", "jsonl")
+EXPORT_CHUNK_SIZE = 10_000
+
+COLUMNS = (
+    "usage_id", "date", "type", "employee_code", "employee_first_name", "employee_last_name",
+    "device_code", "device_description", "device_brand", "device_type", "checked_out_at",
+)
+
+
+def usage_columns(model):
+    """The columns of an exported usage, in the order of COLUMNS, see row_values."""
+
+    return (
+        guid_text(model.id).label("id"), model.date.label("date"), model.type.label("type"),
+        Employee.code, Employee.first_name, Employee.last_name,
+        Device.code, Device.description, Device.brand, Device.type,
+        model.checked_out_at.label("checked_out_at"),
+    )
+
+
+def build_query(filters, after=None, archive=False):
+    """
+    Builds the export query ordered by (date, id).
+
+    Args:
+        filters (dict): "from", "to" (datetime), "employee", "device" (code) and "type" ("in" | "out").
+        after (tuple | None): (date, id) of the last exported row, the export continues after it.
+        archive (bool): If True, archived usages are exported with the usage table.
+
+    Returns:
+        Select: The query.
+    """
+
+    def source(model):
+        query = (
+            select(*usage_columns(model))
+            .outerjoin(Employee, Employee.id == model.employee_id)
+            .outerjoin(Device, Device.id == model.device_id)
+        )
+
+        if filters.get("from"):
+            query = query.where(model.date >= filters["from"])
+        if filters.get("to"):
+            query = query.where(model.date < filters["to"])
+        if filters.get("employee"):
+            query = query.where(Employee.code == filters["employee"])
+        if filters.get("device"):
+            query = query.where(Device.code == filters["device"])
+        if filters.get("type"):
+            query = query.where(model.type == (UsageCheck.CHECK_IN if filters["type"] == "in" else UsageCheck.CHECK_OUT))
+
+        if after:
+            query = query.where(after_key(model, *after))
+        return query
+
+    if archive:
+        return union_all(source(Usage), source(UsageArchive)).order_by("date", "id")
+    return source(Usage).order_by(Usage.date, Usage.id)
+
+
+def row_values(row):
+    # Rows of usage_columns, read by position.
+    return (
+        str(row[0]), row[1].isoformat() if row[1] else None, row[2].value[1],
+        row[3], row[4], row[5],
+        row[6], row[7], row[8].value[1] if row[8] else None, row[9].value[1] if row[9] else None,
+        row[10].isoformat() if row[10] else None,
+    )
+
+
+def encode_chunk(rows, export_format, header=False):
+    """
+    Encodes rows as CSV or JSONL.
+
+    Returns:
+        bytes: The encoded rows.
+    """
+    buffer = io.StringIO()
+    if export_format == "csv":
+        writer = csv.writer(buffer)
+        if header:
+            writer.writerow(COLUMNS)
+        writer.writerows(row_values(row) for row in rows)
+    else:
+        for row in rows:
+            buffer.write(json.dumps(dict(zip(COLUMNS, row_values(row)))))
+            buffer.write("\n")
+    return buffer.getvalue().encode("utf-8")
+
+
+class Checkpoint:
+    """
+    Progress of a resumable export, stored next to the output file.
+
+    After every chunk the output is flushed and the checkpoint records the last exported
+    (date, id), the number of rows and the size of the output. A resumed export truncates
+    the output to that size, so rows written after the checkpoint are not duplicated.
+    """
+
+    def __init__(self, output):
+        self.path = output + ".checkpoint"
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, encoding="utf-8") as file:
+            return json.load(file)
+
+    def save(self, state):
+        with open(self.path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.path + ".tmp", self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def export_usages(connection, filters, export_format="csv", output=None, compress=False, resume=False):
+    """
+    Streams usages joined with employees and devices to CSV or JSONL.
+
+    Rows are read with a server side cursor in chunks and written as they arrive, so memory use
+    does not depend on the number of rows. With gzip every chunk is written as its own gzip
+    member, the concatenated members are one valid gzip file.
+
+    Args:
+        connection (Connection): The database connection.
+        filters (dict): See build_query.
+        export_format (str): "csv" or "jsonl".
+        output (str | None): The output file, stdout if None.
+        compress (bool): If True, the output is gzip compressed.
+        resume (bool): If True, continue an interrupted export of the same output file.
+
+    Returns:
+        int: The total number of exported rows.
+    """
+    checkpoint = Checkpoint(output) if output else None
+    state = checkpoint.load() if checkpoint and resume else None
+    saved_filters = {name: str(value) for name, value in filters.items() if value}
+    saved_options = {"format": export_format, "gzip": compress}
+
+    if state and (state["filters"] != saved_filters or state["options"] != saved_options):
+        raise ValueError("The checkpoint was written with other filters or options, export without --resume.")
+
+    after = None
+    rows_total, offset = 0, 0
+    if state:
+        after = (parse_datetime(state["date"]), uuid.UUID(state["id"]))
+        rows_total, offset = state["rows"], state["offset"]
+
+    if output:
+        target = open(output, "r+b" if state else "wb")
+        target.truncate(offset)
+        target.seek(offset)
+    else:
+        sys.stdout.flush()
+        target = sys.stdout.buffer
+
+    # The archive only holds closed usages, it is read when the date range reaches back into it.
+    archive = filters.get("type") != "in" and reaches_archive(connection, filters.get("from"))
+    result = connection.execution_options(stream_results=True, yield_per=EXPORT_CHUNK_SIZE).execute(
+        build_query(filters, after, archive)
+    )
+
+    try:
+        header = not state
+        for chunk in result.partitions():
+            data = encode_chunk(chunk, export_format, header=header)
+            header = False
+            target.write(gzip.compress(data) if compress else data)
+            target.flush()
+            rows_total += len(chunk)
+
+            if checkpoint:
+                os.fsync(target.fileno())
+                checkpoint.save({
+                    "date": chunk[-1][1].isoformat(),
+                    "id": str(chunk[-1][0]),
+                    "rows": rows_total,
+                    "offset": target.tell(),
+                    "filters": saved_filters,
+                    "options": saved_options,
+                })
+
+        if header:
+            # Nothing was exported, a CSV file still gets its header.
+            data = encode_chunk([], export_format, header=True)
+            target.write(gzip.compress(data) if compress else data)
+    finally:
+        if output:
+            target.close()
+        else:
+            target.flush()
+
+    if checkpoint:
+        checkpoint.remove()
+    return rows_total
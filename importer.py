@@ -0,0 +1,255 @@
+import csv
+import json
+import os
+from abc import ABC, abstractmethod
+from itertools import islice
+
+from sqlalchemy import select, insert
+from models import Employee, Device
+from choices import BrandType, DeviceType, get_type_by_name
+from validators import name_error, email_error
+
+CHUNK_SIZE = 1000
+# Maximum number of bound values in one IN (...) list, below the 999 parameters of older SQLite builds.
+IN_CHUNK_SIZE = 900
+
+EMPLOYEE_FIELDS = ("first_name", "last_name", "email", "code")
+DEVICE_FIELDS = ("description", "brand", "type", "code")
+
+
+def read_rows(path):
+    """
+    Streams rows from a CSV or JSONL file.
+
+    Args:
+        path (str): The path to a .csv or .jsonl file.
+
+    Yields:
+        tuple: (line number, row dict).
+    """
+    extension = os.path.splitext(path)[1].lower()
+
+    with open(path, newline="", encoding="utf-8") as file:
+        if extension == ".csv":
+            # Header is line 1, so data rows start at line 2.
+            for line_number, row in enumerate(csv.DictReader(file), start=2):
+                yield line_number, row
+        elif extension in (".jsonl", ".ndjson"):
+            for line_number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield line_number, row if isinstance(row, dict) else None
+        else:
+            raise ValueError(f"Unsupported file type: {extension}. Use .csv or .jsonl.")
+
+
+def chunks(rows, size=CHUNK_SIZE):
+    """Splits an iterable of rows into lists of at most size rows."""
+
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def clean_employee(row):
+    """
+    Validates an employee row.
+
+    Args:
+        row (dict): The raw row from the file.
+
+    Returns:
+        tuple: (values dict, None) if the row is valid, otherwise (None, error message).
+    """
+    values = {field: str(row.get(field) or "").strip() for field in EMPLOYEE_FIELDS}
+    values["first_name"] = values["first_name"].title()
+    values["last_name"] = values["last_name"].title()
+
+    error = (name_error("First name", values["first_name"])
+             or name_error("Last name", values["last_name"])
+             or email_error(values["email"]))
+    if error:
+        return None, error
+
+    if not values["code"]:
+        return None, "Invalid code."
+
+    return values, None
+
+
+def clean_device(row):
+    """
+    Validates a device row.
+
+    Args:
+        row (dict): The raw row from the file.
+
+    Returns:
+        tuple: (values dict, None) if the row is valid, otherwise (None, error message).
+    """
+    values = {field: str(row.get(field) or "").strip() for field in DEVICE_FIELDS}
+    values["description"] = values["description"].capitalize()
+
+    values["brand"] = get_type_by_name(name=values["brand"], enum_class=BrandType) if values["brand"] else None
+    if not values["brand"]:
+        return None, "Invalid brand. Valid brands: " + ", ".join(brand.value[0] for brand in BrandType)
+
+    values["type"] = get_type_by_name(name=values["type"], enum_class=DeviceType) if values["type"] else None
+    if not values["type"]:
+        return None, "Invalid device type. Valid types: " + ", ".join(device.value[0] for device in DeviceType)
+
+    if not values["code"] or len(values["code"]) > 10:
+        return None, "Invalid code. The code must be 1 to 10 characters long."
+
+    return values, None
+
+
+class Importer(ABC):
+    """
+    Base bulk importer, subclasses define the model, the row cleaning and the unique columns.
+    """
+
+    model = None
+    unique_fields = ()
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.imported = 0
+        self.rejected = []
+
+    @abstractmethod
+    def clean(self, row):
+        """
+        Validates and normalizes a row.
+
+        Returns:
+            tuple: (values, None) for a valid row, (None, error message) otherwise.
+        """
+
+    def existing_values(self, chunk):
+        """
+        Loads the unique values of a chunk that are already in the database, IN_CHUNK_SIZE values per query.
+
+        Args:
+            chunk (list): The valid rows of the chunk.
+
+        Returns:
+            dict: Field name -> set of values already used.
+        """
+        existing = {}
+        for field in self.unique_fields:
+            column = getattr(self.model, field)
+            existing[field] = set()
+            for values in chunks({row[field] for row in chunk}, IN_CHUNK_SIZE):
+                existing[field].update(self.connection.scalars(select(column).where(column.in_(values))))
+        return existing
+
+    def import_chunk(self, chunk):
+        """Validates a chunk of (line number, row) pairs and bulk inserts the accepted rows."""
+
+        valid = []
+        for line_number, row in chunk:
+            if row is None:
+                self.rejected.append((line_number, "Malformed row."))
+                continue
+
+            values, error = self.clean(row)
+            if error:
+                self.rejected.append((line_number, error))
+                continue
+            valid.append((line_number, values))
+
+        if not valid:
+            return
+
+        existing = self.existing_values([values for _, values in valid])
+        accepted = []
+        for line_number, values in valid:
+            duplicate = next((field for field in self.unique_fields if values[field] in existing[field]), None)
+            if duplicate:
+                self.rejected.append((line_number, f"The {duplicate} {values[duplicate]} is already in use."))
+                continue
+
+            # Rows later in the same chunk must not reuse the values of this one.
+            for field in self.unique_fields:
+                existing[field].add(values[field])
+            accepted.append(values)
+
+        if accepted:
+            self.connection.execute(insert(self.model), accepted)
+            self.imported += len(accepted)
+
+    def run(self, path):
+        """Imports the file chunk by chunk."""
+
+        for chunk in chunks(read_rows(path)):
+            self.import_chunk(chunk)
+
+
+class EmployeeImporter(Importer):
+    """Bulk importer for the employees table."""
+
+    model = Employee
+    unique_fields = ("code", "email")
+
+    def clean(self, row):
+        return clean_employee(row)
+
+
+class DeviceImporter(Importer):
+    """Bulk importer for the devices table."""
+
+    model = Device
+    unique_fields = ("code",)
+
+    def clean(self, row):
+        return clean_device(row)
+
+
+IMPORTERS = {
+    "employees": EmployeeImporter,
+    "devices": DeviceImporter,
+}
+
+
+def guess_kind(path):
+    """
+    Guesses the imported table from the file name.
+
+    Args:
+        path (str): The path to the file.
+
+    Returns:
+        str | None: "employees", "devices" or None if the name does not match.
+    """
+    name = os.path.basename(path).lower()
+    for kind in IMPORTERS:
+        if name.startswith(kind) or name.startswith(kind.rstrip("s")):
+            return kind
+    return None
+
+
+def import_file(engine, path, kind=None):
+    """
+    Imports employees or devices from a file in a single transaction.
+
+    Args:
+        engine (Engine): The engine of the database.
+        path (str): The path to a .csv or .jsonl file.
+        kind (str | None): "employees" or "devices", guessed from the file name if None.
+
+    Returns:
+        Importer: The finished importer with the imported count and the rejected rows.
+    """
+    kind = kind or guess_kind(path)
+    if kind not in IMPORTERS:
+        raise ValueError(f"Cannot tell what {path} contains. Valid kinds: {', '.join(IMPORTERS)}.")
+
+    with engine.begin() as connection:
+        importer = IMPORTERS[kind](connection)
+        importer.run(path)
+    return importer
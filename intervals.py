@@ -0,0 +1,132 @@
+from sqlalchemy import select, or_, union_all, literal_column
+from models import Employee, Device, Usage, UsageArchive
+
+# Every usage is the interval [date, checked_out_at) in which an employee held a device, open
+# while checked_out_at is NULL. The usages of one device never overlap: a device is checked
+# in again only after it was checked out. So the usage covering a time is the latest usage of
+# the device that started at or before it, one descending seek in the (device_id, date) index.
+
+
+def intervals(model):
+    """Selects the usages of a table as intervals with the employee and device codes."""
+
+    return (
+        select(
+            Employee.code.label("employee_code"),
+            Device.code.label("device_code"),
+            model.date.label("checked_in_at"),
+            model.checked_out_at.label("checked_out_at"),
+        )
+        .outerjoin(Employee, Employee.id == model.employee_id)
+        .outerjoin(Device, Device.id == model.device_id)
+    )
+
+
+def latest_start(connection, device_id, at):
+    """
+    Finds the latest usage of a device that started at or before a time.
+
+    Returns:
+        Row | None: The usage as an interval, from the usage table or the archive.
+    """
+    latest = None
+    for model in (Usage, UsageArchive):
+        row = connection.execute(
+            intervals(model)
+            .where(model.device_id == device_id, model.date <= at)
+            .order_by(model.date.desc())
+            .limit(1)
+        ).first()
+        if row is not None and (latest is None or row.checked_in_at > latest.checked_in_at):
+            latest = row
+    return latest
+
+
+def holder_at(connection, device_id, at):
+    """
+    Finds who held a device at a time.
+
+    Args:
+        connection (Connection): The connection to query.
+        device_id (UUID): The device.
+        at (datetime): The time, in UTC as the usage dates.
+
+    Returns:
+        Row | None: The usage as (employee_code, device_code, checked_in_at, checked_out_at),
+            None if the device was not checked in at that time.
+    """
+    usage = latest_start(connection, device_id, at)
+    if usage is None or (usage.checked_out_at is not None and usage.checked_out_at <= at):
+        return None
+    return usage
+
+
+def device_holders(connection, device_id, date_from=None, date_to=None):
+    """
+    Lists who held a device in a time range, ordered by check in.
+
+    The range starts at the usage that covers date_from, so only the usages in the range
+    are read.
+
+    Args:
+        connection (Connection): The connection to query.
+        device_id (UUID): The device.
+        date_from (datetime | None): The start of the range, the whole history if None.
+        date_to (datetime | None): The exclusive end of the range, open ended if None.
+
+    Returns:
+        list: The usages as (employee_code, device_code, checked_in_at, checked_out_at) rows.
+    """
+    start = None
+    if date_from is not None:
+        covering = latest_start(connection, device_id, date_from)
+        start = covering.checked_in_at if covering is not None else date_from
+
+    def in_range(model):
+        query = intervals(model).where(model.device_id == device_id)
+        if start is not None:
+            query = query.where(model.date >= start,
+                                or_(model.checked_out_at.is_(None), model.checked_out_at > date_from))
+        if date_to is not None:
+            query = query.where(model.date < date_to)
+        return query
+
+    query = union_all(in_range(Usage), in_range(UsageArchive)).order_by(literal_column("checked_in_at"))
+    return connection.execute(query).all()
+
+
+def employee_overlaps(connection, employee_id, date_from=None, date_to=None):
+    """
+    Lists the usages of an employee that overlap a time range, ordered by check in.
+
+    The usages of an employee may overlap each other, so they are read from the
+    (employee_id, checked_out_at) index: the usages that ended after date_from and the open ones.
+
+    Args:
+        connection (Connection): The connection to query.
+        employee_id (UUID): The employee.
+        date_from (datetime | None): The start of the range, the whole history if None.
+        date_to (datetime | None): The exclusive end of the range, open ended if None.
+
+    Returns:
+        list: The usages as (employee_code, device_code, checked_in_at, checked_out_at) rows.
+    """
+
+    def overlapping(model, open_usages):
+        query = intervals(model).where(model.employee_id == employee_id)
+        if open_usages:
+            query = query.where(model.checked_out_at.is_(None))
+        elif date_from is not None:
+            query = query.where(model.checked_out_at > date_from)
+        else:
+            query = query.where(model.checked_out_at.is_not(None))
+        if date_to is not None:
+            query = query.where(model.date < date_to)
+        return query
+
+    # Archived usages are always closed.
+    query = union_all(
+        overlapping(Usage, open_usages=False), overlapping(Usage, open_usages=True),
+        overlapping(UsageArchive, open_usages=False),
+    ).order_by(literal_column("checked_in_at"))
+    return connection.execute(query).all()
@@ -0,0 +1,29 @@
+from sqlalchemy import event
+from sqlalchemy.orm import raiseload
+
+# No access path loads related rows through relationships: usage listings read columns with Core
+# selects (readers.py) and deletes run set based statements (bulk.py). A query that needs related
+# rows loads them up front with loader options, strict loading catches the ones that do not.
+
+
+def add_strict_loading(orm_execute_state):
+    """Adds raiseload("*") to entity queries, relationships not loaded up front raise instead of emitting SQL."""
+
+    if (orm_execute_state.is_select
+            and not orm_execute_state.is_column_load
+            and not orm_execute_state.is_relationship_load):
+        orm_execute_state.statement = orm_execute_state.statement.options(raiseload("*", sql_only=True))
+
+
+def enable_strict_loading(session_factory):
+    """
+    Makes the sessions of a session factory raise on lazy loads that would emit SQL.
+
+    Relationships already in the identity map can still be read, loader options of the query
+    take precedence over the strict default.
+
+    Args:
+        session_factory (sessionmaker): The session factory, e.g. db.SessionLocal.
+    """
+    if not event.contains(session_factory, "do_orm_execute", add_strict_loading):
+        event.listen(session_factory, "do_orm_execute", add_strict_loading)
@@ -0,0 +1,241 @@
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import select, func
+from sqlalchemy.exc import OperationalError, IntegrityError
+
+import db
+from bench import SIZES, ensure_dataset, make_engine
+from choices import UsageCheck
+from cli import parse_options
+from models import Employee, Device, Usage, DeviceHolder
+from usage import EmployeeUsageScript
+
+OPERATIONS = ("check_in", "check_out", "history")
+MAX_RETRIES = 10
+
+
+def percentile(values, share):
+    """Returns the value below which the share of the sorted values lies."""
+
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def is_locked(error):
+    return "database is locked" in str(error) or "database is busy" in str(error)
+
+
+def worker(path, start_at, duration, mix, employee_codes, device_codes, seed):
+    """
+    Runs a random mix of kiosk operations against the database until the duration ends.
+
+    Args:
+        path (str): The SQLite database file.
+        start_at (float): The time.time() when all workers start.
+        duration (float): The run time in seconds.
+        mix (tuple): Weights of check_in, check_out and history.
+        employee_codes (list): The employees the kiosks use.
+        device_codes (list): The devices the kiosks scan, a small list means more contention.
+        seed (int): The random seed of the worker.
+
+    Returns:
+        dict: Latencies per operation, outcome counts and lock retries.
+    """
+    engine = make_engine(path)
+    db.SessionLocal.configure(bind=engine)
+    rng = random.Random(seed)
+
+    latencies = {operation: [] for operation in OPERATIONS}
+    outcomes = {"ok": 0, "conflict": 0, "integrity_error": 0, "failed": 0}
+    locked_retries = 0
+    # Devices this kiosk checked in, so check outs mostly hit held devices.
+    held = []
+
+    def run(operation):
+        with EmployeeUsageScript() as script:
+            if operation == "history":
+                script.load_employee(rng.choice(employee_codes))
+                script.options = {"limit": "50"}
+                script.get_usages_with_device_info().all()
+                return True
+
+            if operation == "check_out" and held:
+                employee_code, device_code = held.pop(rng.randrange(len(held)))
+            else:
+                employee_code, device_code = rng.choice(employee_codes), rng.choice(device_codes)
+
+            # Check ins and check outs read the employee and device from the database, as the commands do.
+            script.load_employee(employee_code, cached=False)
+            script.load_device(device_code, cached=False)
+            if operation == "check_in":
+                ok, _ = script.check_in_device()
+                if ok:
+                    held.append((employee_code, device_code))
+            else:
+                ok, _ = script.check_out_device()
+            return ok
+
+    time.sleep(max(0.0, start_at - time.time()))
+    stop_at = start_at + duration
+
+    while time.time() < stop_at:
+        operation = rng.choices(OPERATIONS, weights=mix)[0]
+        started = time.perf_counter()
+
+        for attempt in range(MAX_RETRIES):
+            try:
+                ok = run(operation)
+                outcomes["ok" if ok else "conflict"] += 1
+                break
+            except OperationalError as error:
+                if not is_locked(error):
+                    outcomes["failed"] += 1
+                    break
+                locked_retries += 1
+            except IntegrityError:
+                # Another kiosk took the device between the check and the insert.
+                outcomes["integrity_error"] += 1
+                break
+        else:
+            outcomes["failed"] += 1
+
+        latencies[operation].append((time.perf_counter() - started) * 1000)
+
+    engine.dispose()
+    return {"latencies": latencies, "outcomes": outcomes, "locked_retries": locked_retries}
+
+
+def find_anomalies(path):
+    """
+    Checks the check in state after the run.
+
+    Returns:
+        dict: Devices with several open usages, holders without an open usage and open usages without a holder.
+    """
+    engine = make_engine(path)
+    with engine.connect() as connection:
+        open_usages = (
+            select(Usage.device_id)
+            .where(Usage.type == UsageCheck.CHECK_IN, Usage.device_id.is_not(None))
+            .group_by(Usage.device_id)
+            .having(func.count() > 1)
+            .subquery()
+        )
+        anomalies = {
+            "double_check_in_devices": connection.scalar(select(func.count()).select_from(open_usages)),
+            "holders_without_open_usage": connection.scalar(
+                select(func.count()).select_from(DeviceHolder)
+                .join(Usage, Usage.id == DeviceHolder.usage_id)
+                .where(Usage.type != UsageCheck.CHECK_IN)
+            ),
+            "open_usages_without_holder": connection.scalar(
+                select(func.count()).select_from(Usage)
+                .outerjoin(DeviceHolder, DeviceHolder.usage_id == Usage.id)
+                .where(Usage.type == UsageCheck.CHECK_IN, Usage.device_id.is_not(None),
+                       DeviceHolder.usage_id.is_(None))
+            ),
+        }
+    engine.dispose()
+    return anomalies
+
+
+def main(argv=None):
+    """
+    Runs the load test.
+
+    Usage: python loadtest.py [--workers 4] [--duration 10] [--mix 45,45,10] [--hot-devices 50]
+                              [--size tiny | --database path] [--seed 42] [--output loadtest.json]
+    """
+    argv = sys.argv if argv is None else argv
+    _, options = parse_options(argv[1:])
+
+    workers = int(options.get("workers", 4))
+    duration = float(options.get("duration", 10))
+    mix = tuple(float(weight) for weight in options.get("mix", "45,45,10").split(","))
+    hot_devices = int(options.get("hot_devices", 50))
+    seed = int(options.get("seed", 42))
+    size = options.get("size", "tiny")
+
+    if len(mix) != len(OPERATIONS):
+        print(f"Invalid mix: the weights of {', '.join(OPERATIONS)} are required.")
+        return
+    if size not in SIZES:
+        print(f"Invalid size: {size}. Valid sizes: {', '.join(SIZES)}")
+        return
+
+    source = options.get("database") or ensure_dataset(size, seed)
+    # The load test writes, so it runs on a copy of the database.
+    path = source + ".loadtest"
+    shutil.copyfile(source, path)
+
+    engine = make_engine(path)
+    rng = random.Random(seed)
+    with engine.connect() as connection:
+        employee_codes = list(connection.scalars(select(Employee.code)))
+        device_codes = list(connection.scalars(select(Device.code)))
+    engine.dispose()
+    device_codes = rng.sample(device_codes, min(hot_devices, len(device_codes)))
+
+    print(f"{workers} workers, {duration:.0f} s, mix {mix}, {len(device_codes)} hot devices, "
+          f"engine profile {db.ENGINE_PROFILE}", flush=True)
+
+    start_at = time.time() + 1.0
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = [
+            executor.submit(worker, path, start_at, duration, mix, employee_codes, device_codes, seed + index)
+            for index in range(workers)
+        ]
+        results = [future.result() for future in futures]
+
+    latencies = {operation: [] for operation in OPERATIONS}
+    outcomes = {}
+    for result in results:
+        for operation, values in result["latencies"].items():
+            latencies[operation].extend(values)
+        for outcome, count in result["outcomes"].items():
+            outcomes[outcome] = outcomes.get(outcome, 0) + count
+
+    total = sum(len(values) for values in latencies.values())
+    report = {
+        "workers": workers,
+        "duration_s": duration,
+        "mix": dict(zip(OPERATIONS, mix)),
+        "hot_devices": len(device_codes),
+        "engine_profile": db.ENGINE_PROFILE,
+        "operations": total,
+        "throughput_per_s": round(total / duration, 1),
+        "latency_ms": {
+            operation: {
+                "count": len(values),
+                "p50": round(percentile(values, 0.50), 3) if values else None,
+                "p99": round(percentile(values, 0.99), 3) if values else None,
+            }
+            for operation, values in latencies.items()
+        },
+        "outcomes": outcomes,
+        "locked_retries": sum(result["locked_retries"] for result in results),
+        "anomalies": find_anomalies(path),
+    }
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.unlink(path + suffix)
+
+    print(json.dumps(report, indent=2))
+    if options.get("output"):
+        with open(options["output"], "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, select, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from models import Employee, Device
+from importer import chunks
+from settings import LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL
+
+# Lookups by code (and by email) are cached per database as code -> id plus the column values of
+# the row, so a hit builds the instance in the session without SQL. Only rows that exist are
+# cached, a code that is not found is always looked up again.
+# Entries are dropped when a session flushes a change of the row or runs a bulk UPDATE / DELETE
+# of its table. Changes made by other processes are seen at the latest after LOOKUP_CACHE_TTL,
+# so only reads use cached rows: paths that write usages, holders or the row itself look it up
+# with cached=False and never write for an employee or device another process deleted.
+
+# The unique columns rows are looked up by.
+LOOKUP_KEYS = {
+    Employee: ("code", "email"),
+    Device: ("code",),
+}
+
+
+class LookupCache:
+    """
+    Bounded LRU cache of (database, model, column, value) -> (id, column values).
+
+    Thread safe, the command server shares one cache between its commands.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.keys_by_id = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns:
+            tuple | None: (id, column values), None if the key is not cached or expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[2] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                return None
+
+            self.entries.move_to_end(key)
+            return entry[0], entry[1]
+
+    def put(self, database, model, values):
+        """Caches a row under every lookup key of its model."""
+
+        if not self.size:
+            return
+
+        expires = time.monotonic() + self.ttl
+        identity = (database, model, values["id"])
+        with self.lock:
+            self._discard(identity)
+            keys = {(database, model, column, values[column]) for column in LOOKUP_KEYS[model]
+                    if values[column] is not None}
+            for key in keys:
+                self._remove(key)
+                self.entries[key] = (values["id"], values, expires)
+            self.keys_by_id[identity] = keys
+
+            while len(self.entries) > self.size:
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, database, model, row_id=None, values=None):
+        """
+        Drops the entries of a row, by id and by the values it is looked up by.
+
+        Args:
+            database (str): The database URL.
+            model (class): Employee or Device.
+            row_id (UUID | None): The id of the row.
+            values (dict | None): The lookup column values, e.g. of a new row that takes a code.
+        """
+        with self.lock:
+            if row_id is not None:
+                self._discard((database, model, row_id))
+            for column, value in (values or {}).items():
+                self._remove((database, model, column, value))
+
+    def clear(self, model=None):
+        """Drops all entries, or the entries of one model."""
+
+        with self.lock:
+            if model is None:
+                self.entries.clear()
+                self.keys_by_id.clear()
+                return
+            for identity in [identity for identity in self.keys_by_id if identity[1] is model]:
+                self._discard(identity)
+
+    def _discard(self, identity):
+        for key in self.keys_by_id.pop(identity, ()):
+            self.entries.pop(key, None)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self.keys_by_id.get((key[0], key[1], entry[0]))
+        if keys is not None:
+            keys.discard(key)
+
+
+cache = LookupCache(LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL)
+
+
+def database_key(session):
+    """The database URL of a session, so the cache never mixes rows of two databases."""
+
+    return str(session.get_bind().url)
+
+
+def column_values(model, row):
+    return {attribute.key: getattr(row, attribute.key) for attribute in model.__mapper__.column_attrs}
+
+
+def cached_instance(session, model, values):
+    """
+    Adds a cached row to the session as a persistent instance without loading it.
+
+    A row the session already holds is returned as it is, the cached values never overwrite
+    its unsaved changes.
+    """
+    loaded = session.identity_map.get(inspect(model).identity_key_from_primary_key([values["id"]]))
+    if loaded is not None:
+        return loaded
+
+    instance = model(**values)
+    make_transient_to_detached(instance)
+    return session.merge(instance, load=False)
+
+
+def find(session, model, column, value, cached=True):
+    """
+    Looks up a row by a unique column through the cache.
+
+    Args:
+        session (Session): The database session.
+        model (class): Employee or Device.
+        column (str): "code", or "email" for employees.
+        value (str): The value to look up.
+        cached (bool): If False, the row is read from the database and the cache is refreshed.
+
+    Returns:
+        object | None: The instance in the session, None if no row has the value.
+    """
+    database = database_key(session)
+    entry = cache.get((database, model, column, value)) if cached else None
+    if entry is not None:
+        return cached_instance(session, model, entry[1])
+
+    instance = session.scalars(select(model).where(getattr(model, column) == value).limit(1)).first()
+    if instance is not None:
+        cache.put(database, model, column_values(model, instance))
+    return instance
+
+
+def find_ids(session, model, column, values, chunk_size, cached=True):
+    """
+    Resolves many values of a unique column to ids, the values not cached with one query per chunk.
+
+    Args:
+        session (Session): The database session.
+        model (class): Employee or Device.
+        column (str): "code", or "email" for employees.
+        values (set): The values to resolve.
+        chunk_size (int): The maximum number of bound values in one IN (...) list.
+        cached (bool): If False, all values are read from the database and the cache is refreshed.
+
+    Returns:
+        dict: Value -> id for the values that exist.
+    """
+    database = database_key(session)
+    ids, missing = {}, []
+    for value in values:
+        entry = cache.get((database, model, column, value)) if cached else None
+        if entry is None:
+            missing.append(value)
+        else:
+            ids[value] = entry[0]
+
+    attribute = getattr(model, column)
+    columns = [getattr(model, attribute.key) for attribute in model.__mapper__.column_attrs]
+    for chunk in chunks(missing, chunk_size):
+        for row in session.execute(select(*columns).where(attribute.in_(chunk))):
+            row_values = row._asdict()
+            ids[row_values[column]] = row_values["id"]
+            cache.put(database, model, row_values)
+    return ids
+
+
+def row_change(database, instance):
+    """The id and lookup values of a flushed instance, read from its state so nothing is loaded."""
+
+    model = type(instance)
+    state = inspect(instance)
+    row_id = state.identity[0] if state.identity else state.dict.get("id")
+    return database, model, row_id, {column: state.dict[column] for column in LOOKUP_KEYS[model] if column in state.dict}
+
+
+def invalidate_flushed(session, flush_context):
+    """Drops the rows a flush changed, they are dropped again on commit for concurrent readers."""
+
+    changed = session.info.setdefault("lookup_changes", [])
+    database = database_key(session)
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if type(instance) not in LOOKUP_KEYS:
+            continue
+        change = row_change(database, instance)
+        cache.invalidate(*change)
+        changed.append(change)
+
+
+def invalidate_committed(session):
+    for change in session.info.pop("lookup_changes", ()):
+        cache.invalidate(*change)
+
+
+def forget_changes(session, previous_transaction):
+    session.info.pop("lookup_changes", None)
+
+
+def invalidate_bulk(orm_execute_state):
+    """Drops the whole model for UPDATE and DELETE statements, their rows are not known."""
+
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ in LOOKUP_KEYS:
+            cache.clear(mapper.class_)
+
+
+def enable_lookup_cache(session_class=Session):
+    """
+    Adds the invalidation hooks to a session class, by default to all sessions.
+
+    Args:
+        session_class: The Session class or a sessionmaker.
+    """
+    for name, listener in (("after_flush", invalidate_flushed), ("after_commit", invalidate_committed),
+                           ("after_soft_rollback", forget_changes), ("do_orm_execute", invalidate_bulk)):
+        if not event.contains(session_class, name, listener):
+            event.listen(session_class, name, listener)
@@ -0,0 +1,545 @@
+import uuid
+
+from sqlalchemy import (select, insert, update, delete, func, case, inspect, text, bindparam, DateTime, String, Date, Integer, Enum,
+                        MetaData, Table, Column, ForeignKey, Index)
+from sqlalchemy.dialects import postgresql
+from models import GUID, Base, Usage, UsageArchive, DeviceHolder, SchemaVersion
+from readers import guid_text
+from search import create_search_indexes, rebuild_search_indexes, drop_search_indexes
+from settings import GUID_BINARY
+from choices import BrandType, DeviceType, UsageCheck
+
+# Rows per INSERT of a database copy.
+COPY_CHUNK_SIZE = 10_000
+
+
+def populate_device_holders(connection):
+    """
+    Fills the device holder table from the usage history.
+
+    Args:
+        connection (Connection): The connection to run the statements on.
+
+    Returns:
+        int: The number of checked in devices.
+    """
+    open_usages = connection.execute(
+        select(Usage.id, Usage.device_id, Usage.employee_id, Usage.date)
+        .where(Usage.type == UsageCheck.CHECK_IN,
+               Usage.device_id.is_not(None),
+               Usage.employee_id.is_not(None))
+        .order_by(Usage.date)
+    )
+
+    holders = {}
+    for usage in open_usages:
+        # The latest check in wins when the history holds several open usages for one device.
+        holders[usage.device_id] = {
+            "device_id": usage.device_id,
+            "employee_id": usage.employee_id,
+            "usage_id": usage.id,
+            "since": usage.date,
+        }
+
+    connection.execute(delete(DeviceHolder))
+    if holders:
+        connection.execute(insert(DeviceHolder), list(holders.values()))
+    return len(holders)
+
+
+# Every migration writes out the tables and indexes it creates as they were at its version, it
+# never creates them from models.py. A table created from the models would already have the
+# columns and indexes of later migrations, which then fail or do nothing on an old database.
+
+
+def key_tables(metadata, *names):
+    """Adds tables with only their id key to a metadata, so the tables of a migration can reference them."""
+
+    for name in names:
+        Table(name, metadata, Column("id", GUID(), primary_key=True))
+
+
+def create_index(connection, table_name, name, *columns, **options):
+    """
+    Create an index on columns of a table.
+
+    Args:
+        connection (Connection): The connection to run the statement on.
+        table_name (str): The table.
+        name (str): The name of the index.
+        columns (str): The indexed columns, in order.
+        options: Index options, e.g. unique=True or sqlite_where.
+    """
+    # The column types do not matter for CREATE INDEX.
+    table = Table(table_name, MetaData(), *(Column(column, String) for column in columns))
+    Index(name, *(table.c[column] for column in columns), **options).create(connection, checkfirst=True)
+
+
+def create_device_holder(connection):
+    """Create the device holder table and fill it from the usage history."""
+
+    metadata = MetaData()
+    key_tables(metadata, "employee", "device", "usage")
+    Table(
+        "device_holder", metadata,
+        Column("device_id", GUID(), ForeignKey("device.id", ondelete="CASCADE"), primary_key=True),
+        Column("employee_id", GUID(), ForeignKey("employee.id"), nullable=False),
+        Column("usage_id", GUID(), ForeignKey("usage.id"), nullable=False),
+        Column("since", DateTime, nullable=False),
+    ).create(connection, checkfirst=True)
+    populate_device_holders(connection)
+
+
+def create_usage_indexes(connection):
+    """Create the composite indexes used by usage lookups."""
+
+    create_index(connection, "usage", "ix_usage_employee_type_date", "employee_id", "type", "date")
+    create_index(connection, "usage", "ix_usage_device_type_employee", "device_id", "type", "employee_id")
+
+
+def create_usage_date_index(connection):
+    """Create the index of employee usage histories ordered by date."""
+
+    create_index(connection, "usage", "ix_usage_employee_date", "employee_id", "date")
+
+
+def create_open_usage_index(connection):
+    """
+    Create the unique index on open usages per device.
+
+    When the history holds several open usages for one device, the latest check in wins
+    (as in the device holder table) and the older ones are closed first.
+    """
+
+    open_usages = connection.execute(
+        select(Usage.id, Usage.device_id)
+        .where(Usage.type == UsageCheck.CHECK_IN, Usage.device_id.is_not(None))
+        .order_by(Usage.device_id, Usage.date.desc())
+    )
+
+    stale_ids, last_device_id = [], None
+    for usage in open_usages:
+        if usage.device_id == last_device_id:
+            stale_ids.append(usage.id)
+        last_device_id = usage.device_id
+
+    for start in range(0, len(stale_ids), 900):
+        connection.execute(
+            update(Usage).where(Usage.id.in_(stale_ids[start:start + 900])).values(type=UsageCheck.CHECK_OUT)
+        )
+    if stale_ids:
+        populate_device_holders(connection)
+
+    create_index(connection, "usage", "ux_usage_open_device", "device_id", unique=True,
+                 sqlite_where=text("type = 'CHECK_IN'"), postgresql_where=text("type = 'CHECK_IN'"))
+
+
+def create_usage_archive(connection):
+    """Create the usage archive table and the index used to archive closed usages."""
+
+    metadata = MetaData()
+    key_tables(metadata, "employee", "device")
+    Table(
+        "usage_archive", metadata,
+        Column("id", GUID(), primary_key=True),
+        Column("date", DateTime),
+        Column("employee_id", GUID(), ForeignKey("employee.id", ondelete="SET NULL"), nullable=True),
+        Column("device_id", GUID(), ForeignKey("device.id", ondelete="SET NULL"), nullable=True),
+        Column("type", Enum(UsageCheck), nullable=False, default=UsageCheck.CHECK_OUT),
+        Index("ix_usage_archive_employee_date", "employee_id", "date"),
+        Index("ix_usage_archive_date", "date"),
+    ).create(connection, checkfirst=True)
+    create_index(connection, "usage", "ix_usage_type_date", "type", "date")
+
+
+def create_rollup_tables(connection):
+    """Create the daily usage rollup and its high-water mark, they are filled by the first report."""
+
+    metadata = MetaData()
+    key_tables(metadata, "device")
+    Table(
+        "usage_daily", metadata,
+        Column("day", Date, primary_key=True),
+        Column("device_id", GUID(), ForeignKey("device.id", ondelete="CASCADE"), primary_key=True),
+        Column("usages", Integer, nullable=False, default=0),
+        Index("ix_usage_daily_device_day", "device_id", "day"),
+    ).create(connection, checkfirst=True)
+    Table(
+        "rollup_state", metadata,
+        Column("name", String, primary_key=True),
+        Column("high_water", DateTime),
+        Column("updated_at", DateTime),
+    ).create(connection, checkfirst=True)
+
+
+def regroup_rollup_tables(connection):
+    """
+    Replace the rollup per device and day with the rollup per day, brand and type and the device totals.
+
+    The rollup is emptied, the next report rebuilds it. The usages since a date are read with
+    a date index, so a refresh reads only the days it recounts.
+    """
+    metadata = MetaData()
+    key_tables(metadata, "device")
+    usage_daily = Table(
+        "usage_daily", metadata,
+        Column("day", Date, primary_key=True),
+        Column("brand", Enum(BrandType), primary_key=True),
+        Column("type", Enum(DeviceType), primary_key=True),
+        Column("usages", Integer, nullable=False, default=0),
+        Column("devices", Integer, nullable=False, default=0),
+    )
+    usage_device = Table(
+        "usage_device", metadata,
+        Column("device_id", GUID(), ForeignKey("device.id", ondelete="CASCADE"), primary_key=True),
+        Column("usages", Integer, nullable=False, default=0),
+        Column("days", Integer, nullable=False, default=0),
+        Column("first_day", Date),
+        Column("last_day", Date),
+    )
+
+    usage_daily.drop(connection, checkfirst=True)
+    usage_daily.create(connection)
+    usage_device.create(connection, checkfirst=True)
+    connection.execute(text("DELETE FROM rollup_state"))
+    create_index(connection, "usage", "ix_usage_date_device", "date", "device_id")
+
+
+def create_usage_checked_out_index(connection):
+    """Create the index of closed usages by check out time, which archiving reads in order."""
+
+    create_index(connection, "usage", "ix_usage_type_checked_out", "type", "checked_out_at")
+
+
+def recreate_search_indexes(connection):
+    """Replace the search indexes linked to the implicit rowids of their tables by indexes linked by id."""
+
+    drop_search_indexes(connection)
+    create_search_indexes(connection)
+
+
+def next_check_in(model, usage):
+    """The date of the first usage of the same device after a usage, a scalar subquery on one table."""
+
+    later = model.__table__.alias("later")
+    return (
+        select(later.c.date)
+        .where(later.c.device_id == usage.c.device_id, later.c.date > usage.c.date)
+        .order_by(later.c.date)
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+def backfill_checked_out_at(connection):
+    """
+    Sets the check out time of closed usages that have none.
+
+    A device is checked out at the latest when it is checked in again, so a closed usage ends
+    at the next usage of its device, in the usage table or the archive. When a closed usage has
+    no later usage, its check out time is not known. It ends at its own check in, an empty
+    interval, so no one is reported to hold the device after it.
+
+    Args:
+        connection (Connection): The connection to run the statements on.
+
+    Returns:
+        int: The number of updated usages.
+    """
+    updated = 0
+    for model in (Usage, UsageArchive):
+        usage = model.__table__
+        in_usage, in_archive = next_check_in(Usage, usage), next_check_in(UsageArchive, usage)
+        earliest = case(
+            (in_usage.is_(None), in_archive),
+            (in_archive.is_(None), in_usage),
+            (in_archive < in_usage, in_archive),
+            else_=in_usage,
+        )
+        updated += connection.execute(
+            update(usage)
+            .where(usage.c.type == UsageCheck.CHECK_OUT, usage.c.checked_out_at.is_(None))
+            .values(checked_out_at=func.coalesce(earliest, usage.c.date))
+        ).rowcount
+    return updated
+
+
+def add_usage_intervals(connection):
+    """Add the check out time to usages and archived usages, backfill it and create the interval indexes."""
+
+    column_type = DateTime().compile(dialect=connection.dialect)
+    for table in ("usage", "usage_archive"):
+        columns = {column["name"] for column in inspect(connection).get_columns(table)}
+        if "checked_out_at" not in columns:
+            connection.execute(text(f'ALTER TABLE "{table}" ADD COLUMN checked_out_at {column_type}'))
+        create_index(connection, table, f"ix_{table}_device_date", "device_id", "date")
+        create_index(connection, table, f"ix_{table}_employee_checked_out", "employee_id", "checked_out_at", "date")
+
+    backfill_checked_out_at(connection)
+
+
+def create_device_holder_index(connection):
+    """Create the index of device holders by employee."""
+
+    create_index(connection, "device_holder", "ix_device_holder_employee", "employee_id")
+
+
+# The time columns of the usage tables and the SQLite text format SQLAlchemy writes them in.
+USAGE_TIME_COLUMNS = {
+    "usage": ("date", "checked_out_at"),
+    "usage_archive": ("date", "checked_out_at"),
+    "device_holder": ("since",),
+}
+
+
+def normalize_usage_times(connection):
+    """
+    Rewrites the usage times written by the database clock in the format of SQLAlchemy.
+
+    The old default of usage dates, CURRENT_TIMESTAMP, stored 'YYYY-MM-DD HH:MM:SS', SQLAlchemy
+    binds 'YYYY-MM-DD HH:MM:SS.ffffff'. SQLite compares the text, so a usage never equalled a
+    bound date of the same second and (date, id) keysets skipped the usages of that second.
+    PostgreSQL stores timestamps, nothing to do there.
+    """
+    if connection.dialect.name != "sqlite":
+        return
+
+    for table, columns in USAGE_TIME_COLUMNS.items():
+        for column in columns:
+            connection.execute(text(
+                f'UPDATE "{table}" SET "{column}" = "{column}" || \'.000000\' WHERE length("{column}") = 19'
+            ))
+
+
+def roll_up_by_device(connection):
+    """
+    Replace the rollup per day, brand and type and the device totals by the rollup per day and device.
+
+    The new rollup also holds the seconds of every day a device was held, so reports of a date
+    range are answered from it. The rollup is emptied, the next report rebuilds it.
+    """
+    metadata = MetaData()
+    key_tables(metadata, "device")
+    usage_daily = Table(
+        "usage_daily", metadata,
+        Column("day", Date, primary_key=True),
+        Column("device_id", GUID(), ForeignKey("device.id", ondelete="CASCADE"), primary_key=True),
+        Column("usages", Integer, nullable=False, default=0),
+        Column("held_seconds", Integer, nullable=False, default=0),
+        Index("ix_usage_daily_device_day", "device_id", "day"),
+    )
+
+    Table("usage_device", metadata).drop(connection, checkfirst=True)
+    usage_daily.drop(connection, checkfirst=True)
+    usage_daily.create(connection)
+    connection.execute(text("DELETE FROM rollup_state"))
+    create_index(connection, "usage_archive", "ix_usage_archive_checked_out", "checked_out_at")
+
+
+# Ordered list of migrations: (version, description, function).
+MIGRATIONS = [
+    (1, "device holder table", create_device_holder),
+    (2, "usage lookup indexes", create_usage_indexes),
+    (3, "usage history index ordered by date", create_usage_date_index),
+    (4, "unique open usage per device", create_open_usage_index),
+    (5, "usage archive table", create_usage_archive),
+    (6, "daily usage rollup tables", create_rollup_tables),
+    (7, "usage check out times", add_usage_intervals),
+    (8, "device holder index by employee", create_device_holder_index),
+    (9, "employee and device search indexes", create_search_indexes),
+    (10, "usage rollup per day, brand and type and per device", regroup_rollup_tables),
+    (11, "usage index by check out time", create_usage_checked_out_index),
+    (12, "search indexes linked by id", recreate_search_indexes),
+    (13, "usage times stored with microseconds", normalize_usage_times),
+    (14, "usage rollup per day and device with held time", roll_up_by_device),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(connection):
+    """
+    Get the current schema version.
+
+    Args:
+        connection (Connection): The connection to the database.
+
+    Returns:
+        int: The highest applied migration version, 0 if none was applied.
+    """
+    SchemaVersion.__table__.create(connection, checkfirst=True)
+    return connection.execute(select(func.max(SchemaVersion.version))).scalar() or 0
+
+
+def migrate(engine):
+    """
+    Apply pending migrations in order, each one in its own transaction.
+
+    Args:
+        engine (Engine): The engine of the database to migrate.
+
+    Returns:
+        list: The applied migrations as (version, description) tuples.
+    """
+    with engine.begin() as connection:
+        current = get_version(connection)
+
+    applied = []
+    for version, description, migration in MIGRATIONS:
+        if version <= current:
+            continue
+
+        with engine.begin() as connection:
+            migration(connection)
+            connection.execute(insert(SchemaVersion).values(version=version, description=description))
+        applied.append((version, description))
+
+    return applied
+
+
+def create_schema(engine):
+    """
+    Create missing tables and bring the schema up to date.
+
+    Migrations only create what is missing, so running them after create_all is safe
+    for both new and existing databases.
+    """
+
+    Base.metadata.create_all(bind=engine)
+    return migrate(engine)
+
+
+def copy_insert(table, dialect):
+    """
+    Builds the INSERT of a database copy.
+
+    Keys stored as text are read as text (see readers.guid_text) and written as text, or as
+    native UUIDs on PostgreSQL, so no UUID object is built for every key of every row.
+    """
+    if GUID_BINARY:
+        return insert(table)
+
+    text_type = postgresql.UUID(as_uuid=False) if dialect.name == "postgresql" else String()
+    return insert(table).values({
+        column.name: bindparam(column.name, type_=text_type if isinstance(column.type, GUID) else column.type)
+        for column in table.columns
+    })
+
+
+def copy_database(source, target, chunk_size=COPY_CHUNK_SIZE):
+    """
+    Copies all rows of a database into another, empty database, e.g. from SQLite to PostgreSQL.
+
+    The schema of the target is created first. Tables are copied in foreign key order, every
+    table is read in chunks and written with one executemany INSERT per chunk, the indexes are
+    built after the rows are copied. All in one transaction of the target, so a failed copy
+    leaves it empty.
+
+    Args:
+        source (Engine): The engine of the database to copy.
+        target (Engine): The engine of the target database.
+        chunk_size (int): The number of rows read and inserted at once.
+
+    Returns:
+        dict: Table name -> number of copied rows.
+
+    Raises:
+        ValueError: If the target database already holds data.
+    """
+    create_schema(target)
+    tables = [table for table in Base.metadata.sorted_tables if table is not SchemaVersion.__table__]
+
+    copied = {}
+    with source.connect() as reader, target.begin() as writer:
+        for table in tables:
+            if writer.execute(select(table).limit(1)).first() is not None:
+                raise ValueError(f"The target database is not empty, table {table.name} holds rows.")
+
+        # Building the indexes once after the copy is cheaper than updating them on every insert.
+        indexes = [index for table in tables for index in table.indexes]
+        for index in indexes:
+            index.drop(writer)
+
+        for table in tables:
+            copied[table.name] = 0
+            statement = copy_insert(table, target.dialect)
+            result = reader.execution_options(yield_per=chunk_size).execute(
+                select(*(guid_text(column) if isinstance(column.type, GUID) else column for column in table.columns)))
+            for rows in result.mappings().partitions():
+                writer.execute(statement, [dict(row) for row in rows])
+                copied[table.name] += len(rows)
+
+        for index in indexes:
+            index.create(writer)
+    return copied
+
+
+def guid_columns():
+    """
+    Lists the GUID columns of all tables.
+
+    Returns:
+        list: (table name, column name) tuples.
+    """
+    return [
+        (table.name, column.name)
+        for table in Base.metadata.sorted_tables
+        for column in table.columns
+        if isinstance(column.type, GUID)
+    ]
+
+
+def convert_guid_storage(engine, binary):
+    """
+    Rewrites the UUID keys of an SQLite database in place, as 16 byte blobs or as 36 character strings.
+
+    Every key and foreign key is converted in one transaction, so the references between
+    the tables keep matching. Foreign keys are checked before the commit.
+
+    Args:
+        engine (Engine): The engine of an SQLite database.
+        binary (bool): True to convert to blobs, False to convert back to strings.
+
+    Returns:
+        int: The number of converted values.
+    """
+    if engine.dialect.name != 'sqlite':
+        raise ValueError("Only SQLite databases can be converted, PostgreSQL uses the native UUID type.")
+
+    raw_connection = engine.raw_connection()
+    try:
+        connection = raw_connection.driver_connection
+        connection.create_function("guid_to_blob", 1, lambda value: uuid.UUID(value).bytes, deterministic=True)
+        connection.create_function("guid_to_text", 1, lambda value: str(uuid.UUID(bytes=value)), deterministic=True)
+
+        function, source_type = ("guid_to_blob", "text") if binary else ("guid_to_text", "blob")
+        existing_tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+        # Keys and references are rewritten one table at a time, so they must not be checked in between.
+        foreign_keys = connection.execute("PRAGMA foreign_keys").fetchone()[0]
+        connection.execute("PRAGMA foreign_keys = OFF")
+        converted = 0
+        for table, column in guid_columns():
+            if table not in existing_tables:
+                continue
+            cursor = connection.execute(
+                f'UPDATE "{table}" SET "{column}" = {function}("{column}") WHERE typeof("{column}") = ?',
+                (source_type,)
+            )
+            converted += cursor.rowcount
+
+        if connection.execute("PRAGMA foreign_key_check").fetchone():
+            connection.rollback()
+            connection.execute(f"PRAGMA foreign_keys = {'ON' if foreign_keys else 'OFF'}")
+            raise ValueError("Foreign key check failed, the database was not converted.")
+
+        connection.commit()
+        connection.execute(f"PRAGMA foreign_keys = {'ON' if foreign_keys else 'OFF'}")
+        connection.execute("VACUUM")
+    finally:
+        raw_connection.close()
+
+    # The key tables of the search indexes still hold the ids in the old storage.
+    with engine.begin() as connection:
+        rebuild_search_indexes(connection)
+    return converted
@@ -1,14 +1,59 @@
 import uuid
+from datetime import datetime
 
-from sqlalchemy import Column, String, Enum, DateTime, ForeignKey, func
+from sqlalchemy import Column, String, Enum, Date, DateTime, ForeignKey, Integer, Index, func, text
+from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.types import TypeDecorator, CHAR, BINARY
 from choices import BrandType, DeviceType, UsageCheck
-from settings import GUID
+from settings import GUID_BINARY
 
 Base = declarative_base()
 
 
+class GUID(TypeDecorator):
+    """Platform-independent UUID type."""
+
+    impl = CHAR
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(UUID())
+        elif GUID_BINARY:
+            # For MySQL and SQLite in binary mode, use 16 bytes
+            return dialect.type_descriptor(BINARY(16))
+        else:
+            # For MySQL and SQLite, use CHAR(36)
+            return dialect.type_descriptor(CHAR(36))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return value
+
+        if not isinstance(value, uuid.UUID):
+            try:
+                value = uuid.UUID(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"The value {value} is not a valid UUID.")
+
+        if GUID_BINARY and dialect.name != 'postgresql':
+            return value.bytes
+        return str(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, uuid.UUID):
+            return value
+        try:
+            if isinstance(value, bytes):
+                return uuid.UUID(bytes=value)
+            return uuid.UUID(value)
+        except (TypeError, ValueError):
+
+            raise ValueError(f"The value {value} is not a valid UUID.")
+
+
 class Employee(Base):
     __tablename__ = 'employee'
 
@@ -47,12 +92,37 @@ class Usage(Base):
     __tablename__ = 'usage'
 
     id = Column(GUID(), primary_key=True, default=uuid.uuid4)
-    date = Column(DateTime, default=func.now())
+    # UTC from the clock of the application, as the check in and check out times written by the commands.
+    date = Column(DateTime, default=datetime.utcnow)
     employee_id = Column(GUID(), ForeignKey('employee.id'), nullable=True)
     employee = relationship("Employee", back_populates="usages")
     device_id = Column(GUID(), ForeignKey('device.id', ondelete='CASCADE'))
     device = relationship("Device", back_populates="usages")
     type = Column(Enum(UsageCheck), nullable=False, default=UsageCheck.CHECK_IN)
+    # The usage is the interval [date, checked_out_at), still open while checked_out_at is NULL.
+    checked_out_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Employee history listings and check out of all employee usages.
+        Index('ix_usage_employee_type_date', 'employee_id', 'type', 'date'),
+        # Open usage lookups for a device on check in and check out.
+        Index('ix_usage_device_type_employee', 'device_id', 'type', 'employee_id'),
+        # Employee history listings of all types ordered by date.
+        Index('ix_usage_employee_date', 'employee_id', 'date'),
+        # Usages of one type by date, e.g. exports with --type.
+        Index('ix_usage_type_date', 'type', 'date'),
+        # Archival of the usages checked out longest ago.
+        Index('ix_usage_type_checked_out', 'type', 'checked_out_at'),
+        # The usages since a date, e.g. the days the usage rollup recounts.
+        Index('ix_usage_date_device', 'date', 'device_id'),
+        # The holder of a device at a time: the latest usage of the device that started before it.
+        Index('ix_usage_device_date', 'device_id', 'date'),
+        # Usages of an employee that end after the start of a time range.
+        Index('ix_usage_employee_checked_out', 'employee_id', 'checked_out_at', 'date'),
+        # At most one open usage per device, check in relies on it to reject concurrent check ins.
+        Index('ux_usage_open_device', 'device_id', unique=True,
+              sqlite_where=text("type = 'CHECK_IN'"), postgresql_where=text("type = 'CHECK_IN'")),
+    )
 
     def __str__(self):
         return (f"Date: {self.date}"
@@ -60,6 +130,105 @@ class Usage(Base):
 
     def __repr__(self):
         return (f"Date: {self.date}"
-                f"\nEmployee code: {self.employee.code}"
-                f"\nDevice code: {self.device.code}"
+                f"\nEmployee code: {self.employee.code if self.employee else None}"
+                f"\nDevice code: {self.device.code if self.device else None}"
                 f"\nType: {self.type}")
+
+
+class UsageArchive(Base):
+    """Closed usages moved out of the usage table by "python db.py archive"."""
+
+    __tablename__ = 'usage_archive'
+
+    id = Column(GUID(), primary_key=True)
+    date = Column(DateTime)
+    employee_id = Column(GUID(), ForeignKey('employee.id', ondelete='SET NULL'), nullable=True)
+    device_id = Column(GUID(), ForeignKey('device.id', ondelete='SET NULL'), nullable=True)
+    type = Column(Enum(UsageCheck), nullable=False, default=UsageCheck.CHECK_OUT)
+    checked_out_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Employee history listings that reach into the archive.
+        Index('ix_usage_archive_employee_date', 'employee_id', 'date'),
+        # Exports of a date range.
+        Index('ix_usage_archive_date', 'date'),
+        # Holders of a device and usages of an employee in a time range, as for the usage table.
+        Index('ix_usage_archive_device_date', 'device_id', 'date'),
+        Index('ix_usage_archive_employee_checked_out', 'employee_id', 'checked_out_at', 'date'),
+        # Archived usages that reach into the days a refresh of the usage rollup recounts.
+        Index('ix_usage_archive_checked_out', 'checked_out_at'),
+    )
+
+    def __str__(self):
+        return (f"Date: {self.date}"
+                f"\nType: ({self.type})")
+
+
+class DeviceHolder(Base):
+    """Current holder of a device, one row per checked in device."""
+
+    __tablename__ = 'device_holder'
+
+    device_id = Column(GUID(), ForeignKey('device.id', ondelete='CASCADE'), primary_key=True)
+    employee_id = Column(GUID(), ForeignKey('employee.id'), nullable=False)
+    usage_id = Column(GUID(), ForeignKey('usage.id'), nullable=False)
+    since = Column(DateTime, nullable=False)
+    # Many-to-one relationships also make the unit of work insert the usage before the holder.
+    device = relationship("Device")
+    employee = relationship("Employee")
+    usage = relationship("Usage")
+
+    __table_args__ = (
+        # Check outs of all devices of an employee and the foreign key checks of employee deletes.
+        Index('ix_device_holder_employee', 'employee_id'),
+    )
+
+    def __repr__(self):
+        return f"Device: {self.device_id} Employee: {self.employee_id}"
+
+
+class UsageDaily(Base):
+    """Check ins and held time per day and device, rolled up from the usage intervals by reports.py."""
+
+    __tablename__ = 'usage_daily'
+
+    day = Column(Date, primary_key=True)
+    device_id = Column(GUID(), ForeignKey('device.id', ondelete='CASCADE'), primary_key=True)
+    # The check ins of the device that day.
+    usages = Column(Integer, nullable=False, default=0)
+    # The seconds of the day the device was held by an employee.
+    held_seconds = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # Deletes of a device and its rollup rows.
+        Index('ix_usage_daily_device_day', 'device_id', 'day'),
+    )
+
+    def __repr__(self):
+        return f"Day: {self.day} Device: {self.device_id} Usages: {self.usages}"
+
+
+class RollupState(Base):
+    """High-water mark of a rollup table, usages up to this date are rolled up."""
+
+    __tablename__ = 'rollup_state'
+
+    name = Column(String, primary_key=True)
+    high_water = Column(DateTime)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"Rollup: {self.name} High water: {self.high_water}"
+
+
+class SchemaVersion(Base):
+    """Applied schema migrations, the highest version is the current schema version."""
+
+    __tablename__ = 'schema_version'
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String)
+    applied_at = Column(DateTime, default=func.now())
+
+    def __repr__(self):
+        return f"Version: {self.version}"
@@ -0,0 +1,253 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+# Statements run at least this many times in one command are reported as a possible N+1 pattern.
+REPEATED_THRESHOLD = 5
+SLOWEST_STATEMENTS = 5
+STATEMENT_WIDTH = 120
+
+# Profiles are per thread, so commands of the command server are profiled separately.
+_local = threading.local()
+
+
+class Profile:
+    """Timings of one command: statements, connections and named sections such as rendering."""
+
+    def __init__(self, name):
+        self.name = name
+        self.statements = []
+        self.sections = defaultdict(float)
+        self.connections = 0
+        self.connect_time = 0.0
+        self.total = 0.0
+        self.startup = None
+
+    def add_statement(self, statement, duration, rows, executemany):
+        self.statements.append({"sql": statement, "ms": duration * 1000, "rows": rows, "executemany": executemany})
+
+    def repeated_statements(self):
+        """
+        Groups the statements that ran at least REPEATED_THRESHOLD times.
+
+        Returns:
+            list: (SQL, count, total ms) tuples, the most frequent first.
+        """
+        groups = defaultdict(list)
+        for statement in self.statements:
+            groups[statement["sql"]].append(statement["ms"])
+        return sorted(
+            ((sql, len(timings), sum(timings)) for sql, timings in groups.items() if len(timings) >= REPEATED_THRESHOLD),
+            key=lambda group: -group[1],
+        )
+
+    def summary(self):
+        """
+        Returns:
+            dict: The profile as JSON serializable data.
+        """
+        query_time = sum(statement["ms"] for statement in self.statements)
+        section_time = sum(self.sections.values()) * 1000
+        return {
+            "command": self.name,
+            "total_ms": round(self.total * 1000, 3),
+            "startup_ms": round(self.startup * 1000, 3) if self.startup is not None else None,
+            "connect_ms": round(self.connect_time * 1000, 3),
+            "connections": self.connections,
+            "query_ms": round(query_time, 3),
+            "queries": len(self.statements),
+            "rows": sum(statement["rows"] for statement in self.statements),
+            "sections_ms": {name: round(value * 1000, 3) for name, value in self.sections.items()},
+            "other_ms": round(self.total * 1000 - query_time - section_time - self.connect_time * 1000, 3),
+            "repeated": [
+                {"sql": sql, "count": count, "ms": round(ms, 3)} for sql, count, ms in self.repeated_statements()
+            ],
+            "statements": [{**statement, "ms": round(statement["ms"], 3)} for statement in self.statements],
+        }
+
+
+def active_profile():
+    """Returns the profile of the current thread, None if the command is not profiled."""
+
+    return getattr(_local, "profile", None)
+
+
+def short_sql(statement, width=STATEMENT_WIDTH):
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= width else statement[:width - 3] + "..."
+
+
+def process_age():
+    """Seconds since the process started, None where /proc is not available."""
+
+    try:
+        with open("/proc/self/stat") as file:
+            fields = file.read().rpartition(")")[2].split()
+        with open("/proc/uptime") as file:
+            uptime = float(file.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def print_profile(profile, mode, file=None):
+    """
+    Prints a profile as a text summary or as JSON.
+
+    Args:
+        profile (Profile): The finished profile.
+        mode (str | bool): "json" for JSON, anything else for the text summary.
+        file: The output stream, stderr if None, so profiles do not mix with command output.
+    """
+    file = file or sys.stderr
+    data = profile.summary()
+    if mode == "json":
+        print(json.dumps(data, indent=2, default=str), file=file)
+        return
+
+    lines = [f"Profile: {data['command']}", f"  total     {data['total_ms']:>10.3f} ms"]
+    if data["startup_ms"] is not None:
+        lines.append(f"  startup   {data['startup_ms']:>10.3f} ms  process start to command, mostly imports")
+    lines.append(f"  connect   {data['connect_ms']:>10.3f} ms  {data['connections']} new connections")
+    lines.append(f"  queries   {data['query_ms']:>10.3f} ms  {data['queries']} statements, {data['rows']} rows")
+    for name, value in data["sections_ms"].items():
+        lines.append(f"  {name:<9} {value:>10.3f} ms")
+    lines.append(f"  other     {data['other_ms']:>10.3f} ms  Python and ORM")
+
+    slowest = sorted(data["statements"], key=lambda statement: -statement["ms"])[:SLOWEST_STATEMENTS]
+    if slowest:
+        lines.append("Slowest statements:")
+        lines.extend(f"  {s['ms']:>9.3f} ms {s['rows']:>7} rows  {short_sql(s['sql'])}" for s in slowest)
+    if data["repeated"]:
+        lines.append(f"Repeated statements (possible N+1, {REPEATED_THRESHOLD}+ runs):")
+        lines.extend(f"  {r['count']:>6} x {r['ms']:>9.3f} ms  {short_sql(r['sql'])}" for r in data["repeated"])
+
+    print("\n".join(lines), file=file)
+
+
+@contextmanager
+def profiled(mode, name=""):
+    """
+    Profiles the statements and sections run in the block by the current thread.
+
+    Args:
+        mode (str | bool | None): The --profile option, the block is not profiled if not set.
+        name (str): The command, printed in the summary.
+    """
+    if not mode:
+        yield None
+        return
+
+    profile = Profile(name)
+    if threading.current_thread() is threading.main_thread():
+        # In the command server the process started long before the command.
+        profile.startup = process_age()
+    _local.profile = profile
+    started = time.perf_counter()
+    try:
+        yield profile
+    finally:
+        profile.total = time.perf_counter() - started
+        _local.profile = None
+        print_profile(profile, mode)
+
+
+@contextmanager
+def section(name):
+    """Adds the time spent in the block to a named section of the active profile."""
+
+    profile = active_profile()
+    if profile is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.sections[name] += time.perf_counter() - started
+
+
+class CountingCursor:
+    """DBAPI cursor proxy that counts the fetched rows of a statement."""
+
+    def __init__(self, cursor, record):
+        self._cursor = cursor
+        self._record = record
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._record["rows"] += 1
+            yield row
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._record["rows"] += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._record["rows"] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._record["rows"] += len(rows)
+        return rows
+
+
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    if active_profile() is not None and context is not None:
+        context.profile_started = time.perf_counter()
+
+
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    profile = active_profile()
+    started = getattr(context, "profile_started", None)
+    if profile is None or started is None:
+        return
+
+    selects = cursor.description is not None
+    profile.add_statement(statement, time.perf_counter() - started, 0 if selects else max(cursor.rowcount, 0), executemany)
+    if selects:
+        # Rows of a SELECT are counted as the result fetches them.
+        context.cursor = CountingCursor(cursor, profile.statements[-1])
+
+
+def before_connect(dialect, connection_record, cargs, cparams):
+    if active_profile() is not None:
+        _local.connect_started = time.perf_counter()
+
+
+def after_connect(dbapi_connection, connection_record):
+    profile = active_profile()
+    started = getattr(_local, "connect_started", None)
+    if profile is None or started is None:
+        return
+
+    _local.connect_started = None
+    profile.connections += 1
+    profile.connect_time += time.perf_counter() - started
+
+
+def instrument(engine):
+    """
+    Adds the profiling hooks to an engine, they only record while a command is profiled.
+
+    Connect time includes the connection pragmas when the engine applies them in a connect
+    listener added before this one.
+    """
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "do_connect", before_connect)
+    event.listen(engine, "connect", after_connect)
@@ -0,0 +1,55 @@
+from sqlalchemy import String, type_coerce, and_, or_
+from cli import STREAM_CHUNK_SIZE
+from settings import GUID_BINARY
+
+# Read-only listings run Core selects of the columns they print on the connection of the session.
+# The rows are plain named tuples: no ORM instances, identity map or change tracking.
+
+
+def guid_text(column):
+    """
+    Selects a GUID column as stored, without building a UUID object for every row.
+
+    Keys stored as text (and native PostgreSQL UUIDs) are returned as strings, 16 byte keys
+    still go through the GUID type.
+    """
+    if GUID_BINARY:
+        return column
+    return type_coerce(column, String).label(column.key)
+
+
+def read_rows(connection, statement, stream=False):
+    """
+    Runs a read-only select.
+
+    Args:
+        connection (Connection): The connection, e.g. session.connection().
+        statement (Select): The select of the needed columns.
+        stream (bool): If True, rows are fetched in chunks of STREAM_CHUNK_SIZE as they are read.
+
+    Returns:
+        Result: The rows as named tuples.
+    """
+    if stream:
+        connection = connection.execution_options(stream_results=True, yield_per=STREAM_CHUNK_SIZE)
+    return connection.execute(statement)
+
+
+def after_key(model, after, after_id=None):
+    """
+    Selects the usages after a (date, id) key of a history ordered by (date, id).
+
+    Usage dates are stored in one format (see migration 13), so usages that share the date of
+    the key compare equal to it and only those with a greater id follow it.
+
+    Args:
+        model: Usage or UsageArchive.
+        after (datetime): The date of the last read usage.
+        after_id (UUID | None): Its id, all usages at that date are skipped if None.
+
+    Returns:
+        ColumnElement: The WHERE clause.
+    """
+    if after_id is None:
+        return model.date > after
+    return or_(model.date > after, and_(model.date == after, model.id > after_id))
@@ -0,0 +1,198 @@
+import csv
+import json
+import sys
+from datetime import date, datetime
+from enum import Enum
+from itertools import chain, islice
+from uuid import UUID
+
+from tabulate import tabulate
+from settings import tabluate_kwargs
+from profiling import section
+
+# "table" is laid out for people, the other formats are written row by row for other tools.
+OUTPUT_FORMATS = ("table", "csv", "tsv", "jsonl")
+MACHINE_FORMATS = ("csv", "tsv", "jsonl")
+
+# A streamed table sizes its columns from the first rows, longer values later on are cut.
+SAMPLE_ROWS = 1000
+MAX_COLUMN_WIDTH = 60
+
+
+def plain_value(value):
+    """Converts a value for the machine readable formats: ISO dates, enum labels and UUID strings."""
+
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value[1] if isinstance(value.value, tuple) else value.name
+    if isinstance(value, UUID):
+        return str(value)
+    return value
+
+
+def cell_text(value):
+    return "" if value is None else str(value)
+
+
+class StreamingTable:
+    """
+    Prints a rounded grid table row by row.
+
+    Column widths are fixed up front or sampled from the first rows, so the table never
+    holds more than the sample in memory. Values wider than their column are cut with "…".
+    """
+
+    def __init__(self, headers, widths, file):
+        self.headers = headers
+        self.widths = widths
+        self.file = file
+        self.rows = 0
+
+    @classmethod
+    def sized(cls, headers, sample, widths=None, file=None):
+        """
+        Creates a table with the given widths, the other columns fit the sampled rows.
+
+        Args:
+            headers (list): The column names.
+            sample (list): The first rows as dicts.
+            widths (dict | None): Fixed widths by column name.
+            file: The output stream.
+        """
+        widths = widths or {}
+        sized = []
+        for header in headers:
+            if header in widths:
+                sized.append(widths[header])
+                continue
+            width = max([len(header)] + [len(cell_text(row.get(header))) for row in sample])
+            sized.append(min(width, MAX_COLUMN_WIDTH))
+        return cls(headers, sized, file or sys.stdout)
+
+    def border(self, left, middle, right):
+        return left + middle.join("─" * (width + 2) for width in self.widths) + right
+
+    def line(self, values):
+        cells = []
+        for value, width in zip(values, self.widths):
+            text = cell_text(value)
+            if len(text) > width:
+                text = text[:width - 1] + "…"
+            cells.append(f" {text:^{width}} ")
+        return "│" + "│".join(cells) + "│"
+
+    def write_header(self):
+        self.file.write(self.border("╭", "┬", "╮") + "\n" + self.line(self.headers) + "\n")
+
+    def write_rows(self, rows):
+        separator = self.border("├", "┼", "┤") + "\n"
+        lines = []
+        for row in rows:
+            lines.append(separator)
+            lines.append(self.line(row.get(header) for header in self.headers) + "\n")
+            self.rows += 1
+        self.file.write("".join(lines))
+
+    def write_footer(self):
+        self.file.write(self.border("╰", "┴", "╯") + "\n")
+        self.file.flush()
+
+
+def render_table(rows, stream=False, widths=None, file=None, chunk_size=SAMPLE_ROWS):
+    """
+    Prints rows as a table.
+
+    Without stream the rows are collected and laid out by tabulate. With stream the columns
+    are sized from the first chunk of rows and every chunk is printed as soon as it is read.
+
+    Returns:
+        int: The number of printed rows.
+    """
+    file = file or sys.stdout
+    if not stream:
+        data = list(rows)
+        if data:
+            with section("tabulate"):
+                table = tabulate(data, **tabluate_kwargs)
+            print(table, file=file)
+        return len(data)
+
+    rows = iter(rows)
+    sample = list(islice(rows, chunk_size))
+    if not sample:
+        return 0
+
+    with section("render"):
+        table = StreamingTable.sized(list(sample[0]), sample, widths, file)
+        table.write_header()
+        table.write_rows(sample)
+    file.flush()
+
+    while chunk := list(islice(rows, chunk_size)):
+        with section("render"):
+            table.write_rows(chunk)
+        file.flush()
+
+    table.write_footer()
+    return table.rows
+
+
+def render_delimited(rows, delimiter, file=None):
+    """Writes rows as CSV or TSV with a header line, without any layout."""
+
+    file = file or sys.stdout
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return 0
+
+    writer = csv.writer(file, delimiter=delimiter, lineterminator="\n")
+    writer.writerow(list(first))
+    count = 0
+    for row in chain((first,), rows):
+        writer.writerow([plain_value(value) for value in row.values()])
+        count += 1
+    file.flush()
+    return count
+
+
+def render_jsonl(rows, file=None):
+    """Writes every row as one JSON object per line."""
+
+    file = file or sys.stdout
+    count = 0
+    for row in rows:
+        file.write(json.dumps({key: plain_value(value) for key, value in row.items()}, default=str) + "\n")
+        count += 1
+    file.flush()
+    return count
+
+
+def render_rows(rows, output_format=None, stream=False, widths=None, file=None):
+    """
+    Prints rows as a table or in a machine readable format.
+
+    Args:
+        rows (iterable): The rows as dicts with the same keys.
+        output_format (str | None): "table" (default), "csv", "tsv" or "jsonl".
+        stream (bool): If True, a table is printed as the rows are read.
+        widths (dict | None): Fixed column widths of a streamed table by column name.
+        file: The output stream, stdout if None.
+
+    Returns:
+        int: The number of printed rows.
+
+    Raises:
+        ValueError: If the format is not valid.
+    """
+    output_format = output_format or "table"
+    if output_format == "table":
+        return render_table(rows, stream=stream, widths=widths, file=file)
+    if output_format == "csv":
+        return render_delimited(rows, ",", file=file)
+    if output_format == "tsv":
+        return render_delimited(rows, "\t", file=file)
+    if output_format == "jsonl":
+        return render_jsonl(rows, file=file)
+    raise ValueError(f"Invalid format: {output_format}. Valid formats: {', '.join(OUTPUT_FORMATS)}.")
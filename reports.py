@@ -0,0 +1,244 @@
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import select, insert, delete, func, cast, or_, and_, case, Date, union_all
+from models import Device, Usage, UsageArchive, UsageDaily, RollupState
+from choices import UsageCheck
+from importer import chunks
+from db import dialect_insert
+from settings import ROLLUP_LAG_HOURS
+
+ROLLUP_NAME = "usage_daily"
+REPORT_GROUPS = ("day", "device", "brand", "type")
+DAY_SECONDS = 24 * 60 * 60
+# Rollup rows per INSERT of a refresh.
+ROLLUP_CHUNK_SIZE = 5000
+
+
+def usage_day(connection, column):
+    """The day of a date column, SQLite stores dates as text and has no date cast."""
+
+    if connection.dialect.name == "sqlite":
+        return func.date(column, type_=Date)
+    return cast(column, Date)
+
+
+def usage_sources(date_from=None):
+    """The usages with a device of the usage and archive tables since a date."""
+
+    sources = []
+    for model in (Usage, UsageArchive):
+        source = (
+            select(model.date.label("date"), model.device_id.label("device_id")).where(model.device_id.is_not(None))
+        )
+        if date_from is not None:
+            source = source.where(model.date >= date_from)
+        sources.append(source)
+    return union_all(*sources).subquery()
+
+
+def held_intervals(date_from=None):
+    """
+    The usages with a device that were held at or after a date: the open ones and the ones checked out after it.
+
+    Returns:
+        Select: (date, checked_out_at, device_id) rows, checked_out_at is NULL while the device is held.
+    """
+    sources = []
+    for model in (Usage, UsageArchive):
+        source = select(model.date, model.checked_out_at, model.device_id).where(model.device_id.is_not(None))
+        if date_from is not None:
+            # Both halves seek an index that starts with the type, the archive only holds closed usages.
+            closed = and_(model.type == UsageCheck.CHECK_OUT, model.checked_out_at > date_from)
+            source = source.where(or_(model.type == UsageCheck.CHECK_IN, closed) if model is Usage else closed)
+        sources.append(source)
+    return union_all(*sources)
+
+
+def split_by_day(begin, end):
+    """Yields (day, seconds) for every day the interval [begin, end) covers."""
+
+    while begin < end:
+        next_day = datetime.combine(begin.date() + timedelta(days=1), time.min)
+        yield begin.date(), (min(end, next_day) - begin).total_seconds()
+        begin = next_day
+
+
+def get_mark(connection, name):
+    return connection.scalar(select(RollupState.high_water).where(RollupState.name == name))
+
+
+def set_mark(connection, name, value):
+    state = dialect_insert(connection, RollupState).values(name=name, high_water=value, updated_at=func.now())
+    connection.execute(state.on_conflict_do_update(
+        index_elements=["name"], set_={"high_water": value, "updated_at": func.now()}
+    ))
+
+
+def refresh_usage_daily(connection, rebuild=False, lag=None, now=None):
+    """
+    Recounts the days since shortly before the high-water mark into the rollup per day and device.
+
+    The usage dates are business times, a usage may be written after the last refresh with an
+    earlier date (a batch file, a kiosk that was offline). So the days from lag before the mark
+    on are deleted from usage_daily and counted again: the check ins of every device and day, and
+    the seconds of the day the device was held, from the usage intervals that reach into the
+    recounted days. A device still held is counted as held until now. Archived usages are read
+    too, so archiving does not lose usages that were not rolled up yet. Usages written later
+    than lag after their date are only counted by a rebuild.
+
+    A day leaves the recount window only after a usage newer than it by lag was rolled up, so it
+    was over when it was last recounted: a device held then was held the whole day, whenever it
+    was checked out later.
+
+    Args:
+        connection (Connection): The connection, the refresh runs in its transaction.
+        rebuild (bool): If True, the rollup is emptied and rebuilt from the whole history.
+        lag (timedelta | None): How far before the mark the days are recounted, ROLLUP_LAG_HOURS if None.
+        now (datetime | None): The end of the usages still open, in UTC, the current time if None.
+
+    Returns:
+        int: The number of recounted (day, device) rows.
+    """
+    lag = timedelta(hours=ROLLUP_LAG_HOURS) if lag is None else lag
+    now = now or datetime.utcnow()
+    start = None
+    if not rebuild:
+        high_water = get_mark(connection, ROLLUP_NAME)
+        if high_water is not None:
+            start = recount_start(high_water, lag)
+
+    # Whole days are recounted, so the new counts replace the old ones.
+    if start is None:
+        connection.execute(delete(UsageDaily))
+    else:
+        connection.execute(delete(UsageDaily).where(UsageDaily.day >= start.date()))
+
+    # (day, device_id) -> [check ins, held seconds]
+    rows = {}
+    new_usages = usage_sources(start)
+    day = usage_day(connection, new_usages.c.date)
+    check_ins = select(day, new_usages.c.device_id, func.count()).group_by(day, new_usages.c.device_id)
+    for usage_date, device_id, usages in connection.execute(check_ins):
+        rows[usage_date, device_id] = [usages, 0]
+
+    for checked_in_at, checked_out_at, device_id in connection.execute(held_intervals(start)):
+        begin = checked_in_at if start is None else max(checked_in_at, start)
+        for held_day, seconds in split_by_day(begin, checked_out_at or now):
+            rows.setdefault((held_day, device_id), [0, 0])[1] += seconds
+
+    for chunk in chunks(rows.items(), ROLLUP_CHUNK_SIZE):
+        connection.execute(insert(UsageDaily), [
+            {"day": held_day, "device_id": device_id, "usages": usages, "held_seconds": round(seconds)}
+            for (held_day, device_id), (usages, seconds) in chunk
+        ])
+
+    new_high_water = connection.scalar(select(func.max(new_usages.c.date)))
+    if new_high_water is not None:
+        set_mark(connection, ROLLUP_NAME, new_high_water)
+    return len(rows)
+
+
+def recount_start(high_water, lag):
+    """The first day a refresh recounts, as a datetime at midnight."""
+
+    return datetime.combine((high_water - lag).date(), time.min)
+
+
+def report_period(connection, date_from=None, date_to=None):
+    """
+    The days of a report, the rolled up days if the range is open.
+
+    Returns:
+        tuple: (first day, last day) inclusive, (None, None) if nothing was rolled up.
+    """
+    first_day, last_day = connection.execute(select(func.min(UsageDaily.day), func.max(UsageDaily.day))).one()
+    if date_from:
+        first_day = date_from.date()
+    if date_to:
+        last_day = date_to.date() - timedelta(days=1)
+    return first_day, last_day
+
+
+def usage_report(connection, by, date_from=None, date_to=None):
+    """
+    Aggregates the usage rollup by day, device, brand or device type.
+
+    Every report, with or without a date range, reads only the rollup rows of its days.
+    A day counts as a check-in day of a device when it was checked in that day. "Check-in days %"
+    is the share of such device days: the check-in days divided by the devices in the group
+    times the days of the period. "Utilization %" is the share of the time the devices were
+    held, from the usage intervals: the held hours divided by the devices times the hours of
+    the period.
+
+    Args:
+        connection (Connection): The connection to the database.
+        by (str): "day", "device", "brand" or "type".
+        date_from (datetime | None): The first day of the report.
+        date_to (datetime | None): The end of the report, exclusive.
+
+    Returns:
+        list: The report rows as dicts.
+    """
+    first_day, last_day = report_period(connection, date_from, date_to)
+    if first_day is None or last_day is None or last_day < first_day:
+        return []
+    days = (last_day - first_day).days + 1
+
+    checked_in = UsageDaily.usages > 0
+    usages = func.sum(UsageDaily.usages)
+    check_in_days = func.count(case((checked_in, 1)))
+    held = func.sum(UsageDaily.held_seconds)
+    period = (UsageDaily.day >= first_day, UsageDaily.day <= last_day)
+
+    if by == "day":
+        devices = connection.scalar(select(func.count()).select_from(Device))
+        rows = connection.execute(
+            select(UsageDaily.day, usages, check_in_days, held)
+            .where(*period).group_by(UsageDaily.day).order_by(UsageDaily.day)
+        )
+        return [
+            {"Day": day, "Check ins": total, "Devices checked in": used, "Check-in days %": percent(used, devices),
+             "Held hours": hours(seconds), "Utilization %": percent(seconds, devices * DAY_SECONDS)}
+            for day, total, used, seconds in rows
+        ]
+
+    if by == "device":
+        rows = connection.execute(
+            select(Device.code, Device.description, Device.brand, Device.type, usages, check_in_days,
+                   func.min(case((checked_in, UsageDaily.day))), func.max(case((checked_in, UsageDaily.day))), held)
+            .join(Device, Device.id == UsageDaily.device_id)
+            .where(*period)
+            .group_by(Device.id, Device.code, Device.description, Device.brand, Device.type)
+            .order_by(usages.desc(), Device.code)
+        )
+        return [
+            {"Device code": code, "Device description": description, "Device brand": brand.value[1],
+             "Device type": device_type.value[1], "Check ins": total, "Check-in days": used,
+             "Check-in days %": percent(used, days), "Held hours": hours(seconds),
+             "Utilization %": percent(seconds, days * DAY_SECONDS), "First day": first, "Last day": last}
+            for code, description, brand, device_type, total, used, first, last, seconds in rows
+        ]
+
+    column, heading = (Device.brand, "Device brand") if by == "brand" else (Device.type, "Device type")
+    inventory = dict(connection.execute(select(column, func.count()).group_by(column)).tuples().all())
+    rows = connection.execute(
+        select(column, usages, func.count(case((checked_in, UsageDaily.device_id)).distinct()), check_in_days, held)
+        .join(Device, Device.id == UsageDaily.device_id)
+        .where(*period)
+        .group_by(column)
+        .order_by(usages.desc())
+    )
+    return [
+        {heading: group.value[1], "Check ins": total, "Devices checked in": devices,
+         "Devices": inventory.get(group, 0), "Check-in days %": percent(used, inventory.get(group, 0) * days),
+         "Held hours": hours(seconds), "Utilization %": percent(seconds, inventory.get(group, 0) * days * DAY_SECONDS)}
+        for group, total, devices, used, seconds in rows
+    ]
+
+
+def hours(seconds):
+    return round((seconds or 0) / 3600, 1)
+
+
+def percent(part, whole):
+    return round(100 * part / whole, 1) if whole else 0.0
@@ -0,0 +1,236 @@
+import weakref
+
+from sqlalchemy import select, text, and_, or_, inspect, table, column
+from sqlalchemy.exc import OperationalError
+from models import Employee, Device
+from readers import guid_text
+
+# On SQLite employees and devices are searched in FTS5 indexes. The tables have GUID keys and
+# VACUUM may renumber their implicit rowids, so the index rows are linked to the table rows by a
+# key table: an INTEGER PRIMARY KEY, the rowid of the index row, and the id of the table row.
+# Triggers update the indexes with every insert, update and delete, so bulk imports and bulk
+# deletes keep them in sync as well.
+# Without FTS5 (PostgreSQL, or an SQLite build without it) the columns are matched with ILIKE.
+
+# Model -> the searched columns.
+SEARCH_COLUMNS = {
+    Employee: ("first_name", "last_name", "email", "code"),
+    Device: ("description", "code"),
+}
+
+# Results per page when --limit is not set.
+SEARCH_PAGE_SIZE = 20
+
+# Engine -> {model: True if its FTS5 index exists}, so a search does not read the schema each time.
+# Creating or dropping the indexes forgets the entries of the engine, the next search checks again.
+search_index_cache = weakref.WeakKeyDictionary()
+
+
+def index_name(model):
+    return f"{model.__tablename__}_search"
+
+
+def keys_name(model):
+    return f"{model.__tablename__}_search_key"
+
+
+def search_index_ddl(model):
+    """The FTS5 table of a model, its key table and the triggers that keep them in sync with the table."""
+
+    table_name, index, keys = model.__tablename__, index_name(model), keys_name(model)
+    columns = ", ".join(SEARCH_COLUMNS[model])
+    new = ", ".join(f"new.{name}" for name in SEARCH_COLUMNS[model])
+    assignments = ", ".join(f"{name} = new.{name}" for name in SEARCH_COLUMNS[model])
+    new_rowid = f"(SELECT search_rowid FROM {keys} WHERE id = new.id)"
+    old_rowid = f"(SELECT search_rowid FROM {keys} WHERE id = old.id)"
+    return [
+        f"CREATE TABLE IF NOT EXISTS {keys} (search_rowid INTEGER PRIMARY KEY, id NOT NULL UNIQUE)",
+        # Prefix indexes of 2 and 3 characters make short prefix searches as fast as whole words.
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5({columns}, "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {table_name} BEGIN "
+        f"INSERT INTO {keys}(id) VALUES (new.id); "
+        f"INSERT INTO {index}(rowid, {columns}) VALUES ({new_rowid}, {new}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {table_name} BEGIN "
+        f"DELETE FROM {index} WHERE rowid = {old_rowid}; "
+        f"DELETE FROM {keys} WHERE id = old.id; END",
+        f"CREATE TRIGGER IF NOT EXISTS {index}_update AFTER UPDATE OF {columns} ON {table_name} BEGIN "
+        f"UPDATE {index} SET {assignments} WHERE rowid = {new_rowid}; END",
+    ]
+
+
+def has_fts5(connection):
+    """Checks if the SQLite library of the connection has the FTS5 extension."""
+
+    if connection.dialect.name != "sqlite":
+        return False
+    try:
+        connection.execute(text("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(value)"))
+    except OperationalError:
+        return False
+    connection.execute(text("DROP TABLE temp.fts5_probe"))
+    return True
+
+
+def has_search_index(connection, model):
+    """Checks if the FTS5 index of a model exists, once per engine."""
+
+    if connection.dialect.name != "sqlite":
+        return False
+    indexes = search_index_cache.setdefault(connection.engine, {})
+    if model not in indexes:
+        indexes[model] = inspect(connection).has_table(index_name(model))
+    return indexes[model]
+
+
+def forget_search_indexes(connection):
+    search_index_cache.pop(connection.engine, None)
+
+
+def create_search_indexes(connection):
+    """
+    Creates the FTS5 indexes and their triggers and indexes the existing rows.
+
+    Does nothing on databases without FTS5, their searches fall back to ILIKE.
+    """
+    if not has_fts5(connection):
+        return
+
+    for model in SEARCH_COLUMNS:
+        for statement in search_index_ddl(model):
+            connection.execute(text(statement))
+    forget_search_indexes(connection)
+    rebuild_search_indexes(connection)
+
+
+def rebuild_search_indexes(connection):
+    """Indexes all rows again, e.g. after their ids were converted to another storage."""
+
+    for model in SEARCH_COLUMNS:
+        if has_search_index(connection, model):
+            table_name, index, keys = model.__tablename__, index_name(model), keys_name(model)
+            columns = ", ".join(SEARCH_COLUMNS[model])
+            values = ", ".join(f"{table_name}.{name}" for name in SEARCH_COLUMNS[model])
+            connection.execute(text(f"DELETE FROM {index}"))
+            connection.execute(text(f"DELETE FROM {keys}"))
+            connection.execute(text(f"INSERT INTO {keys}(id) SELECT id FROM {table_name}"))
+            connection.execute(text(
+                f"INSERT INTO {index}(rowid, {columns}) SELECT {keys}.search_rowid, {values} "
+                f"FROM {table_name} JOIN {keys} ON {keys}.id = {table_name}.id"
+            ))
+
+
+def drop_search_indexes(connection):
+    """Drops the search indexes, their key tables and triggers."""
+
+    if connection.dialect.name != "sqlite":
+        return
+    forget_search_indexes(connection)
+    for model in SEARCH_COLUMNS:
+        index = index_name(model)
+        for trigger in ("insert", "delete", "update"):
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {index}_{trigger}"))
+        connection.execute(text(f"DROP TABLE IF EXISTS {index}"))
+        connection.execute(text(f"DROP TABLE IF EXISTS {keys_name(model)}"))
+
+
+def search_terms(query):
+    """
+    Splits a search into terms, whitespace separates them.
+
+    Returns:
+        list: The terms, empty if the search holds only whitespace.
+    """
+    return query.split()
+
+
+def like_pattern(term):
+    """Matches a term anywhere in a value, % and _ in the term are searched as text."""
+
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def match_expression(terms):
+    """
+    Builds the FTS5 query of the terms: every term must match the start of a word.
+
+    Terms are quoted, so FTS5 operators and punctuation in them are searched as text, e.g.
+    "anna@exa" matches the tokens "anna" and "exa..." of an email next to each other.
+    """
+    return " ".join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+def search_query(connection, model, columns, terms):
+    """
+    Selects the rows matching every term, best matches first.
+
+    Args:
+        connection (Connection): The connection to query.
+        model (class): Employee or Device.
+        columns (list): The selected columns.
+        terms (list): The search terms, see search_terms.
+
+    Returns:
+        Select: The query, ranked by bm25 with an FTS5 index, ordered by code otherwise.
+    """
+    if has_search_index(connection, model):
+        index = table(index_name(model), column("rowid"), column("rank"))
+        keys = table(keys_name(model), column("search_rowid"), column("id"))
+        return (
+            select(*columns)
+            .select_from(index)
+            .join(keys, keys.c.search_rowid == index.c.rowid)
+            .join(model, model.id == keys.c.id)
+            .where(text(f"{index.name} MATCH :match").bindparams(match=match_expression(terms)))
+            .order_by(index.c.rank, model.code)
+        )
+
+    # Every term must be found in one of the columns, anywhere in the value.
+    return (
+        select(*columns)
+        .where(and_(*(
+            or_(*(getattr(model, name).ilike(like_pattern(term), escape="\\") for name in SEARCH_COLUMNS[model]))
+            for term in terms
+        )))
+        .order_by(model.code)
+    )
+
+
+def search_employees(connection, query, limit=SEARCH_PAGE_SIZE, offset=0):
+    """
+    Finds employees by the start of words in their names, email or code.
+
+    Args:
+        connection (Connection): The connection to query.
+        query (str): The search, e.g. "ann now" or "anna@example".
+        limit (int): The maximum number of employees.
+        offset (int): The number of best matches to skip, for the next pages.
+
+    Returns:
+        list: (id, first_name, last_name, email, code) rows.
+    """
+    columns = [guid_text(Employee.id), Employee.first_name, Employee.last_name, Employee.email, Employee.code]
+    terms = search_terms(query)
+    if not terms:
+        return []
+    return connection.execute(search_query(connection, Employee, columns, terms).limit(limit).offset(offset)).all()
+
+
+def search_devices(connection, query, limit=SEARCH_PAGE_SIZE, offset=0):
+    """
+    Finds devices by the start of words in their description or code.
+
+    Args:
+        connection (Connection): The connection to query.
+        query (str): The search, e.g. "lap 14".
+        limit (int): The maximum number of devices.
+        offset (int): The number of best matches to skip, for the next pages.
+
+    Returns:
+        list: (id, description, brand, type, code) rows.
+    """
+    columns = [guid_text(Device.id), Device.description, Device.brand, Device.type, Device.code]
+    terms = search_terms(query)
+    if not terms:
+        return []
+    return connection.execute(search_query(connection, Device, columns, terms).limit(limit).offset(offset)).all()
@@ -0,0 +1,149 @@
+import io
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+import traceback
+
+from sqlalchemy.orm import configure_mappers
+
+import db
+import devices
+import employees
+import usage
+from settings import SERVER_SOCKET
+
+# Script name -> function that runs the script with an argv list.
+SCRIPTS = {
+    "employees": employees.main,
+    "devices": devices.main,
+    "usage": usage.run,
+    "db": lambda argv: db.main(db.scripts, db.args_scripts, argv=argv),
+}
+
+
+class ThreadLocalStream:
+    """
+    Stand-in for sys.stdin / sys.stdout / sys.stderr that forwards to the stream of the current thread.
+
+    Each client connection is handled in its own thread, so print() and input() of the
+    scripts talk to the right client while other commands run at the same time.
+    """
+
+    def __init__(self, default):
+        self._default = default
+        self._local = threading.local()
+
+    def set(self, stream):
+        self._local.stream = stream
+
+    def clear(self):
+        self._local.stream = None
+
+    def __getattr__(self, name):
+        return getattr(getattr(self._local, "stream", None) or self._default, name)
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    """
+    Runs one command for a client.
+
+    The client sends one JSON line {"argv": ["employees", "list", ...]}, the rest of the
+    connection is the stdin of the command. The output of the command, stdout and stderr (e.g.
+    --profile and the messages of machine readable formats), is sent back and the connection is
+    closed when the command is done.
+    """
+
+    def handle(self):
+        try:
+            argv = json.loads(self.rfile.readline())["argv"]
+        except (ValueError, KeyError, TypeError):
+            self.wfile.write(b'Invalid request, expected: {"argv": [script, command, ...]}\n')
+            return
+
+        stdin = io.TextIOWrapper(self.rfile, encoding="utf-8")
+        stdout = io.TextIOWrapper(self.wfile, encoding="utf-8")
+        sys.stdin.set(stdin)
+        sys.stdout.set(stdout)
+        sys.stderr.set(stdout)
+        try:
+            self.run_command(argv)
+        finally:
+            try:
+                stdout.flush()
+            except OSError:
+                pass
+            sys.stdin.clear()
+            sys.stdout.clear()
+            sys.stderr.clear()
+
+    @staticmethod
+    def run_command(argv):
+        """
+        Runs a script command.
+
+        Args:
+            argv (list): The script name ("employees", "devices", "usage", "db") and its arguments.
+        """
+        script = os.path.splitext(os.path.basename(argv[0]))[0] if argv else ""
+        if script not in SCRIPTS:
+            print(f"Invalid script: {script}. Valid scripts:\n{' | '.join(SCRIPTS)}")
+            return
+
+        started = time.perf_counter()
+        try:
+            SCRIPTS[script]([f"{script}.py", *argv[1:]])
+        except SystemExit:
+            pass
+        except EOFError:
+            print("\nInput ended before the command was done.")
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+        finally:
+            print(f"[{script} {' '.join(argv[1:])}: {(time.perf_counter() - started) * 1000:.1f} ms]",
+                  file=sys.__stderr__)
+
+
+class CommandServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server that handles every client in its own thread."""
+
+    daemon_threads = True
+
+
+def warm_up():
+    """Configures the mappers and opens a pooled connection, so the first command is fast."""
+
+    configure_mappers()
+    with db.engine.connect() as connection:
+        connection.exec_driver_sql("SELECT 1")
+
+
+def serve(path=SERVER_SOCKET):
+    """
+    Starts the command server.
+
+    Args:
+        path (str): The path of the Unix socket.
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+
+    sys.stdin = ThreadLocalStream(sys.stdin)
+    sys.stdout = ThreadLocalStream(sys.stdout)
+    sys.stderr = ThreadLocalStream(sys.stderr)
+    warm_up()
+
+    with CommandServer(path, CommandHandler) as server:
+        print(f"Listening on {path}, stop with Ctrl+C.", file=sys.__stdout__, flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(path)
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1] if len(sys.argv) > 1 else SERVER_SOCKET)
@@ -0,0 +1,207 @@
+import csv
+import hashlib
+import heapq
+import io
+import json
+import math
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+
+from sqlalchemy import create_engine, select, make_url
+from models import Employee, Device, Usage, UsageArchive
+import export
+
+# Usage statements are written as one file per employee. The employees are split into ranges of
+# codes and every range is read with one query ordered by (employee code, date), which walks the
+# code index and the (employee_id, date) index of the usages without sorting, so a worker reads
+# its range in one pass. Ranges run in worker processes with their own read-only connection.
+
+FORMATS = ("csv", "jsonl")
+
+COLUMNS = (
+    "date", "type", "checked_out_at", "device_code", "device_description", "device_brand", "device_type",
+)
+# The rows are read and converted as export rows, a statement writes these columns of them.
+EXPORT_POSITIONS = tuple(export.COLUMNS.index(name) for name in COLUMNS)
+# The position of the employee code in an export row.
+EMPLOYEE_CODE = export.COLUMNS.index("employee_code")
+
+# Ranges per worker, smaller ranges even out workers whose employees have longer histories.
+RANGES_PER_WORKER = 4
+
+
+def read_only_engine(uri):
+    """
+    Creates an engine whose connections cannot write, for the workers of a parallel read.
+
+    SQLite files are opened with mode=ro, PostgreSQL sessions default to read only transactions.
+    """
+    url = make_url(uri)
+    if url.get_backend_name() == "sqlite":
+        path = os.path.abspath(url.database)
+        return create_engine(f"sqlite:///file:{path}?mode=ro&uri=true")
+    if url.get_backend_name() == "postgresql":
+        return create_engine(url, connect_args={"options": "-c default_transaction_read_only=on"})
+    return create_engine(url)
+
+
+def employee_ranges(connection, workers):
+    """
+    Splits the employees into ranges of codes with about the same number of employees.
+
+    Returns:
+        list: (first code, last code) tuples in code order, both codes included.
+    """
+    codes = connection.scalars(select(Employee.code).where(Employee.code.is_not(None)).order_by(Employee.code)).all()
+    if not codes:
+        return []
+    size = math.ceil(len(codes) / (workers * RANGES_PER_WORKER))
+    return [(codes[start], codes[min(start + size, len(codes)) - 1]) for start in range(0, len(codes), size)]
+
+
+def range_usages(model, first_code, last_code, date_from=None, date_to=None):
+    """Selects the usages of the employees in a range of codes, ordered by employee code and date."""
+
+    query = (
+        select(*export.usage_columns(model))
+        .join(Employee, Employee.id == model.employee_id)
+        .outerjoin(Device, Device.id == model.device_id)
+        .where(Employee.code.between(first_code, last_code))
+    )
+    if date_from:
+        query = query.where(model.date >= date_from)
+    if date_to:
+        query = query.where(model.date < date_to)
+    return query.order_by(Employee.code, model.date)
+
+
+def statement_path(directory, code, export_format):
+    """
+    The file of an employee, named after its code.
+
+    Characters that are not safe in file names are replaced. Since e.g. "A/1" and "A_1" would
+    then share a file, a replaced code gets a short hash of the code, "A_1-a5b3d27a".
+    """
+    name = re.sub(r'[^A-Za-z0-9._-]', '_', code)
+    if name != code:
+        name = f"{name}-{hashlib.sha256(code.encode('utf-8')).hexdigest()[:8]}"
+    return os.path.join(directory, f"{name}.{export_format}")
+
+
+def row_values(row):
+    """The values of a statement row, converted as export.row_values converts them."""
+
+    values = export.row_values(row)
+    return tuple(values[position] for position in EXPORT_POSITIONS)
+
+
+def encode_statement(rows, export_format):
+    """
+    Encodes the usages of one employee as CSV with a header or as JSONL.
+
+    Returns:
+        str: The statement.
+    """
+    buffer = io.StringIO()
+    if export_format == "csv":
+        writer = csv.writer(buffer)
+        writer.writerow(COLUMNS)
+        writer.writerows(row_values(row) for row in rows)
+    else:
+        for row in rows:
+            buffer.write(json.dumps(dict(zip(COLUMNS, row_values(row)))))
+            buffer.write("\n")
+    return buffer.getvalue()
+
+
+def write_range(connection, first_code, last_code, directory, export_format="csv",
+                date_from=None, date_to=None, archive=False):
+    """
+    Writes the statements of the employees in a range of codes.
+
+    Every employee gets a file, an empty statement if it has no usages in the date range.
+
+    Args:
+        connection (Connection): The connection to read.
+        first_code, last_code (str): The range of employee codes, both included.
+        directory (str): The directory of the statements.
+        export_format (str): "csv" or "jsonl".
+        date_from, date_to (datetime | None): The date range, date_to is exclusive.
+        archive (bool): If True, archived usages are read with the usage table.
+
+    Returns:
+        tuple: (number of statements, number of usages).
+    """
+    codes = connection.scalars(
+        select(Employee.code).where(Employee.code.between(first_code, last_code)).order_by(Employee.code)
+    ).all()
+    # The database orders the codes, its collation may differ from Python's string order.
+    positions = {code: position for position, code in enumerate(codes)}
+
+    reader = connection.execution_options(stream_results=True)
+    streams = [reader.execute(range_usages(Usage, first_code, last_code, date_from, date_to))]
+    if archive:
+        streams.append(reader.execute(range_usages(UsageArchive, first_code, last_code, date_from, date_to)))
+    usages = groupby(
+        heapq.merge(*streams, key=lambda row: (positions[row[EMPLOYEE_CODE]], row[1])),
+        key=lambda row: row[EMPLOYEE_CODE],
+    )
+
+    written = 0
+    next_usages = next(usages, None)
+    for code in codes:
+        rows = []
+        if next_usages is not None and next_usages[0] == code:
+            rows = list(next_usages[1])
+            next_usages = next(usages, None)
+        with open(statement_path(directory, code, export_format), "w", encoding="utf-8", newline="") as file:
+            file.write(encode_statement(rows, export_format))
+        written += len(rows)
+    return len(codes), written
+
+
+def range_worker(uri, first_code, last_code, directory, export_format, date_from, date_to, archive):
+    """Writes the statements of a range in a worker process, see write_range."""
+
+    engine = read_only_engine(uri)
+    try:
+        with engine.connect() as connection:
+            return write_range(connection, first_code, last_code, directory, export_format, date_from, date_to, archive)
+    finally:
+        engine.dispose()
+
+
+def write_statements(connection, uri, directory, export_format="csv", date_from=None, date_to=None,
+                     archive=False, workers=1):
+    """
+    Writes a usage statement file for every employee.
+
+    Args:
+        connection (Connection): The connection the employee ranges are read with.
+        uri (str): The database URI the worker processes connect to.
+        directory (str): The directory of the statements, created if it does not exist.
+        export_format (str): "csv" or "jsonl".
+        date_from, date_to (datetime | None): The date range, date_to is exclusive.
+        archive (bool): If True, archived usages are read with the usage table.
+        workers (int): The number of worker processes, 1 writes all ranges on the connection.
+
+    Returns:
+        tuple: (number of statements, number of usages).
+    """
+    os.makedirs(directory, exist_ok=True)
+    ranges = employee_ranges(connection, workers)
+    if workers == 1:
+        totals = [write_range(connection, first, last, directory, export_format, date_from, date_to, archive)
+                  for first, last in ranges]
+    else:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = [
+                executor.submit(range_worker, uri, first, last, directory, export_format, date_from, date_to, archive)
+                for first, last in ranges
+            ]
+            totals = [future.result() for future in futures]
+    return sum(total[0] for total in totals), sum(total[1] for total in totals)
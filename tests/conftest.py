@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The engine is created when db.py is imported, so the tests point it to their own database first.
+DATABASE_DIR = tempfile.mkdtemp(prefix="techtask-tests-")
+DATABASE_PATH = os.path.join(DATABASE_DIR, "test.db")
+os.environ["DATABASE_URI"] = f"sqlite:///{DATABASE_PATH}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import engine, SessionLocal  # noqa: E402
+from migrations import create_schema  # noqa: E402
+from lookups import cache  # noqa: E402
+from loaders import enable_strict_loading  # noqa: E402
+
+# The tests fail on a lazy load that emits SQL, whatever DB_STRICT_LOADING says.
+enable_strict_loading(SessionLocal)
+
+
+@pytest.fixture
+def database():
+    """A new database with the latest schema for every test, the engine bound to it."""
+
+    engine.dispose()
+    if os.path.exists(DATABASE_PATH):
+        os.remove(DATABASE_PATH)
+    cache.clear()
+    create_schema(engine)
+    yield engine
+    engine.dispose()
+    cache.clear()
+
+
+@pytest.fixture
+def session(database):
+    with SessionLocal() as session:
+        yield session
+
+
+@pytest.fixture
+def answers(monkeypatch):
+    """Feeds the answers to the input() prompts of an interactive command."""
+
+    def feed(*lines):
+        lines = iter(lines)
+        monkeypatch.setattr("builtins.input", lambda prompt="": next(lines))
+
+    return feed
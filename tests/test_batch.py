@@ -0,0 +1,66 @@
+from sqlalchemy import select, delete
+
+import batch
+from models import Employee, Device, Usage, DeviceHolder
+from choices import BrandType, DeviceType, UsageCheck
+from batch import apply_scans
+from usage import EmployeeUsageScript
+
+
+def add_rows(session):
+    session.add_all([
+        Employee(first_name="John", last_name="Doe", email="john.doe010@example.com", code="010"),
+        Employee(first_name="Jane", last_name="Smith", email="jane.smith011@example.com", code="011"),
+        Device(description="Laptop", brand=BrandType.DELL, type=DeviceType.COMPUTER, code="001"),
+    ])
+    session.commit()
+
+
+def kiosk(employee_code, device_code, check_in):
+    """Checks a device in or out as another process would, in its own session."""
+
+    with EmployeeUsageScript() as script:
+        script.load_employee(employee_code, cached=False)
+        script.load_device(device_code, cached=False)
+        return (script.check_in_device if check_in else script.check_out_device)()
+
+
+def open_usage(session, employee_code):
+    return session.scalars(
+        select(Usage).join(Employee, Employee.id == Usage.employee_id)
+        .where(Employee.code == employee_code, Usage.type == UsageCheck.CHECK_IN)
+    ).first()
+
+
+def test_batch_check_out_of_a_device_changed_by_another_kiosk(session, monkeypatch):
+    add_rows(session)
+    kiosk("010", "001", check_in=True)
+    load_holders = batch.load_holders
+    kiosks = iter([lambda: (kiosk("010", "001", check_in=False), kiosk("011", "001", check_in=True))])
+
+    def load_holders_then_change(*args, **kwargs):
+        holders = load_holders(*args, **kwargs)
+        # The device changes hands after the batch read its holder.
+        next(kiosks, lambda: None)()
+        return holders
+
+    monkeypatch.setattr(batch, "load_holders", load_holders_then_change)
+    results = apply_scans(session, [(1, "010", "001", "check_out")])
+
+    assert results == [(1, False, "Employee <010> has not checked in device <001>.")]
+    usage = open_usage(session, "011")
+    assert usage is not None
+    assert session.scalar(select(DeviceHolder.usage_id)) == usage.id
+
+
+def test_batch_check_in_of_a_device_without_holder_row(session):
+    add_rows(session)
+    kiosk("011", "001", check_in=True)
+    # An open usage whose holder row is missing, as left by older versions.
+    session.execute(delete(DeviceHolder))
+    session.commit()
+
+    results = apply_scans(session, [(1, "010", "001", "check_in")])
+
+    assert results == [(1, False, "Device <001> - already checked in!")]
+    assert open_usage(session, "010") is None
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event, select, func
+from sqlalchemy.orm import sessionmaker
+
+from db import pragma_statements
+from models import Employee, Device, Usage, UsageArchive, UsageDaily, DeviceHolder
+from choices import BrandType, DeviceType, UsageCheck
+from migrations import create_schema
+from archive import archive_usages
+from bulk import delete_employees, delete_devices, check_out_employees
+from reports import refresh_usage_daily
+from settings import ENGINE_PROFILES, COMMON_PRAGMAS
+
+# The bulk paths keep every reference valid themselves, so they leave the same rows whether the
+# ON DELETE actions of the schema run or not.
+
+
+@pytest.fixture(params=["ON", "OFF"])
+def fk_session(request, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'foreign_keys.db'}")
+    pragmas = {**ENGINE_PROFILES["safe"], **COMMON_PRAGMAS, "foreign_keys": request.param}
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        for statement in pragma_statements(pragmas):
+            dbapi_connection.execute(statement)
+
+    create_schema(engine)
+    with sessionmaker(bind=engine)() as session:
+        assert session.connection().exec_driver_sql("PRAGMA foreign_keys").scalar() == (request.param == "ON")
+        yield session
+    engine.dispose()
+
+
+def add_history(session):
+    """Two employees and devices, an old closed usage and an open usage of each employee."""
+
+    now = datetime.utcnow()
+    employees = [Employee(first_name="Emp", last_name=str(number), email=f"emp{number}@example.com", code=f"01{number}")
+                 for number in range(2)]
+    devices = [Device(description="Phone", brand=BrandType.SAMSUNG, type=DeviceType.PHONE, code=f"00{number}")
+               for number in range(2)]
+    session.add_all([*employees, *devices])
+    session.flush()
+    for employee, device in zip(employees, devices):
+        session.add(Usage(date=now - timedelta(days=800), checked_out_at=now - timedelta(days=790),
+                          employee_id=employee.id, device_id=device.id, type=UsageCheck.CHECK_OUT))
+        usage = Usage(date=now - timedelta(hours=1), employee_id=employee.id, device_id=device.id,
+                      type=UsageCheck.CHECK_IN)
+        session.add(usage)
+        session.flush()
+        session.add(DeviceHolder(device_id=device.id, employee_id=employee.id, usage_id=usage.id, since=usage.date))
+    session.commit()
+    refresh_usage_daily(session.connection())
+    session.commit()
+
+
+def assert_references_valid(session):
+    assert session.connection().exec_driver_sql("PRAGMA foreign_key_check").all() == []
+
+
+def test_bulk_deletes_with_foreign_keys(fk_session):
+    add_history(fk_session)
+    archive_usages(fk_session.get_bind(), datetime.utcnow() - timedelta(days=365))
+    assert fk_session.scalar(select(func.count()).select_from(UsageArchive)) == 2
+
+    employees = delete_employees(fk_session, [Employee.code == "010"])
+    devices = delete_devices(fk_session, [Device.code == "001"])
+    fk_session.commit()
+
+    assert employees == {"checked_out": 1, "usages": 1, "archived": 1, "employees": 1}
+    assert devices == {"checked_out": 1, "usages": 1, "archived": 1, "devices": 1}
+    assert fk_session.scalar(select(func.count()).select_from(DeviceHolder)) == 0
+    assert fk_session.scalar(select(func.count()).select_from(UsageDaily)
+                             .where(UsageDaily.device_id.not_in(select(Device.id)))) == 0
+    refresh_usage_daily(fk_session.connection(), rebuild=True)
+    fk_session.commit()
+    assert_references_valid(fk_session)
+
+
+def test_bulk_check_out_with_foreign_keys(fk_session):
+    add_history(fk_session)
+
+    assert check_out_employees(fk_session, [Employee.code.startswith("01")]) == 2
+    fk_session.commit()
+
+    assert fk_session.scalar(select(func.count()).select_from(DeviceHolder)) == 0
+    assert_references_valid(fk_session)
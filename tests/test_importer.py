@@ -0,0 +1,39 @@
+import csv
+
+from sqlalchemy import event, select, func
+
+from models import Employee
+from importer import import_file, IN_CHUNK_SIZE
+
+
+def write_employees(path, count):
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=("first_name", "last_name", "email", "code"))
+        writer.writeheader()
+        for number in range(count):
+            writer.writerow({"first_name": "John", "last_name": "Doe",
+                             "email": f"john.doe{number}@example.com", "code": f"{number:04d}"})
+
+
+def test_reimport_binds_at_most_in_chunk_size_values(database, tmp_path):
+    path = tmp_path / "employees.csv"
+    write_employees(path, 1000)
+    assert import_file(database, str(path)).imported == 1000
+
+    parameters = []
+
+    def count_parameters(connection, cursor, statement, bound, context, executemany):
+        if statement.startswith("SELECT"):
+            parameters.append(len(bound))
+
+    event.listen(database, "before_cursor_execute", count_parameters)
+    try:
+        importer = import_file(database, str(path))
+    finally:
+        event.remove(database, "before_cursor_execute", count_parameters)
+
+    assert importer.imported == 0
+    assert len(importer.rejected) == 1000
+    assert parameters and max(parameters) <= IN_CHUNK_SIZE
+    with database.connect() as connection:
+        assert connection.scalar(select(func.count()).select_from(Employee)) == 1000
@@ -0,0 +1,32 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import selectinload
+
+from models import Employee, Device, Usage
+from choices import BrandType, DeviceType, UsageCheck
+
+
+def add_usage(session):
+    employee = Employee(first_name="John", last_name="Doe", email="john.doe010@example.com", code="010")
+    device = Device(description="Xp13 laptop", brand=BrandType.DELL, type=DeviceType.COMPUTER, code="001")
+    session.add(Usage(date=datetime.utcnow(), employee=employee, device=device, type=UsageCheck.CHECK_IN))
+    session.commit()
+    session.expunge_all()
+
+
+def test_lazy_load_raises(session):
+    add_usage(session)
+    employee = session.scalars(select(Employee)).one()
+
+    with pytest.raises(InvalidRequestError):
+        employee.usages
+
+
+def test_loader_options_load_up_front(session):
+    add_usage(session)
+    employee = session.scalars(select(Employee).options(selectinload(Employee.usages))).one()
+
+    assert [usage.type for usage in employee.usages] == [UsageCheck.CHECK_IN]
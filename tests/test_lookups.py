@@ -0,0 +1,55 @@
+from sqlalchemy import select
+
+from models import Employee, Device
+from choices import BrandType, DeviceType
+from employees import EmployeeScript
+from devices import DeviceScript
+from lookups import find
+
+
+def add_rows(session):
+    session.add(Employee(first_name="John", last_name="Doe", email="john.doe010@example.com", code="010"))
+    session.add(Device(description="Xp13 laptop", brand=BrandType.DELL, type=DeviceType.COMPUTER, code="001"))
+    session.commit()
+
+
+def test_cached_find_returns_the_loaded_instance(session):
+    add_rows(session)
+    # Caches the row.
+    find(session, Employee, "code", "010")
+    session.expunge_all()
+
+    employee = find(session, Employee, "code", "010", cached=False)
+    employee.first_name = "Johnny"
+
+    assert find(session, Employee, "email", "john.doe010@example.com") is employee
+    assert employee.first_name == "Johnny"
+
+
+def test_update_employee_with_the_current_email_and_code(session, answers):
+    add_rows(session)
+    find(session, Employee, "code", "010")
+
+    answers("010", "Johnny", "", "john.doe010@example.com", "010")
+    with EmployeeScript() as script:
+        script.update_employee()
+
+    session.expire_all()
+    employee = session.scalars(select(Employee).where(Employee.code == "010")).one()
+    assert employee.first_name == "Johnny"
+    assert employee.email == "john.doe010@example.com"
+
+
+def test_update_device_with_the_current_code(session, answers):
+    add_rows(session)
+    find(session, Device, "code", "001")
+
+    # The current code is rejected as in use, the next answer skips the code.
+    answers("001", "Meeting room laptop", "hp", "", "001", "")
+    with DeviceScript() as script:
+        script.update_device()
+
+    session.expire_all()
+    device = session.scalars(select(Device).where(Device.code == "001")).one()
+    assert device.description == "Meeting room laptop"
+    assert device.brand == BrandType.HP
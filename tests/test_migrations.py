@@ -0,0 +1,69 @@
+import uuid
+
+from sqlalchemy import create_engine, inspect, MetaData, Table, Column, String, DateTime, Enum, ForeignKey
+
+from models import GUID
+from choices import BrandType, DeviceType, UsageCheck
+from migrations import MIGRATIONS, migrate, create_schema, LATEST_VERSION, get_version
+
+
+def first_schema(engine):
+    """The tables of the first release, before any migration."""
+
+    metadata = MetaData()
+    Table("employee", metadata, Column("id", GUID(), primary_key=True, default=uuid.uuid4),
+          Column("first_name", String(128)), Column("last_name", String(128)),
+          Column("email", String(128), unique=True), Column("code", String, unique=True))
+    Table("device", metadata, Column("id", GUID(), primary_key=True, default=uuid.uuid4),
+          Column("description", String), Column("brand", Enum(BrandType), nullable=False),
+          Column("type", Enum(DeviceType), nullable=False), Column("code", String(10), unique=True))
+    Table("usage", metadata, Column("id", GUID(), primary_key=True, default=uuid.uuid4), Column("date", DateTime),
+          Column("employee_id", GUID(), ForeignKey("employee.id")),
+          Column("device_id", GUID(), ForeignKey("device.id", ondelete="CASCADE")),
+          Column("type", Enum(UsageCheck), nullable=False))
+    metadata.create_all(engine)
+
+
+def schema(engine):
+    inspector = inspect(engine)
+    return {
+        table: (
+            sorted(column["name"] for column in inspector.get_columns(table)),
+            sorted(index["name"] for index in inspector.get_indexes(table)),
+            sorted((key["referred_table"], tuple(key["constrained_columns"])) for key in inspector.get_foreign_keys(table)),
+        )
+        for table in inspector.get_table_names()
+    }
+
+
+def test_migrating_the_first_schema_gives_the_current_schema(tmp_path):
+    old = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    new = create_engine(f"sqlite:///{tmp_path / 'new.db'}")
+    first_schema(old)
+
+    applied = migrate(old)
+    create_schema(new)
+
+    assert [version for version, _ in applied] == list(range(1, LATEST_VERSION + 1))
+    with old.connect() as connection:
+        assert get_version(connection) == LATEST_VERSION
+    assert schema(old) == schema(new)
+
+
+def test_a_migration_creates_its_tables_as_they_were_at_its_version(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    first_schema(engine)
+
+    with engine.begin() as connection:
+        for version, _, migration in MIGRATIONS:
+            if version > 6:
+                break
+            migration(connection)
+
+    tables = schema(engine)
+    # The check out time and its indexes come with migration 7, the held time of the rollup with migration 14.
+    assert tables["usage_archive"][:2] == (
+        ["date", "device_id", "employee_id", "id", "type"], ["ix_usage_archive_date", "ix_usage_archive_employee_date"]
+    )
+    assert tables["usage_daily"][0] == ["day", "device_id", "usages"]
+    assert tables["device_holder"][1] == []
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func
+
+from models import Employee, Device, Usage
+from choices import BrandType, DeviceType, UsageCheck
+from reports import refresh_usage_daily, usage_report
+
+NOW = datetime(2024, 3, 10, 12, 0)
+DATE_FROM, DATE_TO = datetime(2024, 3, 2), datetime(2024, 3, 8)
+
+
+def add_usages(session, start, open_usage=True):
+    """Usages of three devices from a start time on, one held across several days and one still open."""
+
+    employee = session.scalars(select(Employee)).first()
+    devices = {device.code: device for device in session.scalars(select(Device))}
+    intervals = [
+        ("001", start, start + timedelta(hours=3)),
+        ("001", start + timedelta(days=1, hours=2), start + timedelta(days=4, hours=5)),
+        ("002", start + timedelta(hours=20), start + timedelta(days=2)),
+        ("003", start + timedelta(days=5, hours=1), None if open_usage else start + timedelta(days=5, hours=4)),
+    ]
+    for code, checked_in_at, checked_out_at in intervals:
+        session.add(Usage(date=checked_in_at, checked_out_at=checked_out_at, employee_id=employee.id,
+                          device_id=devices[code].id,
+                          type=UsageCheck.CHECK_IN if checked_out_at is None else UsageCheck.CHECK_OUT))
+    session.commit()
+
+
+def add_rows(session):
+    session.add(Employee(first_name="John", last_name="Doe", email="john.doe010@example.com", code="010"))
+    session.add_all([
+        Device(description="Laptop", brand=BrandType.DELL, type=DeviceType.COMPUTER, code="001"),
+        Device(description="Printer", brand=BrandType.HP, type=DeviceType.PRINTER, code="002"),
+        Device(description="Phone", brand=BrandType.SAMSUNG, type=DeviceType.PHONE, code="003"),
+    ])
+    session.commit()
+
+
+def raw_totals(session):
+    """Check ins and held seconds per device code in the report range, from the usage table."""
+
+    totals = {}
+    rows = session.execute(select(Device.code, Usage.date, Usage.checked_out_at).join(Device, Device.id == Usage.device_id))
+    for code, checked_in_at, checked_out_at in rows:
+        check_ins, held = totals.get(code, (0, 0))
+        if DATE_FROM <= checked_in_at < DATE_TO:
+            check_ins += 1
+        overlap = (min(checked_out_at or NOW, DATE_TO) - max(checked_in_at, DATE_FROM)).total_seconds()
+        totals[code] = (check_ins, held + max(overlap, 0))
+    return {code: (check_ins, round(held / 3600, 1)) for code, (check_ins, held) in totals.items() if check_ins or held}
+
+
+def test_ranged_report_matches_the_usages(session):
+    add_rows(session)
+    add_usages(session, datetime(2024, 3, 1, 22, 0))
+    refresh_usage_daily(session.connection(), now=NOW)
+    # A later refresh recounts only the lag window, the totals must not change.
+    add_usages(session, datetime(2024, 3, 6, 23, 0), open_usage=False)
+    refresh_usage_daily(session.connection(), lag=timedelta(hours=1), now=NOW)
+
+    rows = usage_report(session.connection(), "device", DATE_FROM, DATE_TO)
+
+    assert {row["Device code"]: (row["Check ins"], row["Held hours"]) for row in rows} == raw_totals(session)
+
+
+def test_ranged_brand_report_counts_the_devices_checked_in(session):
+    add_rows(session)
+    add_usages(session, datetime(2024, 3, 1, 22, 0))
+    refresh_usage_daily(session.connection(), now=NOW)
+
+    rows = usage_report(session.connection(), "brand", DATE_FROM, DATE_TO)
+    checked_in = dict(session.execute(
+        select(Device.brand, func.count(Usage.device_id.distinct()))
+        .join(Device, Device.id == Usage.device_id)
+        .where(Usage.date >= DATE_FROM, Usage.date < DATE_TO)
+        .group_by(Device.brand)
+    ).tuples().all())
+
+    assert {row["Device brand"]: row["Devices checked in"] for row in rows if row["Devices checked in"]} == {
+        brand.value[1]: count for brand, count in checked_in.items()
+    }
@@ -0,0 +1,41 @@
+from sqlalchemy import event
+
+from models import Employee
+from search import search_employees, drop_search_indexes
+
+
+def test_search_reads_the_schema_once(session, database):
+    session.add(Employee(first_name="Anna", last_name="Nowak", email="anna.nowak@example.com", code="010"))
+    session.commit()
+
+    schema_reads = []
+
+    def count_schema_reads(connection, cursor, statement, parameters, context, executemany):
+        if "table_info" in statement or "table_xinfo" in statement or "sqlite_master" in statement:
+            schema_reads.append(statement)
+
+    event.listen(database, "before_cursor_execute", count_schema_reads)
+    try:
+        with database.connect() as connection:
+            first = search_employees(connection, "ann now")
+        with database.connect() as connection:
+            second = search_employees(connection, "ann")
+    finally:
+        event.remove(database, "before_cursor_execute", count_schema_reads)
+
+    assert [row.code for row in first] == [row.code for row in second] == ["010"]
+    assert len(schema_reads) <= 1
+
+
+def test_search_without_the_indexes(session, database):
+    session.add(Employee(first_name="Anna", last_name="Nowak", email="anna.nowak@example.com", code="010"))
+    session.commit()
+    with database.connect() as connection:
+        assert len(search_employees(connection, "ann")) == 1
+
+    with database.begin() as connection:
+        drop_search_indexes(connection)
+
+    # The dropped indexes are not used from the cache, the search falls back to ILIKE.
+    with database.connect() as connection:
+        assert [row.code for row in search_employees(connection, "nowak")] == ["010"]
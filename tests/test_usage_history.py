@@ -0,0 +1,54 @@
+import uuid
+
+from sqlalchemy import text, bindparam
+
+from models import Employee, Device, GUID
+from export import build_query
+from migrations import normalize_usage_times
+from usage import EmployeeUsageScript
+
+
+def add_legacy_usages(session):
+    """Three usages of an employee in the same second, stored as the old CURRENT_TIMESTAMP default did."""
+
+    employee = Employee(first_name="Jessica", last_name="Davis", email="jessica.davis014@example.com", code="014")
+    devices = [Device(description=f"Phone {number}", code=f"00{number}") for number in range(1, 4)]
+    session.add_all([employee, *devices])
+    session.flush()
+    # The dates are written as text, the ids are bound with GUID so they match the GUID_STORAGE of the tables.
+    statement = text(
+        "INSERT INTO usage (id, date, employee_id, device_id, type, checked_out_at) "
+        "VALUES (:id, '2024-01-01 10:00:00', :employee_id, :device_id, 'CHECK_OUT', '2024-01-02 10:00:00')"
+    ).bindparams(*(bindparam(name, type_=GUID()) for name in ("id", "employee_id", "device_id")))
+    for device in devices:
+        session.execute(statement, {"id": uuid.uuid4(), "employee_id": employee.id, "device_id": device.id})
+    normalize_usage_times(session.connection())
+    session.commit()
+    return employee
+
+
+def test_usage_pages_keep_usages_of_the_same_second(session):
+    employee = add_legacy_usages(session)
+
+    with EmployeeUsageScript() as script:
+        script.employee = employee
+        script.options = {"limit": "1"}
+        pages = []
+        while True:
+            rows = script.get_usages_with_device_info().all()
+            if not rows:
+                break
+            pages.extend(rows)
+            script.options = {"limit": "1", "after": rows[-1].date.isoformat(), "after_id": str(rows[-1].id)}
+
+    assert sorted(row.code for row in pages) == ["001", "002", "003"]
+
+
+def test_export_resumes_after_usages_of_the_same_second(session):
+    add_legacy_usages(session)
+    rows = session.execute(build_query({})).all()
+
+    # The export selects the ids as text, or as UUIDs with binary storage.
+    resumed = session.execute(build_query({}, after=(rows[0][1], uuid.UUID(str(rows[0][0]))))).all()
+
+    assert [row[0] for row in resumed] == [row[0] for row in rows[1:]]
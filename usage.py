@@ -1,9 +1,24 @@
+import os
 import sys
-from tabulate import tabulate
-from models import Employee, Device, Usage
-from db import DatabaseConnectionMixin
+import time
+import uuid
+from datetime import datetime
+from sqlalchemy import select, insert, update, delete, text, literal_column, union_all
+from models import Employee, Device, Usage, UsageArchive, DeviceHolder
+from db import DatabaseConnectionMixin, dialect_insert
+from batch import read_scans, apply_scans
+from archive import reaches_archive
+from export import FORMATS, export_usages
+from reports import REPORT_GROUPS, refresh_usage_daily, usage_report
 from choices import UsageCheck
-from settings import tabluate_kwargs
+from cli import parse_options, parse_datetime, parse_uuid, get_limit, print_rows, message_file
+from renderer import OUTPUT_FORMATS, MACHINE_FORMATS
+from readers import read_rows, after_key
+from profiling import profiled
+from lookups import find
+from intervals import holder_at, device_holders, employee_overlaps
+from statements import FORMATS as STATEMENT_FORMATS, write_statements
+from settings import DATABASE_URI
 
 
 class EmployeeUsageScript(DatabaseConnectionMixin):
@@ -16,36 +31,72 @@ class EmployeeUsageScript(DatabaseConnectionMixin):
             "out": self.all_check_out,
             "check_in": self.check_in,
             "check_out": self.check_out,
+            "batch": self.batch,
+            "export": self.export,
+            "report": self.report,
+            "statements": self.statements,
+            "holder": self.holder,
+            "holders": self.holders,
+            "overlaps": self.overlaps,
         }
         self.employee = None
         self.device = None
         self.session = None
+        self.options = {}
+        self.arguments = []
 
     def get_usages_with_device_info(self, search_type=None):
         """
-            Get query usages with device info.
+            Get usages with device info ordered by date.
+
+            The usages are read with a Core select on the connection of the session, as named
+            tuples without ORM instances.
 
             Args:
                 search_type (str | none): The type of usage to search for.
 
+            Options:
+                --after (str): Only usages after this date (keyset pagination).
+                --after-id (str): With --after, also the usages at that date with a greater id, so
+                    usages that share the date of the last printed one are not skipped.
+                --limit (int): The maximum number of usages.
+                --stream: Fetch usages in chunks as they are read.
+
             Returns:
-                query: Returns query with usages and device info.
-        """
-        query = self.session.query(
-            Usage.date,
-            Usage.type,
-            Device.description,
-            Device.brand,
-            Device.type.label('device_type'),
-            Device.code
-        ).join(Device).join(Employee)
-
-        if search_type == 'in':
-            return query.filter(Usage.employee_id == self.employee.id, Usage.type == UsageCheck.CHECK_IN).all()
-        elif search_type == 'out':
-            return query.filter(Usage.employee_id == self.employee.id, Usage.type == UsageCheck.CHECK_OUT).all()
-        else:
-            return query.filter(Usage.employee_id == self.employee.id).all()
+                Result: The rows with usages and device info.
+        """
+        after = parse_datetime(self.options["after"]) if self.options.get("after") else None
+        after_id = parse_uuid(self.options["after_id"]) if after and self.options.get("after_id") else None
+
+        def history(model):
+            query = select(
+                model.id.label('id'),
+                model.date.label('date'),
+                model.type.label('type'),
+                Device.description,
+                Device.brand,
+                Device.type.label('device_type'),
+                Device.code
+            ).join(Device, Device.id == model.device_id).where(model.employee_id == self.employee.id)
+
+            if search_type == 'in':
+                query = query.where(model.type == UsageCheck.CHECK_IN)
+            elif search_type == 'out':
+                query = query.where(model.type == UsageCheck.CHECK_OUT)
+            if after:
+                query = query.where(after_key(model, after, after_id))
+            return query
+
+        query = history(Usage)
+        # The archive only holds closed usages, it is read when the history reaches back into it.
+        if search_type != 'in' and reaches_archive(self.session, after, self.employee.id):
+            query = union_all(query, history(UsageArchive))
+        query = query.order_by(literal_column('date'), literal_column('id'))
+
+        limit = get_limit(self.options)
+        if limit:
+            query = query.limit(limit)
+        return read_rows(self.session.connection(), query, stream=self.options.get("stream"))
 
     def load_employee_and_device(self):
         """Loads an employee and device by code and stores it in a class attribute."""
@@ -57,7 +108,7 @@ class EmployeeUsageScript(DatabaseConnectionMixin):
                     print("Invalid input.")
                     continue
 
-                if self.load_employee(employee_code):
+                if self.load_employee(employee_code, cached=False):
                     chek_employee = False
                     continue
 
@@ -69,146 +120,479 @@ class EmployeeUsageScript(DatabaseConnectionMixin):
                 print("Invalid input.")
                 continue
 
-            device = self.session.query(Device).filter(Device.code == device_code).first()
-            if device is None:
+            if not self.load_device(device_code, cached=False):
                 print(f"Device {device_code} - not found!")
                 continue
-            self.device = device
             break
 
-    def load_employee(self, code):
-        """Loads an employee by code and stores it in a class attribute."""
-        self.employee = self.session.query(Employee).filter(Employee.code == code).first()
+    def load_employee(self, code, cached=True):
+        """
+        Loads an employee by code and stores it in a class attribute.
+
+        Check ins and check outs pass cached=False, so they read the employee from the database.
+        """
+        self.employee = find(self.session, Employee, "code", code, cached=cached)
         return self.employee is not None
 
-    @staticmethod
-    def print_usages(query, all_colums=False):
+    def load_device(self, code, cached=True):
+        """Loads a device by code and stores it in a class attribute, see load_employee."""
+        self.device = find(self.session, Device, "code", code, cached=cached)
+        return self.device is not None
+
+    def print_usages(self, query, all_colums=False):
         """
         Print usages.
 
         Args:
-            query (list): The query to print.
+            query (iterable): The query to print.
             all_colums (bool): If True, all columns will be printed.
 
         Returns:
-            None
+            int: The number of printed usages.
         """
-        if not query:
-            print("No usages found.")
-            return
-
-        data = []
-        for q in query:
-            data_q = [
-                ("Date", q.date),
-                ("Device description", q.description),
-                ("Device brand", q.brand),
-                ("Device type", q.device_type),
-                ("Device code", q.code)
-            ]
-            if all_colums:
-                data_q.insert(1, ("Usages type", q.type.value[1]))
+        last_date, last_id = None, None
+
+        def rows():
+            nonlocal last_date, last_id
+            for q in query:
+                last_date, last_id = q.date, q.id
+                data_q = [
+                    ("Date", q.date),
+                    ("Device description", q.description),
+                    ("Device brand", q.brand),
+                    ("Device type", q.device_type),
+                    ("Device code", q.code)
+                ]
+                if all_colums:
+                    data_q.insert(1, ("Usages type", q.type.value[1]))
+
+                yield dict(data_q)
+
+        count = print_rows(rows(), stream=self.options.get("stream"), output_format=self.options.get("format"),
+                           widths={"Date": 26})
+        limit = get_limit(self.options)
+        if limit and count == limit:
+            print(f"Next page: --after {last_date.isoformat()} --after-id {last_id}", file=message_file(self.options))
+        return count
+
+    def list_usages(self, search_type, all_colums, empty_message):
+        """
+        List usages for an employee.
 
-            data.append(dict(data_q))
+        Args:
+            search_type (str | none): The type of usage to list.
+            all_colums (bool): If True, all columns will be printed.
+            empty_message (str): The message printed when no usages are found.
+        """
+        try:
+            query = self.get_usages_with_device_info(search_type=search_type)
+        except ValueError as error:
+            print(error)
+            return
 
-        print(tabulate(data, **tabluate_kwargs))
+        if not self.print_usages(query, all_colums=all_colums):
+            print(f"{empty_message} {self.employee}", file=message_file(self.options))
 
     def all_usages(self):
         """List all usage for an employee."""
-        query = self.get_usages_with_device_info()
-        if not query:
-            print(f"No usages found for employee {self.employee}")
-            return
-        self.print_usages(query, all_colums=True)
+        self.list_usages(None, all_colums=True, empty_message="No usages found for employee")
 
     def all_check_in(self):
         """List all check in for an employee."""
-        query = self.get_usages_with_device_info(search_type='in')
-        if not query:
-            print(f"No usages check in found for employee {self.employee}")
-            return
-        self.print_usages(query)
+        self.list_usages('in', all_colums=False, empty_message="No usages check in found for employee")
 
     def all_check_out(self):
         """List all check out for an employee code."""
-        query = self.get_usages_with_device_info(search_type='out')
-        if not query:
-            print(f"No usages check out found for employee {self.employee}")
-            return
-        self.print_usages(query)
+        self.list_usages('out', all_colums=False, empty_message="No usages check out found for employee")
 
-    def check_in_or_out(self, prefix, usage=None):
+    def check_in_or_out(self, prefix):
         """
-        Check in or Check out a device.
+        Check in or Check out a device with single atomic statements.
+
+        Check in inserts the open usage with ON CONFLICT DO NOTHING against the unique index of
+        open usages per device, so of two concurrent check ins only one inserts a row.
+        Check out closes the open usage of the employee with a conditional UPDATE ... RETURNING.
+        The device holder row is written in the same transaction.
 
         Args:
-            prefix (str = "checked in" | "checked out"): The prefix to print.
-            usage (Usage | None): The usage to update.
+            prefix (str = "checked in" | "checked out"): The prefix of the message.
 
         Returns:
-            None
+            tuple: (True, message) if the device was checked in or out, otherwise (False, message).
         """
         if prefix == "checked in":
-            self.session.add(
-                Usage(employee_id=self.employee.id, device_id=self.device.id)
+            now = datetime.utcnow()
+            statement = (
+                dialect_insert(self.session, Usage)
+                .values(id=uuid.uuid4(), date=now, employee_id=self.employee.id, device_id=self.device.id,
+                        type=UsageCheck.CHECK_IN)
+                .on_conflict_do_nothing(index_elements=[Usage.device_id],
+                                        index_where=text("type = 'CHECK_IN'"))
+                .returning(Usage.id)
+            )
+            usage_id = self.session.execute(statement).scalar()
+            if usage_id is None:
+                self.session.rollback()
+                return False, f"Device {self.device} - already checked in!"
+
+            self.session.execute(
+                insert(DeviceHolder).values(device_id=self.device.id, employee_id=self.employee.id,
+                                            usage_id=usage_id, since=now)
             )
         elif prefix == "checked out":
-            usage.type = UsageCheck.CHECK_OUT
+            statement = (
+                update(Usage)
+                .where(Usage.device_id == self.device.id, Usage.employee_id == self.employee.id,
+                       Usage.type == UsageCheck.CHECK_IN)
+                .values(type=UsageCheck.CHECK_OUT, checked_out_at=datetime.utcnow())
+                .returning(Usage.id)
+                .execution_options(synchronize_session=False)
+            )
+            if self.session.execute(statement).first() is None:
+                self.session.rollback()
+                return False, f"Employee {self.employee} has not checked in device {self.device}."
+
+            self.session.execute(delete(DeviceHolder).where(DeviceHolder.device_id == self.device.id))
 
+        # The message is built before the commit expires the employee and device, which would reload them.
+        message = f'Employee {self.employee} {prefix} device {self.device}.'
         self.session.commit()
-        print(f'Employee {self.employee} {prefix} device {self.device}.')
+        return True, message
+
+    def check_in_device(self):
+        """
+        Check in the loaded device for the loaded employee if the device is free.
+
+        Returns:
+            tuple: (True, message) if the device was checked in, otherwise (False, message).
+        """
+        return self.check_in_or_out(prefix="checked in")
+
+    def check_out_device(self):
+        """
+        Check out the loaded device if the loaded employee holds it.
+
+        Returns:
+            tuple: (True, message) if the device was checked out, otherwise (False, message).
+        """
+        return self.check_in_or_out(prefix="checked out")
 
     def check_in(self):
         """Check in a device."""
         self.load_employee_and_device()
-
-        if self.session.query(Usage).filter(Usage.device_id == self.device.id,
-                                            Usage.type == UsageCheck.CHECK_IN).first():
-            print(f"Device {self.device} - already checked in!")
-            return
-
-        self.check_in_or_out(prefix="checked in")
+        print(self.check_in_device()[1])
 
     def check_out(self):
         """Check out all device for Employee."""
         self.load_employee_and_device()
-        usage = self.session.query(Usage).filter(Usage.device_id == self.device.id,
-                                                 Usage.employee_id == self.employee.id,
-                                                 Usage.type == UsageCheck.CHECK_IN).first()
-        if usage is None:
-            print(f"Employee {self.employee} has not checked in device {self.device}.")
+        print(self.check_out_device()[1])
+
+    def batch(self):
+        """
+        Check in and check out devices from a scan file or stdin in one transaction.
+
+        Every line has employee_code,device_code,action where action is check_in or check_out.
+        The result of every line is printed as a table row, or as CSV, TSV or JSONL with --format.
+        """
+        path = self.arguments[0] if self.arguments else "-"
+
+        try:
+            if path == "-":
+                results = apply_scans(self.session, read_scans(sys.stdin))
+            else:
+                with open(path, newline="", encoding="utf-8") as file:
+                    results = apply_scans(self.session, read_scans(file))
+        except (OSError, ValueError) as error:
+            print(error)
+            return
+
+        rows = (
+            {"Line": line_number, "Result": "OK" if ok else "REJECTED", "Message": message}
+            for line_number, ok, message in results
+        )
+        print_rows(rows, stream=True, output_format=self.options.get("format"))
+        accepted = sum(ok for _, ok, _ in results)
+        print(f"Accepted {accepted} scans, rejected {len(results) - accepted} scans.", file=message_file(self.options))
+
+    def export(self):
+        """
+        Export usages with employee and device info to CSV or JSONL.
+
+        Options:
+            --from, --to (str): The date range, --to is exclusive.
+            --employee, --device (str): Only usages of this employee or device code.
+            --type (str): in | out.
+            --format (str): csv | jsonl, csv by default.
+            --gzip: Compress the output.
+            --output (str): The output file, stdout if not set.
+            --resume: Continue an interrupted export of the output file.
+        """
+        export_format = self.options.get("format", "csv")
+        output = self.options.get("output")
+        # Without --output the data goes to stdout, messages go to stderr.
+        messages = sys.stdout if output else sys.stderr
+
+        try:
+            filters = {
+                "from": parse_datetime(self.options["from"]) if self.options.get("from") else None,
+                "to": parse_datetime(self.options["to"]) if self.options.get("to") else None,
+                "employee": self.options.get("employee"),
+                "device": self.options.get("device"),
+                "type": self.options.get("type"),
+            }
+            if export_format not in FORMATS:
+                raise ValueError(f"Invalid format: {export_format}. Valid formats: {', '.join(FORMATS)}.")
+            if filters["type"] not in (None, "in", "out"):
+                raise ValueError(f"Invalid type: {filters['type']}. Valid types: in, out.")
+            if self.options.get("resume") and not output:
+                raise ValueError("--resume requires --output.")
+
+            rows = export_usages(
+                self.session.connection(), filters, export_format, output,
+                compress=bool(self.options.get("gzip")), resume=bool(self.options.get("resume")),
+            )
+        except (ValueError, OSError) as error:
+            print(error, file=messages)
             return
 
-        self.check_in_or_out(prefix="checked out", usage=usage)
+        print(f"Exported {rows} usages{f' to {output}' if output else ''}.", file=messages)
 
+    def report(self):
+        """
+        Print the check ins and held hours by day, device, brand or device type from the usage rollup.
 
-def run():
-    """This function runs the script."""
+        The rollup is brought up to date first, the days since shortly before the last report are recounted.
 
-    slash = 100
-    print("-" * slash + "\n")
+        Options:
+            --by (str): day | device | brand | type, device by default.
+            --from, --to (str): The date range, --to is exclusive.
+            --rebuild: Rebuild the rollup from the whole usage history, e.g. after a backfill.
+            --format (str): table | csv | tsv | jsonl.
+        """
+        by = self.options.get("by", "device")
+        try:
+            if by not in REPORT_GROUPS:
+                raise ValueError(f"Invalid group: {by}. Valid groups: {', '.join(REPORT_GROUPS)}.")
+            date_from = parse_datetime(self.options["from"]) if self.options.get("from") else None
+            date_to = parse_datetime(self.options["to"]) if self.options.get("to") else None
+        except ValueError as error:
+            print(error, file=message_file(self.options))
+            return
 
-    if len(sys.argv) < 2:
+        connection = self.session.connection()
+        refreshed = refresh_usage_daily(connection, rebuild=bool(self.options.get("rebuild")))
+        self.session.commit()
+        if self.options.get("rebuild"):
+            print(f"Rollup rebuilt: {refreshed} device days.", file=message_file(self.options))
+
+        rows = usage_report(self.session.connection(), by, date_from, date_to)
+        if not print_rows(rows, output_format=self.options.get("format")):
+            print("No usages found.", file=message_file(self.options))
+
+    def statements(self):
+        """
+        Write a usage statement for every employee, one file per employee code.
+
+        The employees are split into ranges of codes that worker processes read with their own
+        read-only connection, one ordered scan per range.
+
+        Options:
+            --output (str): The directory of the statements.
+            --from, --to (str): The date range, --to is exclusive.
+            --format (str): csv | jsonl, csv by default.
+            --workers (int): The number of worker processes, the number of CPUs by default.
+        """
+        export_format = self.options.get("format", "csv")
+        output = self.options.get("output")
+        try:
+            if not output:
+                raise ValueError("Enter the directory of the statements with --output.")
+            if export_format not in STATEMENT_FORMATS:
+                raise ValueError(f"Invalid format: {export_format}. Valid formats: {', '.join(STATEMENT_FORMATS)}.")
+            workers = self.options.get("workers", os.cpu_count() or 1)
+            if not str(workers).isdigit() or int(workers) < 1:
+                raise ValueError(f"Invalid workers: {workers}. The number of workers must be a positive number.")
+            date_from = parse_datetime(self.options["from"]) if self.options.get("from") else None
+            date_to = parse_datetime(self.options["to"]) if self.options.get("to") else None
+        except ValueError as error:
+            print(error)
+            return
+
+        connection = self.session.connection()
+        started = time.perf_counter()
+        try:
+            statements, usages = write_statements(
+                connection, DATABASE_URI, output, export_format, date_from, date_to,
+                archive=reaches_archive(connection, date_from), workers=int(workers),
+            )
+        except OSError as error:
+            print(error)
+            return
+
+        print(f"Wrote {statements} statements with {usages} usages to {output} "
+              f"in {time.perf_counter() - started:.1f} s with {workers} workers.")
+
+    def print_intervals(self, usages, empty_message):
+        """
+        Print usages as check in / check out intervals.
+
+        Args:
+            usages (iterable): (employee_code, device_code, checked_in_at, checked_out_at) rows.
+            empty_message (str): The message printed when no usages are found.
+        """
+        rows = (
+            {
+                "Employee code": usage.employee_code,
+                "Device code": usage.device_code,
+                "Checked in": usage.checked_in_at,
+                "Checked out": usage.checked_out_at,
+            }
+            for usage in usages
+        )
+        if not print_rows(rows, output_format=self.options.get("format")):
+            print(empty_message, file=message_file(self.options))
+
+    def date_range(self):
+        """
+        Reads the --from and --to options.
+
+        Returns:
+            tuple: (from, to) datetimes, None where not set.
+
+        Raises:
+            ValueError: If a date is not valid.
+        """
+        date_from = parse_datetime(self.options["from"]) if self.options.get("from") else None
+        date_to = parse_datetime(self.options["to"]) if self.options.get("to") else None
+        return date_from, date_to
+
+    def load_device_argument(self):
+        """Loads the device of the first argument, returns False after printing why it failed."""
+        if not self.arguments:
+            print("Enter a device code.", file=message_file(self.options))
+            return False
+        if not self.load_device(self.arguments[0]):
+            print(f"Device {self.arguments[0]} - not found!", file=message_file(self.options))
+            return False
+        return True
+
+    def holder(self):
+        """
+        Print who held a device at a time.
+
+        Options:
+            --at (str): The time (UTC), now if not set.
+            --format (str): table | csv | tsv | jsonl.
+        """
+        try:
+            at = parse_datetime(self.options["at"]) if self.options.get("at") else datetime.utcnow()
+        except ValueError as error:
+            print(error, file=message_file(self.options))
+            return
+        if not self.load_device_argument():
+            return
+
+        usage = holder_at(self.session.connection(), self.device.id, at)
+        self.print_intervals([usage] if usage else [], f"Device {self.device} was not checked in at {at.isoformat()}.")
+
+    def holders(self):
+        """
+        Print who held a device in a time range.
+
+        Options:
+            --from, --to (str): The time range (UTC), --to is exclusive.
+            --format (str): table | csv | tsv | jsonl.
+        """
+        try:
+            date_from, date_to = self.date_range()
+        except ValueError as error:
+            print(error, file=message_file(self.options))
+            return
+        if not self.load_device_argument():
+            return
+
+        usages = device_holders(self.session.connection(), self.device.id, date_from, date_to)
+        self.print_intervals(usages, f"No usages found for device {self.device}")
+
+    def overlaps(self):
+        """
+        Print the devices an employee held at any time in a time range.
+
+        Options:
+            --from, --to (str): The time range (UTC), --to is exclusive.
+            --format (str): table | csv | tsv | jsonl.
+        """
+        if self.employee is None:
+            print("Enter an employee code.", file=message_file(self.options))
+            return
+        try:
+            date_from, date_to = self.date_range()
+        except ValueError as error:
+            print(error, file=message_file(self.options))
+            return
+
+        usages = employee_overlaps(self.session.connection(), self.employee.id, date_from, date_to)
+        self.print_intervals(usages, f"No usages found for employee {self.employee}")
+
+
+def run(argv=None):
+    """
+    This function runs the script.
+
+    Args:
+        argv (list | None): The command line with the script name, sys.argv if None.
+    """
+    argv = sys.argv if argv is None else argv
+
+    slash = 100
+    args, options = parse_options(argv[1:])
+    command = args[0].lower() if args else ""
+    # An export to stdout and the machine readable formats write only the data to stdout.
+    if command == "export":
+        banner = bool(options.get("output"))
+    else:
+        banner = options.get("format") not in MACHINE_FORMATS
+
+    if banner:
+        print("-" * slash + "\n")
+
+    if len(argv) < 2:
         print("usage.py comands:"
-              "\n all | in | out | check_in [employee_code] | check_out [employee_code]")
+              "\n all | in | out | check_in [employee_code] | check_out [employee_code]"
+              "\n batch [scan file, stdin if not set]"
+              "\n export [--from DATE] [--to DATE] [--employee CODE] [--device CODE] [--type in | out]"
+              "\n        [--format csv | jsonl] [--gzip] [--output FILE [--resume]]"
+              "\n report [--by day | device | brand | type] [--from DATE] [--to DATE] [--rebuild]"
+              "\n statements --output DIR [--from DATE] [--to DATE] [--format csv | jsonl] [--workers N]"
+              "\n holder [device_code] [--at DATE] | holders [device_code] [--from DATE] [--to DATE]"
+              "\n overlaps [employee_code] [--from DATE] [--to DATE]"
+              "\n all | in | out options: [--limit N] [--after DATE [--after-id ID]] [--stream]"
+              "\n all | in | out | batch | report | holder | holders | overlaps options: [--format table | csv | tsv | jsonl]"
+              "\n [--profile | --profile=json] prints where the time of a command goes")
         return
 
-    command = sys.argv[1].lower()
+    if command not in ("export", "statements") and options.get("format") not in (None, *OUTPUT_FORMATS):
+        print(f"Invalid format: {options['format']}. Valid formats: {', '.join(OUTPUT_FORMATS)}.")
+        return
 
-    with EmployeeUsageScript() as eus:
+    with profiled(options.get("profile"), f"usage {' '.join(args)}"), EmployeeUsageScript() as eus:
+        eus.options = options
+        eus.arguments = args[1:]
         if command not in eus.commands:
-            print(f"Invalid command: {command}, valid commands: \n all | in | out | check_in [employee_code] | check_out [employee_code]")
+            print(f"Invalid command: {command}, valid commands: \n all | in | out | check_in [employee_code] | check_out [employee_code] | batch [file] | export | report | statements"
+                  " | holder [device_code] | holders [device_code] | overlaps [employee_code]")
             return
 
-        if len(sys.argv) == 3:
-            code = sys.argv[2]
+        if len(args) == 2 and command not in ("batch", "export", "report", "statements", "holder", "holders"):
+            code = args[1]
             if not eus.load_employee(code):
                 print(f"Employee {code} not found!")
                 return
 
         eus.commands[command]()
 
-        print("\n" + "-" * slash)
+        if banner:
+            print("\n" + "-" * slash)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,46 @@
+import re
+
+EMAIL_PATTERN = r"(^[a-z0-9_.+-]+@[a-z0-9-]+\.[a-z]+$)"
+
+
+def name_error(key, value):
+    """
+    Checks if the name is valid.
+
+    Args:
+        key (str): The name of the field (First name or Last name).
+        value (str): The name to check.
+
+    Returns:
+        str | None: Returns the error message if the name is invalid, otherwise None.
+    """
+
+    value = value.strip()
+
+    if len(value) < 3:
+        return f"{key} must be longer than 2 characters."
+
+    if any(char.isdigit() for char in value):
+        return f"{key} cannot contain numbers."
+
+    if re.search(r'[!@#$%^&*(),.?":{}|<>]', value):
+        return f"{key} cannot contain special characters."
+
+    return None
+
+
+def email_error(email):
+    """
+    Checks if the email address has a valid format.
+
+    Args:
+        email (str): The email address to check.
+
+    Returns:
+        str | None: Returns the error message if the email is invalid, otherwise None.
+    """
+
+    if not re.match(EMAIL_PATTERN, email):
+        return "This is not a valid email format. Please try again."
+
+    return None